@@ -1,74 +1,100 @@
-from flask import Flask, request, jsonify, render_template, send_file
+from flask import (
+    Blueprint, Flask, Response, current_app, request, jsonify, render_template, send_file, stream_with_context
+)
 import requests
-import pandas as pd
 import io
-import sqlite3
-from datetime import datetime, timedelta
+from datetime import datetime
 import os
-from database import init_db
+from arquivamento import Arquivador, LoteArquivado
+from database import init_db, COLUNAS_RESULTADO, PROXIMO_SEQ, SELECT_RESULTADO, colunas_resultado, formatar_linha
+from cache_resultados import CacheResultados
+from credenciais import Credencial, PoolCredenciais, falha_de_credencial, ler_credenciais
+from http_client import cliente_http
+from ingestao import ingerir_cpfs, ler_cpfs
+from limitador import CircuitoAberto, DisjuntorCircuito
+from eventos import DifusorEventos
+from log_estruturado import configurar_logs, corpo_resposta
+from exportacao import FORMATOS, ExportadorLotes
+from lotes import MotorLotes
+from metricas import registro
+from persistencia import Persistencia
+from reprocessamento import FilaReprocessamento
+from token_manager import CredencialRecusada, FalhaToken, GerenciadorToken
 from concurrent.futures import ThreadPoolExecutor
-from queue import Queue
-import threading
+import logging
 import time
 
-app = Flask(__name__)
+rotas = Blueprint("fgts", __name__)
+
+# Nome fixo: rodando como script o módulo seria __main__ e LOG_NIVEIS=app=... não pegaria.
+log = logging.getLogger("app")
 
 parar_execucao = False
-token_atual = None
-token_expira_em = None
 
-TOKEN_URL = "https://webservice.facta.com.br/gera-token"
-TOKEN_AUTH_HEADER = "Basic OTY1NTI6ZjRzaXV0azJ1ZWNhNDVldXhnOXc="
-API_URL = "https://webservice.facta.com.br/consignado-trabalhador/autoriza-consulta"
+TOKEN_URL = os.environ.get("FACTA_TOKEN_URL", "https://webservice.facta.com.br/gera-token")
+TOKEN_AUTH_HEADER = os.environ.get("FACTA_AUTH_HEADER", "Basic OTY1NTI6ZjRzaXV0azJ1ZWNhNDVldXhnOXc=")
+# Contas contratadas, cada uma com token, limitador e disjuntor próprios: "conta1=Basic xxx,conta2=Basic yyy".
+FACTA_CREDENCIAIS = os.environ.get("FACTA_CREDENCIAIS", "")
+API_URL = os.environ.get(
+    "FACTA_API_URL", "https://webservice.facta.com.br/consignado-trabalhador/autoriza-consulta"
+)
 
 DB_FILE = "consultas.db"
 RESULT_FOLDER = "resultados"
-os.makedirs(RESULT_FOLDER, exist_ok=True)
-os.makedirs("recuperacoes", exist_ok=True)
 
-executor = ThreadPoolExecutor(max_workers=3)
-fila_reprocessamento = Queue()
-tentativas_reprocessamento = {}
+LOTE_MAX_WORKERS = int(os.environ.get("LOTE_MAX_WORKERS", "32"))
+LOTE_CONCORRENCIA = int(os.environ.get("LOTE_CONCORRENCIA", "16"))
+DISJUNTOR_ESPERA_MAXIMA = float(os.environ.get("DISJUNTOR_ESPERA_MAXIMA", "60"))
+LOTE_FOLGA_LIMITADOR = int(os.environ.get("LOTE_FOLGA_LIMITADOR", "2"))
+
+executor = ThreadPoolExecutor(max_workers=LOTE_MAX_WORKERS)
 MAX_TENTATIVAS = 3
 
-def gerar_token():
-    global token_atual, token_expira_em
-    try:
-        resp = requests.get(
-            TOKEN_URL,
-            headers={"Authorization": TOKEN_AUTH_HEADER, "Accept": "application/json"},
-            timeout=10
-        )
-        resp.raise_for_status()
-        data = resp.json()
-        novo_token = data.get("token")
-        if not novo_token:
-            raise RuntimeError(f"Não recebi token. Resposta: {resp.text}")
-        token_atual = novo_token
-        token_expira_em = datetime.now() + timedelta(minutes=59)
-        print(f"token gerado: {token_atual[:15]}... válido até {token_expira_em.strftime('%H:%M:%S')}")
-        return token_atual
-    except Exception as e:
-        print(f"Erro ao gerar token: {e}")
-        token_atual = None
-        token_expira_em = None
-        raise
+ERROS_TRANSITORIOS = (requests.ConnectionError, requests.Timeout, CircuitoAberto, FalhaToken)
+
+FACTA_ESPERA = registro.histograma(
+    "facta_espera_segundos", "Espera por disjuntor e vaga no limitador antes de chamar a Facta."
+)
+CPFS_PROCESSADOS = registro.contador(
+    "cpfs_processados_total", "CPFs processados por origem (facta/cache) e status.", ("origem", "status")
+)
+
+persistencia = Persistencia(DB_FILE)
+
+difusor_eventos = DifusorEventos(persistencia)
+
+cache_resultados = CacheResultados(persistencia)
 
-def garantir_token():
-    global token_atual, token_expira_em
-    if token_atual is None or token_expira_em is None:
-        return gerar_token()
-    if datetime.now() >= token_expira_em:
-        return gerar_token()
-    return token_atual
+arquivador = Arquivador(persistencia)
 
-init_db()
+exportador = ExportadorLotes(persistencia, RESULT_FOLDER, arquivo=arquivador)
 
-@app.route("/")
+credenciais_facta = PoolCredenciais(
+    Credencial(nome, GerenciadorToken(DB_FILE, cliente_http, TOKEN_URL, cabecalho, chave=nome))
+    for nome, cabecalho in ler_credenciais(FACTA_CREDENCIAIS, TOKEN_AUTH_HEADER)
+)
+
+@rotas.route("/")
 def index():
     return render_template("index.html")
 
-@app.route("/registrar-lote", methods=["POST"])
+def registrar_cpfs(lote_id, cpfs):
+    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    agora = time.time()
+    rows = [(cpf, "Pendente", ts, lote_id, agora) for cpf in cpfs]
+
+    def gravar(c):
+        # Conferido dentro da transação do escritor: o arquivamento registra o lote nela também.
+        if lote_id and c.execute("SELECT 1 FROM lotes_arquivados WHERE lote_id = ?", (lote_id,)).fetchone():
+            raise LoteArquivado(f"Lote {lote_id} já foi arquivado; use outro lote_id")
+        return c.executemany(
+            "INSERT OR IGNORE INTO consultas (cpf, status, data, lote_id, atualizado_em, seq) "
+            f"VALUES (?, ?, ?, ?, ?, {PROXIMO_SEQ})", rows
+        ).rowcount
+
+    return persistencia.executar(gravar).result()
+
+@rotas.route("/registrar-lote", methods=["POST"])
 def registrar_lote():
     data = request.get_json(silent=True) or {}
     cpfs = data.get("cpfs", [])
@@ -77,138 +103,301 @@ def registrar_lote():
     if not lote_id or not isinstance(cpfs, list) or not cpfs:
         return jsonify({"erro": "lote_id e lista de cpfs são obrigatórios"}), 400
 
-    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     try:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_consultas_cpf_lote ON consultas(cpf, lote_id)")
-        rows = [(cpf, "Pendente", ts, lote_id) for cpf in cpfs]
-        c.executemany(
-            "INSERT OR IGNORE INTO consultas (cpf, resultado, data, lote_id) VALUES (?, ?, ?, ?)", rows
+        total = registrar_cpfs(lote_id, cpfs)
+        return jsonify({"ok": True, "lote_id": lote_id, "total_registrados": total})
+    except LoteArquivado as e:
+        return jsonify({"erro": str(e)}), 409
+    except Exception as e:
+        return jsonify({"erro": str(e)}), 500
+
+def inteiro_opcional(valor, campo):
+    # JSON traz int e formulário traz texto; bool também é int em Python, mas não vale aqui.
+    if valor is None or valor == "":
+        return None
+    if isinstance(valor, str) and valor.strip().lstrip("-").isdigit():
+        return int(valor)
+    if isinstance(valor, int) and not isinstance(valor, bool):
+        return valor
+    raise ValueError(f"{campo} deve ser um número inteiro")
+
+@rotas.route("/importar-lote", methods=["POST"])
+def importar_lote():
+    arquivo = request.files.get("arquivo")
+    lote_id = request.form.get("lote_id")
+
+    if not lote_id or arquivo is None:
+        return jsonify({"erro": "lote_id e arquivo são obrigatórios"}), 400
+    try:
+        concorrencia = inteiro_opcional(request.form.get("concorrencia"), "concorrencia")
+        prioridade = inteiro_opcional(request.form.get("prioridade"), "prioridade")
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 400
+
+    try:
+        valores = ler_cpfs(arquivo.stream, arquivo.filename)
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 400
+
+    try:
+        relatorio = ingerir_cpfs(valores, lambda cpfs: registrar_cpfs(lote_id, cpfs))
+        resposta = {"ok": True, "lote_id": lote_id, **relatorio}
+        if request.form.get("iniciar") in ("1", "true"):
+            motor_lotes.iniciar(lote_id, concorrencia, prioridade)
+            resposta["progresso"] = motor_lotes.progresso(lote_id)
+        log.info(
+            "Lote importado",
+            extra={
+                "lote_id": lote_id,
+                "registrados": relatorio["registrados"],
+                "chamadas_evitadas": relatorio["chamadas_evitadas"],
+            },
         )
-        conn.commit()
-        conn.close()
-        return jsonify({"ok": True, "lote_id": lote_id, "total_registrados": len(rows)})
+        return jsonify(resposta)
+    except LoteArquivado as e:
+        return jsonify({"erro": str(e)}), 409
     except Exception as e:
         return jsonify({"erro": str(e)}), 500
 
-def worker_reprocessar():
-    print("Worker de reprocessamento iniciado e aguardando CPFs...")
-    while True:
-        try:
-            if not fila_reprocessamento.empty():
-                cpf, lote_id = fila_reprocessamento.get()
-                tentativas = tentativas_reprocessamento.get(cpf, 0) + 1
-
-                if tentativas > MAX_TENTATIVAS:
-                    print(f"⚠️ CPF {cpf} atingiu o máximo de {MAX_TENTATIVAS} tentativas.")
-                    conn = sqlite3.connect(DB_FILE)
-                    c = conn.cursor()
-                    c.execute("SELECT resultado FROM consultas WHERE cpf=? AND lote_id=?", (cpf, lote_id))
-                    row = c.fetchone()
-                    resultado_antigo = row[0] if row else ""
-                    novo_resultado = (
-                        f"{resultado_antigo}, "
-                        f"Status: Falhou após {MAX_TENTATIVAS} tentativas, "
-                        f"Mensagem: Base offline ou erro de conexão"
-                    )
-                    c.execute(
-                        "UPDATE consultas SET resultado=?, data=? WHERE cpf=? AND lote_id=?",
-                        (novo_resultado, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), cpf, lote_id)
-                    )
-                    conn.commit()
-                    conn.close()
-                    time.sleep(5)
-                    continue
-
-                tentativas_reprocessamento[cpf] = tentativas
-                print(f" Reprocessando CPF {cpf} (tentativa {tentativas}/{MAX_TENTATIVAS})...")
-
-                token = garantir_token()
-                try:
-                    response = requests.get(
-                        API_URL,
-                        headers={"Authorization": f"Bearer {token}", "Accept": "application/json"},
-                        params={"cpf": cpf},
-                        timeout=15,
-                    )
-
-                    if response.status_code == 200:
-                        resp_json = response.json()
-                        msg = resp_json.get("mensagem", "")
-                        dados_trab = resp_json.get("dados_trabalhador", {}).get("dados", [])
-
-                        if dados_trab:
-                            info = dados_trab[0]
-                            resultado_str = (
-                                f"Nome: {info.get('nome','-')}, "
-                                f"Data Nascimento: {info.get('dataNascimento','-')}, "
-                                f"Data Admissao: {info.get('dataAdmissao','-')}, "
-                                f"Valor Liberado: {info.get('valorTotalVencimentos','-')}, "
-                                f"Margem: {info.get('valorMargemDisponivel','-')}, "
-                                f"Elegível: {info.get('elegivel','-')}, "
-                                f"Status: {'Autorizado' if info.get('elegivel') == 'SIM' or 'autorizado' in msg.lower() else 'Não autorizado'}, "
-                                f"Mensagem: {msg}"
-                            )
-
-                            conn = sqlite3.connect(DB_FILE)
-                            c = conn.cursor()
-                            c.execute(
-                                "UPDATE consultas SET resultado=?, data=? WHERE cpf=? AND lote_id=?",
-                                (resultado_str, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), cpf, lote_id)
-                            )
-                            conn.commit()
-                            conn.close()
-                            print(f"CPF {cpf} reprocessado com sucesso!")
-                        else:
-                            print(f" CPF {cpf} ainda sem dados — voltará para a fila (tentativa {tentativas}/{MAX_TENTATIVAS}).")
-                            fila_reprocessamento.put((cpf, lote_id))
-
-                    else:
-                        print(f" HTTP {response.status_code} ao reprocessar {cpf} — voltará para a fila.")
-                        conn = sqlite3.connect(DB_FILE)
-                        c = conn.cursor()
-                        c.execute("SELECT resultado FROM consultas WHERE cpf=? AND lote_id=?", (cpf, lote_id))
-                        row = c.fetchone()
-                        resultado_antigo = row[0] if row else ""
-                        novo_resultado = f"{resultado_antigo}, Mensagem: Erro HTTP {response.status_code} no reprocessamento"
-                        c.execute(
-                            "UPDATE consultas SET resultado=?, data=? WHERE cpf=? AND lote_id=?",
-                            (novo_resultado, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), cpf, lote_id)
-                        )
-                        conn.commit()
-                        conn.close()
-                        fila_reprocessamento.put((cpf, lote_id))
-
-                except Exception as e:
-                    print(f"Erro ao reprocessar {cpf}: {e}")
-                    conn = sqlite3.connect(DB_FILE)
-                    c = conn.cursor()
-                    c.execute("SELECT resultado FROM consultas WHERE cpf=? AND lote_id=?", (cpf, lote_id))
-                    row = c.fetchone()
-                    resultado_antigo = row[0] if row else ""
-                    novo_resultado = f"{resultado_antigo}, Mensagem: Erro reprocessando ({e})"
-                    c.execute(
-                        "UPDATE consultas SET resultado=?, data=? WHERE cpf=? AND lote_id=?",
-                        (novo_resultado, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), cpf, lote_id)
-                    )
-                    conn.commit()
-                    conn.close()
-                    fila_reprocessamento.put((cpf, lote_id))
-
-                time.sleep(15)
+def extrair_dados_trabalhador(info, msg):
+    return {
+        "nome": info.get("nome") or "-",
+        "data_nascimento": info.get("dataNascimento") or "-",
+        "data_admissao": info.get("dataAdmissao") or "-",
+        "valor_liberado": info.get("valorTotalVencimentos") or "-",
+        "margem": info.get("valorMargemDisponivel") or "-",
+        "elegivel": info.get("elegivel") or "-",
+        "mensagem": msg,
+        "status": "Autorizado" if info.get("elegivel") == "SIM" or "autorizado" in msg.lower() else "Não autorizado"
+    }
+
+def gravar_resultado(cpf, lote_id, resultado, consultado_em=None):
+    ts_now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    valores = colunas_resultado(resultado)
+    colunas = ", ".join(COLUNAS_RESULTADO)
+    marcadores = ", ".join("?" for _ in COLUNAS_RESULTADO)
+
+    def gravar(c):
+        agora = time.time()
+        rows = []
+        if lote_id:
+            rows = c.execute(
+                f"UPDATE consultas SET {', '.join(f'{k}=?' for k in COLUNAS_RESULTADO)}, data=?, "
+                f"atualizado_em=?, consultado_em=?, lease_dono=NULL, lease_expira=NULL, "
+                f"seq={PROXIMO_SEQ} WHERE cpf=? AND lote_id=? "
+                f"RETURNING seq, {SELECT_RESULTADO}",
+                valores + (ts_now, agora, consultado_em, cpf, lote_id)
+            ).fetchall()
+        if not rows:
+            rows = c.execute(
+                f"INSERT INTO consultas (cpf, data, lote_id, atualizado_em, consultado_em, seq, {colunas}) "
+                f"VALUES (?, ?, ?, ?, ?, {PROXIMO_SEQ}, {marcadores}) RETURNING seq, {SELECT_RESULTADO}",
+                (cpf, ts_now, lote_id, agora, consultado_em) + valores
+            ).fetchall()
+        return [(row[0], row[1:]) for row in rows]
+
+    return difusor_eventos.publicar_apos_commit(persistencia.executar(gravar), lote_id)
+
+def atualizar_status(cpf, lote_id, status=None, mensagem=None):
+    def gravar(c):
+        rows = c.execute(
+            "UPDATE consultas SET status=COALESCE(?, status), mensagem=?, data=?, atualizado_em=?, "
+            f"seq={PROXIMO_SEQ} WHERE cpf=? AND lote_id=? RETURNING seq, {SELECT_RESULTADO}",
+            (status, mensagem, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), time.time(), cpf, lote_id)
+        ).fetchall()
+        return [(row[0], row[1:]) for row in rows]
+
+    return difusor_eventos.publicar_apos_commit(persistencia.executar(gravar), lote_id)
+
+def consultar_facta(cpf, token):
+    return cliente_http.get(
+        API_URL,
+        headers={"Authorization": f"Bearer {token}", "Accept": "application/json"},
+        params={"cpf": cpf},
+        timeout=15,
+    )
+
+def token_rejeitado(response):
+    if response.status_code in (401, 403):
+        return True
+    if response.status_code != 200:
+        return False
+    try:
+        mensagem = response.json().get("mensagem", "")
+    except ValueError:
+        return False
+    return str(mensagem).lower().startswith("token inválido")
+
+def chamar_api(cpf):
+    espera = time.perf_counter()
+    try:
+        credencial = credenciais_facta.adquirir(DISJUNTOR_ESPERA_MAXIMA)
+    finally:
+        FACTA_ESPERA.observar(time.perf_counter() - espera)
+
+    inicio = time.perf_counter()
+    resultado = "erro"
+    try:
+        token = credencial.token.obter()
+        response = consultar_facta(cpf, token)
+        if token_rejeitado(response):
+            log.info("Token inválido, aguardando renovação", extra={"cpf": cpf, "credencial": credencial.nome})
+            token = credencial.token.renovar(token_invalido=token)
+            response = consultar_facta(cpf, token)
+            if token_rejeitado(response):
+                # Vira erro transitório: o CPF volta pela fila e cai em outra credencial.
+                raise CredencialRecusada(f"Token recusado pela Facta (credencial {credencial.nome})")
+        resultado = "429" if response.status_code == 429 else "erro" if response.status_code >= 500 else "ok"
+        return response
+    except Exception as e:
+        if falha_de_credencial(e):
+            resultado = "auth"
+        raise
+    finally:
+        credenciais_facta.liberar(credencial, time.perf_counter() - inicio, resultado)
+
+def resposta_transitoria(response):
+    return response.status_code == 429 or response.status_code >= 500
+
+def reprocessar_cpf(cpf, lote_id, tentativas):
+    try:
+        response = chamar_api(cpf)
+
+        if response.status_code == 200:
+            resp_json = response.json()
+            msg = resp_json.get("mensagem", "")
+            dados_trab = resp_json.get("dados_trabalhador", {}).get("dados", [])
+
+            if dados_trab:
+                resultado = extrair_dados_trabalhador(dados_trab[0], msg)
+                consultado_em = time.time()
+                gravar_resultado(cpf, lote_id, resultado, consultado_em).result()
+                cache_resultados.guardar(cpf, resultado, consultado_em)
+                log.info(
+                    "CPF reprocessado com sucesso", extra={"cpf": cpf, "lote_id": lote_id, "tentativa": tentativas}
+                )
+                return True, None
+
+            log.info(
+                "CPF ainda sem dados, volta para a fila",
+                extra={"cpf": cpf, "lote_id": lote_id, "tentativa": tentativas},
+            )
+            return False, msg or "Sem dados retornados"
+
+        log.warning(
+            "Erro HTTP no reprocessamento, volta para a fila",
+            extra={"cpf": cpf, "lote_id": lote_id, "tentativa": tentativas, "status_http": response.status_code},
+        )
+        erro = f"Erro HTTP {response.status_code} no reprocessamento"
 
+    except Exception as e:
+        log.warning(
+            "Erro ao reprocessar CPF", extra={"cpf": cpf, "lote_id": lote_id, "tentativa": tentativas, "erro": str(e)}
+        )
+        erro = f"Erro reprocessando ({e})"
+
+    atualizar_status(cpf, lote_id, f"Reprocessando ({tentativas}/{MAX_TENTATIVAS})", erro)
+    return False, erro
+
+def desistir_reprocessamento(cpf, lote_id, tentativas, erro):
+    atualizar_status(
+        cpf, lote_id,
+        f"Falhou após {tentativas} tentativas",
+        "Base offline ou erro de conexão"
+    )
+
+fila_reprocessamento = FilaReprocessamento(
+    persistencia, reprocessar_cpf, desistir_reprocessamento, max_tentativas=MAX_TENTATIVAS
+)
+
+def processar_cpf(cpf, lote_id):
+    resultado_final = {
+        "CPF": cpf,
+        "nome": "-",
+        "data_nascimento": "-",
+        "data_admissao": "-",
+        "valor_liberado": "-",
+        "margem": "-",
+        "elegivel": "-",
+        "mensagem": "",
+        "status": "Não autorizado"
+    }
+
+    em_cache = cache_resultados.buscar(cpf)
+    if em_cache is not None:
+        consultado_em, resultado = em_cache
+        resultado_final.update({k: v if v is not None else "-" for k, v in resultado.items()})
+        resultado_final["cache"] = True
+        log.debug("Resultado reaproveitado do cache", extra={"cpf": cpf, "lote_id": lote_id})
+        gravar_resultado(cpf, lote_id, resultado_final, consultado_em).result()
+        CPFS_PROCESSADOS.inc(origem="cache", status=resultado_final["status"])
+        return resultado_final
+
+    consultado_em = None
+    response = None
+    inicio = time.perf_counter()
+    try:
+        response = chamar_api(cpf)
+        resp_json = response.json() if response.status_code == 200 else {}
+
+        if resposta_transitoria(response):
+            resultado_final["mensagem"] = f"Erro HTTP {response.status_code}"
+            resultado_final["status"] = f"Reprocessando (1/{MAX_TENTATIVAS})"
+            fila_reprocessamento.agendar(cpf, lote_id, resultado_final["mensagem"])
+        elif response.status_code == 200 and not resp_json.get("erro", True):
+            msg = resp_json.get("mensagem", "")
+            dados_trab = resp_json.get("dados_trabalhador", {}).get("dados", [])
+            if dados_trab:
+                resultado_final.update(extrair_dados_trabalhador(dados_trab[0], msg))
             else:
-                time.sleep(5)
+                resultado_final["mensagem"] = msg or "Sem dados retornados"
+            # Só respostas definitivas da Facta entram no cache; erros e reprocessamentos não.
+            consultado_em = time.time()
+            cache_resultados.guardar(cpf, resultado_final, consultado_em)
+        else:
+            resultado_final["mensagem"] = resp_json.get("mensagem", f"Erro HTTP {response.status_code}")
+
+    except ERROS_TRANSITORIOS as e:
+        erro_texto = str(e)
+        resultado_final["mensagem"] = f"Erro: {erro_texto}"
+        log.warning(
+            "Erro de conexão com a Facta, será reprocessado",
+            extra={"cpf": cpf, "lote_id": lote_id, "erro": erro_texto},
+        )
+        fila_reprocessamento.agendar(cpf, lote_id, erro_texto)
+        resultado_final["status"] = f"Reprocessando (1/{MAX_TENTATIVAS})"
 
-        except Exception as e:
-            print(f" Erro no loop principal do worker: {e}")
-            time.sleep(10)
+    except Exception as e:
+        resultado_final["mensagem"] = f"Erro: {e}"
+        log.exception("Erro ao consultar CPF", extra={"cpf": cpf, "lote_id": lote_id})
+
+    if response is not None:
+        # Corpo só por amostragem (ou quando a Facta não devolveu 200), já cortado e sem CPF.
+        log.info(
+            "Consulta Facta",
+            extra={
+                "cpf": cpf,
+                "lote_id": lote_id,
+                "status_http": response.status_code,
+                "latencia_ms": round((time.perf_counter() - inicio) * 1000, 1),
+                "status": resultado_final["status"],
+                "corpo": corpo_resposta(response.text, forcar=response.status_code != 200),
+            },
+        )
 
-threading.Thread(target=worker_reprocessar, daemon=True).start()
-print("🚀 Worker de reprocessamento iniciado!")
+    # Espera o commit: se a gravação falhar, o motor de lotes devolve o CPF para a fila.
+    gravar_resultado(cpf, lote_id, resultado_final, consultado_em).result()
+    CPFS_PROCESSADOS.inc(origem="facta", status=resultado_final["status"].split(" (")[0])
+    return resultado_final
 
-@app.route("/consultar", methods=["POST"])
+# O despachante só libera pouco acima do limite atual do AIMD: a fila fica no
+# escalonador (justo entre lotes), não na espera do limitador.
+motor_lotes = MotorLotes(
+    executor, processar_cpf, persistencia, concorrencia_padrao=LOTE_CONCORRENCIA,
+    capacidade=lambda: credenciais_facta.capacidade() + LOTE_FOLGA_LIMITADOR,
+)
+
+@rotas.route("/consultar", methods=["POST"])
 def consultar():
     global parar_execucao
     data_in = request.get_json(silent=True) or {}
@@ -219,275 +408,242 @@ def consultar():
         return jsonify({"erro": "Lista de CPFs vazia."}), 400
 
     resultados = []
-    token = garantir_token()
-    API_URL = "https://webservice.facta.com.br/consignado-trabalhador/autoriza-consulta"
-
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    ts_inicio = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    for cpf in cpfs:
-        c.execute(
-            "INSERT OR IGNORE INTO consultas (cpf, resultado, data, lote_id) VALUES (?, ?, ?, ?)",
-            (cpf, "Pendente", ts_inicio, lote_id)
-        )
-    conn.commit()
-    conn.close()
+    try:
+        registrar_cpfs(lote_id, cpfs)
+    except LoteArquivado as e:
+        return jsonify({"erro": str(e)}), 409
 
     for cpf in cpfs:
         if parar_execucao:
-            print("Consulta interrompida manualmente pelo usuário.")
+            log.info("Consulta interrompida manualmente pelo usuário", extra={"lote_id": lote_id})
             break
+        resultados.append(processar_cpf(cpf, lote_id))
 
-        resultado_final = {
-            "CPF": cpf,
-            "nome": "-",
-            "data_nascimento": "-",
-            "data_admissao": "-",
-            "valor_liberado": "-",
-            "margem": "-",
-            "elegivel": "-",
-            "mensagem": "",
-            "status": "Não autorizado"
-        }
+    parar_execucao = False
+    return jsonify(resultados)
 
-        try:
-            response = requests.get(
-                API_URL,
-                headers={"Authorization": f"Bearer {token}", "Accept": "application/json"},
-                params={"cpf": cpf},
-                timeout=15,
-            )
+@rotas.route("/iniciar-lote", methods=["POST"])
+def iniciar_lote():
+    data = request.get_json(silent=True) or {}
+    cpfs = data.get("cpfs", [])
+    lote_id = data.get("lote_id")
 
-            print(f"[{cpf}] Status: {response.status_code}")
-            print(f"[{cpf}] Response: {response.text}")
+    if not lote_id or not isinstance(cpfs, list):
+        return jsonify({"erro": "lote_id é obrigatório e cpfs deve ser uma lista"}), 400
+    try:
+        concorrencia = inteiro_opcional(data.get("concorrencia"), "concorrencia")
+        prioridade = inteiro_opcional(data.get("prioridade"), "prioridade")
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 400
 
-            resp_json = response.json() if response.status_code == 200 else {}
+    try:
+        if cpfs:
+            registrar_cpfs(lote_id, cpfs)
+        execucao = motor_lotes.iniciar(lote_id, concorrencia, prioridade)
+        return jsonify({
+            "ok": True,
+            "lote_id": lote_id,
+            "concorrencia": execucao.concorrencia,
+            "prioridade": execucao.prioridade,
+            "progresso": motor_lotes.progresso(lote_id),
+        }), 202
+    except LoteArquivado as e:
+        return jsonify({"erro": str(e)}), 409
+    except Exception as e:
+        return jsonify({"erro": str(e)}), 500
 
-            if str(resp_json.get("mensagem", "")).lower().startswith("token inválido"):
-                print(f"[{cpf}] Token inválido, gerando novo token...")
-                token = gerar_token()
-                response = requests.get(
-                    API_URL,
-                    headers={"Authorization": f"Bearer {token}", "Accept": "application/json"},
-                    params={"cpf": cpf},
-                    timeout=15,
-                )
-                resp_json = response.json()
-
-            if response.status_code == 200 and not resp_json.get("erro", True):
-                msg = resp_json.get("mensagem", "")
-                dados_trab = resp_json.get("dados_trabalhador", {}).get("dados", [])
-                if dados_trab:
-                    info = dados_trab[0]
-                    resultado_final.update({
-                        "nome": info.get("nome") or "-",
-                        "data_nascimento": info.get("dataNascimento") or "-",
-                        "data_admissao": info.get("dataAdmissao") or "-",
-                        "valor_liberado": info.get("valorTotalVencimentos") or "-",
-                        "margem": info.get("valorMargemDisponivel") or "-",
-                        "elegivel": info.get("elegivel") or "-",
-                        "mensagem": msg,
-                        "status": "Autorizado" if info.get("elegivel") == "SIM" or "autorizado" in msg.lower() else "Não autorizado"
-                    })
-                else:
-                    resultado_final["mensagem"] = msg or "Sem dados retornados"
-            else:
-                resultado_final["mensagem"] = resp_json.get("mensagem", f"Erro HTTP {response.status_code}")
+@rotas.route("/cancelar-lote", methods=["POST"])
+def cancelar_lote():
+    data = request.get_json(silent=True) or {}
+    lote_id = data.get("lote_id")
+    if not lote_id:
+        return jsonify({"erro": "lote_id é obrigatório"}), 400
 
-        except Exception as e:
-            erro_texto = str(e)
-            resultado_final["mensagem"] = f"Erro: {erro_texto}"
-
-            if "HTTPSConnectionPool" in erro_texto or "Max retries exceeded" in erro_texto:
-                print(f"⚠️ {cpf} apresentou erro de conexão — será reprocessado em 15s.")
-                fila_reprocessamento.put((cpf, lote_id))
-                conn = sqlite3.connect(DB_FILE)
-                c = conn.cursor()
+    try:
+        cancelados = motor_lotes.cancelar(lote_id)
+        log.info("Lote cancelado", extra={"lote_id": lote_id, "cancelados": cancelados})
+        return jsonify({"ok": True, "lote_id": lote_id, "cancelados": cancelados})
+    except Exception as e:
+        return jsonify({"erro": str(e)}), 500
+
+@rotas.route("/prioridade-lote", methods=["POST"])
+def prioridade_lote():
+    data = request.get_json(silent=True) or {}
+    lote_id = data.get("lote_id")
+    prioridade = data.get("prioridade")
+    if not lote_id or not isinstance(prioridade, int):
+        return jsonify({"erro": "lote_id e prioridade (inteiro) são obrigatórios"}), 400
+
+    if not motor_lotes.priorizar(lote_id, prioridade):
+        return jsonify({"erro": "Lote não encontrado"}), 404
+    return jsonify({"ok": True, "progresso": motor_lotes.progresso(lote_id)})
+
+@rotas.route("/progresso-lote", methods=["GET"])
+def progresso_lote():
+    lote_id = request.args.get("lote_id")
+    if not lote_id:
+        return jsonify({"erro": "lote_id é obrigatório"}), 400
+
+    progresso = motor_lotes.progresso(lote_id)
+    if progresso is None:
+        return jsonify({"erro": "Lote não encontrado"}), 404
+    return jsonify(progresso)
+
+@rotas.route("/resumo-lote", methods=["GET"])
+def resumo_lote():
+    lote_id = request.args.get("lote_id")
+    if not lote_id:
+        return jsonify({"erro": "lote_id é obrigatório"}), 400
+
+    try:
+        resumo = motor_lotes.resumo(lote_id)
+    except Exception as e:
+        return jsonify({"erro": str(e)}), 500
+    if resumo is None:
+        return jsonify({"erro": "Lote não encontrado"}), 404
+
+    etag = f"{lote_id}:{resumo['versao']}:{resumo['estado']}"
+    if etag in request.if_none_match:
+        resposta = current_app.response_class(status=304)
+        resposta.set_etag(etag)
+        return resposta
+
+    resposta = jsonify(resumo)
+    resposta.set_etag(etag)
+    return resposta
+
+@rotas.route("/status-lote", methods=["GET"])
+def status_lote():
+    lote_id = request.args.get("lote_id")
+    if not lote_id:
+        return jsonify({"erro": "lote_id é obrigatório"}), 400
+
+    desde = request.args.get("desde", type=int)
+
+    try:
+        with persistencia.leitura() as conn:
+            c = conn.cursor()
+            # Lote arquivado: o arquivo mais o que entrou no banco depois, como na exportação.
+            arquivado = arquivador.cursor(lote_id)
+            if arquivado is not None:
+                cursor = arquivado[1]
+            else:
+                c.execute("SELECT COALESCE(MAX(seq), 0) FROM consultas WHERE lote_id = ?", (lote_id,))
+                cursor = c.fetchone()[0]
+
+            etag = f"{lote_id}:{cursor}"
+            if etag in request.if_none_match or (desde is not None and desde >= cursor):
+                resposta = current_app.response_class(status=304)
+                resposta.set_etag(etag)
+                return resposta
+
+            if arquivado is not None:
+                rows = list(arquivador.linhas(lote_id, desde))
+            elif desde is None:
                 c.execute(
-                    "UPDATE consultas SET resultado=?, data=? WHERE cpf=? AND lote_id=?",
-                    (f"Status: Reprocessando (1/{MAX_TENTATIVAS}), Mensagem: {erro_texto}",
-                     datetime.now().strftime("%Y-%m-%d %H:%M:%S"), cpf, lote_id)
+                    f"SELECT {SELECT_RESULTADO} FROM consultas WHERE lote_id = ? ORDER BY id ASC",
+                    (lote_id,)
                 )
-                conn.commit()
-                conn.close()
-
-        resultados.append(resultado_final)
-
-        ts_now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        resultado_str = (
-            f"Nome: {resultado_final['nome']}, "
-            f"Data Nascimento: {resultado_final['data_nascimento']}, "
-            f"Data Admissao: {resultado_final['data_admissao']}, "
-            f"Valor Liberado: {resultado_final['valor_liberado']}, "
-            f"Margem: {resultado_final['margem']}, "
-            f"Elegível: {resultado_final['elegivel']}, "
-            f"Status: {resultado_final['status']}, "
-            f"Mensagem: {resultado_final['mensagem']}"
-        )
-
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        if lote_id:
-            c.execute(
-                "UPDATE consultas SET resultado=?, data=? WHERE cpf=? AND lote_id=?",
-                (resultado_str, ts_now, resultado_final["CPF"], lote_id)
-            )
-            if c.rowcount == 0:
+                rows = c.fetchall()
+            else:
                 c.execute(
-                    "INSERT INTO consultas (cpf, resultado, data, lote_id) VALUES (?, ?, ?, ?)",
-                    (resultado_final["CPF"], resultado_str, ts_now, lote_id)
+                    f"SELECT {SELECT_RESULTADO} FROM consultas WHERE lote_id = ? AND seq > ? ORDER BY seq ASC",
+                    (lote_id, desde)
                 )
-        else:
-            c.execute(
-                "INSERT INTO consultas (cpf, resultado, data) VALUES (?, ?, ?)",
-                (resultado_final["CPF"], resultado_str, ts_now)
-            )
-        conn.commit()
-        conn.close()
+                rows = c.fetchall()
+            dados = [formatar_linha(row) for row in rows]
 
-    parar_execucao = False
-    return jsonify(resultados)
+        resposta = jsonify(dados if desde is None else {"cursor": cursor, "dados": dados})
+        resposta.set_etag(etag)
+        resposta.headers["X-Cursor"] = str(cursor)
+        return resposta
+    except Exception as e:
+        return jsonify({"erro": str(e)}), 500
 
-@app.route("/status-lote", methods=["GET"])
-def status_lote():
+@rotas.route("/eventos-lote", methods=["GET"])
+def eventos_lote():
     lote_id = request.args.get("lote_id")
     if not lote_id:
         return jsonify({"erro": "lote_id é obrigatório"}), 400
 
+    ultimo_evento = request.headers.get("Last-Event-ID") or request.args.get("desde") or "0"
     try:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("""
-            SELECT cpf, resultado, data 
-            FROM consultas 
-            WHERE lote_id = ? 
-            AND id IN (
-                SELECT MAX(id) FROM consultas WHERE lote_id = ? GROUP BY cpf
-            )
-            ORDER BY id ASC
-        """, (lote_id, lote_id))
-
-        registros = c.fetchall()
-        conn.close()
-
-        dados = []
-        for cpf, resultado, data in registros:
-            cpf = cpf.strip().zfill(11)
-            partes = {}
-            for pedaco in resultado.split(","):
-                if ":" in pedaco:
-                    chave, valor = pedaco.split(":", 1)
-                    partes[chave.strip()] = valor.strip()
-
-            dados.append({
-                "CPF": cpf,
-                "Nome": partes.get("Nome", "-"),
-                "Data Nascimento": partes.get("Data Nascimento", "-"),
-                "Data Admissao": partes.get("Data Admissao", "-"),
-                "Valor Liberado": partes.get("Valor Liberado", "-"),
-                "Margem": partes.get("Margem", "-"),
-                "Elegível": partes.get("Elegível", "-"),
-                "Status": partes.get("Status", "-"),
-                "Mensagem": partes.get("Mensagem", "-"),
-                "Data": data
-            })
-
-        return jsonify(dados)
+        desde = int(ultimo_evento)
+    except ValueError:
+        return jsonify({"erro": "Last-Event-ID inválido"}), 400
+
+    return Response(
+        stream_with_context(difusor_eventos.assinar(lote_id, desde)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def ultimo_lote():
+    with persistencia.leitura() as conn:
+        row = conn.execute(
+            "SELECT lote_id FROM consultas WHERE lote_id IS NOT NULL ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+    return row[0] if row else None
+
+def exportar(lote_id, formato):
+    total, cursor = exportador.cursor(lote_id)
+    if not total:
+        return jsonify({"erro": "Nenhuma consulta encontrada"}), 404
+
+    download_name = f"consultas_lote_{lote_id}.{formato}"
+    arquivo = exportador.em_cache(lote_id, formato, cursor)
+    if arquivo is None and formato == "xlsx":
+        arquivo = exportador.gerar_xlsx(lote_id, cursor)
+    if arquivo is not None:
+        return send_file(arquivo, as_attachment=True, download_name=download_name, mimetype=FORMATOS[formato])
+
+    return Response(
+        stream_with_context(exportador.transmitir_csv(lote_id, cursor, comprimir=formato == "csv.gz")),
+        mimetype=FORMATOS[formato],
+        headers={"Content-Disposition": f'attachment; filename="{download_name}"'},
+    )
+
+@rotas.route("/exportar-lote", methods=["GET"])
+def exportar_lote():
+    formato = request.args.get("formato", "xlsx")
+    if formato not in FORMATOS:
+        return jsonify({"erro": f"formato deve ser um de: {', '.join(FORMATOS)}"}), 400
+
+    try:
+        lote_id = request.args.get("lote_id") or ultimo_lote()
+        if not lote_id:
+            return jsonify({"erro": "Nenhuma consulta encontrada"}), 404
+        return exportar(lote_id, formato)
     except Exception as e:
         return jsonify({"erro": str(e)}), 500
 
-@app.route("/recuperar-consultas-excel", methods=["GET"])
+@rotas.route("/recuperar-consultas-excel", methods=["GET"])
 def recuperar_excel():
     try:
-        lote_id = request.args.get("lote_id")
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-
+        lote_id = request.args.get("lote_id") or ultimo_lote()
         if not lote_id:
-            c.execute("SELECT lote_id FROM consultas WHERE lote_id IS NOT NULL ORDER BY id DESC LIMIT 1")
-            row = c.fetchone()
-            if not row:
-                conn.close()
-                return jsonify({"erro": "Nenhuma consulta encontrada"}), 404
-            lote_id = row[0]
-
-        c.execute("SELECT cpf, resultado, data FROM consultas WHERE lote_id = ? ORDER BY id DESC", (lote_id,))
-        consultas = c.fetchall()
-        conn.close()
-
-        if not consultas:
             return jsonify({"erro": "Nenhuma consulta encontrada"}), 404
-
-        dados_expandidos = []
-        for cpf, resultado, data in consultas:
-            partes = {}
-            for pedaco in resultado.split(","):
-                if ":" in pedaco:
-                    chave, valor = pedaco.split(":", 1)
-                    partes[chave.strip()] = valor.strip()
-
-            dados_expandidos.append({
-                "CPF": cpf,
-                "Nome": partes.get("Nome", "-"),
-                "Data Nascimento": partes.get("Data Nascimento", "-"),
-                "Data Admissao": partes.get("Data Admissao", "-"),
-                "Valor Liberado": partes.get("Valor Liberado", "-"),
-                "Margem": partes.get("Margem", "-"),
-                "Elegível": partes.get("Elegível", "-"),
-                "Status": partes.get("Status", "-"),
-                "Mensagem": partes.get("Mensagem", "-"),
-                "Data": data
-            })
-
-        df = pd.DataFrame(dados_expandidos)
-        arquivo_excel = os.path.join(RESULT_FOLDER, f"consultas_lote_{lote_id}.xlsx")
-        df.to_excel(arquivo_excel, index=False)
-        return send_file(arquivo_excel, as_attachment=True)
-
+        return exportar(lote_id, "xlsx")
     except Exception as e:
         return jsonify({"erro": str(e)}), 500
 
-@app.route("/baixar-excel", methods=["POST"])
+@rotas.route("/baixar-excel", methods=["POST"])
 def baixar_excel():
     data = request.get_json(silent=True) or {}
     dados = data.get("resultados", [])
 
     if not dados:
         try:
-            conn = sqlite3.connect(DB_FILE)
-            c = conn.cursor()
-            c.execute("SELECT lote_id FROM consultas ORDER BY id DESC LIMIT 1")
-            row = c.fetchone()
-            if row:
-                lote_id = row[0]
-                c.execute("SELECT cpf, resultado, data FROM consultas WHERE lote_id=?", (lote_id,))
-                consultas = c.fetchall()
-                conn.close()
-
-                dados = []
-                for cpf, resultado, data in consultas:
-                    partes = {
-                        k.strip(): v.strip()
-                        for k, v in (p.split(":") for p in resultado.split(",") if ":" in p)
-                    }
-                    dados.append({
-                        "CPF": cpf,
-                        "Nome": partes.get("Nome", "-"),
-                        "Data Nascimento": partes.get("Data Nascimento", "-"),
-                        "Data Admissao": partes.get("Data Admissao", "-"),
-                        "Valor Liberado": partes.get("Valor Liberado", "-"),
-                        "Margem": partes.get("Margem", "-"),
-                        "Elegível": partes.get("Elegível", "-"),
-                        "Status": partes.get("Status", "-"),
-                        "Mensagem": partes.get("Mensagem", "-"),
-                        "Data": data
-                    })
+            lote_id = data.get("lote_id") or ultimo_lote()
+            if lote_id:
+                return exportar(lote_id, "xlsx")
         except Exception as e:
-            print(f"Erro ao recuperar pendentes: {e}")
-
-    if not dados:
+            log.warning("Erro ao recuperar pendentes", extra={"erro": str(e)})
         return jsonify({"erro": "Nenhum dado disponível para exportar."}), 400
 
+    # pandas só é carregado aqui: importá-lo na subida dominava o tempo de boot de cada worker.
+    import pandas as pd
+
     df = pd.DataFrame(dados)
     output = io.BytesIO()
     with pd.ExcelWriter(output, engine="openpyxl") as writer:
@@ -503,13 +659,139 @@ def baixar_excel():
         mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
     )
 
-@app.route("/parar", methods=["POST"])
+@rotas.route("/arquivo-lotes", methods=["GET"])
+def arquivo_lotes():
+    limite = min(request.args.get("limite", 100, type=int), 1000)
+    deslocamento = request.args.get("deslocamento", 0, type=int)
+    try:
+        return jsonify(arquivador.listar(limite, deslocamento))
+    except Exception as e:
+        return jsonify({"erro": str(e)}), 500
+
+@rotas.route("/arquivar", methods=["POST"])
+def arquivar():
+    data = request.get_json(silent=True) or {}
+    idade_dias = data.get("idade_dias")
+    if idade_dias is not None and (not isinstance(idade_dias, (int, float)) or idade_dias < 0):
+        return jsonify({"erro": "idade_dias deve ser um número não negativo"}), 400
+
+    try:
+        if data.get("converter_banco"):
+            relatorio = arquivador.converter_banco()
+        else:
+            relatorio = arquivador.executar_ciclo(idade_dias)
+    except Exception as e:
+        log.exception("Erro no arquivamento manual")
+        return jsonify({"erro": str(e)}), 500
+    if "erro" in relatorio:
+        return jsonify(relatorio), 409
+    return jsonify({"ok": True, **relatorio})
+
+@rotas.route("/diagnostico", methods=["GET"])
+def diagnostico():
+    return jsonify({
+        "http": cliente_http.estatisticas(),
+        "credenciais": credenciais_facta.estatisticas(),
+        "persistencia": persistencia.estatisticas(),
+        "eventos": difusor_eventos.estatisticas(),
+        "reprocessamento": fila_reprocessamento.estatisticas(),
+        "cache": cache_resultados.estatisticas(),
+        "lotes": motor_lotes.estatisticas(),
+        "arquivo": arquivador.estatisticas(),
+    })
+
+def _por_tentativa():
+    return {(t,): n for t, n in fila_reprocessamento.estatisticas()["por_tentativa"].items()}
+
+registro.medidor(
+    "limitador_limite", "Limite atual de concorrência do AIMD por credencial.", ("credencial",),
+    funcao=lambda: {(c.nome,): c.limitador.limite for c in credenciais_facta.credenciais}
+)
+registro.medidor(
+    "limitador_em_voo", "Chamadas à Facta em andamento por credencial.", ("credencial",),
+    funcao=lambda: {(c.nome,): c.limitador.estatisticas()["em_voo"] for c in credenciais_facta.credenciais}
+)
+registro.medidor(
+    "disjuntor_estado", "1 no estado atual do disjuntor de cada credencial.", ("credencial", "estado"),
+    funcao=lambda: {
+        (c.nome, e): int(c.disjuntor.estado == e)
+        for c in credenciais_facta.credenciais
+        for e in (DisjuntorCircuito.FECHADO, DisjuntorCircuito.ABERTO, DisjuntorCircuito.MEIO_ABERTO)
+    }
+)
+registro.medidor(
+    "credencial_quarentena", "1 enquanto a credencial está fora de circulação.", ("credencial",),
+    funcao=lambda: {(c.nome,): int(c.em_quarentena()) for c in credenciais_facta.credenciais}
+)
+registro.medidor(
+    "sqlite_fila_escrita", "Operações aguardando o escritor.",
+    funcao=lambda: persistencia.estatisticas()["fila_escrita"]
+)
+registro.medidor(
+    "reprocessamento_fila", "CPFs na fila de reprocessamento por tentativas já feitas.", ("tentativas",),
+    funcao=_por_tentativa
+)
+registro.medidor(
+    "reprocessamento_vencidos", "CPFs da fila de reprocessamento já vencidos.",
+    funcao=lambda: fila_reprocessamento.estatisticas()["vencidos"]
+)
+registro.medidor(
+    "lote_vazao_cpfs_por_minuto", "CPFs concluídos no último minuto por lote ativo neste processo.",
+    ("lote_id",), funcao=motor_lotes.vazao
+)
+registro.medidor(
+    "escalonador_em_andamento", "CPFs despachados pelo escalonador e ainda em processamento.",
+    funcao=lambda: motor_lotes.estatisticas()["em_andamento"]
+)
+registro.medidor(
+    "eventos_assinantes", "Conexões SSE abertas.",
+    funcao=lambda: difusor_eventos.estatisticas()["assinantes"]
+)
+
+@rotas.route("/metrics", methods=["GET"])
+def metricas():
+    return Response(registro.exportar(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+@rotas.route("/parar", methods=["POST"])
 def parar():
     global parar_execucao
-    parar_execucao = True
-    print("Execução interrompida manualmente pelo usuário.")
+    data = request.get_json(silent=True) or {}
+    lote_id = data.get("lote_id")
+    if lote_id:
+        motor_lotes.parar(lote_id)
+    else:
+        # Sem lote_id só interrompe a consulta avulsa deste processo; os lotes seguem como estão.
+        parar_execucao = True
+    log.info("Execução interrompida manualmente pelo usuário", extra={"lote_id": lote_id})
     return jsonify({"ok": True})
 
+_servicos_iniciados = False
+
+def iniciar_servicos():
+    # Threads de fundo e retomada de lotes; uma vez por processo (em gunicorn, por worker).
+    global _servicos_iniciados
+    if _servicos_iniciados:
+        return
+    _servicos_iniciados = True
+    persistencia.iniciar()
+    difusor_eventos.iniciar()
+    credenciais_facta.iniciar()
+    fila_reprocessamento.iniciar()
+    arquivador.iniciar()
+    motor_lotes.retomar_pendentes()
+
+def create_app(iniciar=True):
+    configurar_logs()
+    os.makedirs(RESULT_FOLDER, exist_ok=True)
+    os.makedirs("recuperacoes", exist_ok=True)
+    init_db(DB_FILE)
+
+    app = Flask(__name__)
+    app.register_blueprint(rotas)
+    if iniciar:
+        iniciar_servicos()
+    return app
+
 
 if __name__ == "__main__":
-    app.run(debug=True, port=8800)
+    create_app().run(debug=True, port=8800, use_reloader=False)
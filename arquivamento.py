@@ -0,0 +1,443 @@
+import csv
+import gzip
+import hashlib
+import importlib.util
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from database import COLUNAS_RESULTADO, SELECT_RESULTADO, converter_auto_vacuum
+from metricas import registro
+from persistencia import conectar
+
+log = logging.getLogger(__name__)
+
+ARQUIVO_PASTA = os.environ.get("ARQUIVO_PASTA", "arquivo")
+ARQUIVO_IDADE_DIAS = float(os.environ.get("ARQUIVO_IDADE_DIAS", "30"))
+# Intervalo entre ciclos automáticos (s); 0 deixa só o POST /arquivar.
+ARQUIVO_INTERVALO = float(os.environ.get("ARQUIVO_INTERVALO", str(6 * 3600)))
+ARQUIVO_BLOCO = int(os.environ.get("ARQUIVO_BLOCO", "5000"))
+ARQUIVO_VACUO_PAGINAS = int(os.environ.get("ARQUIVO_VACUO_PAGINAS", "2000"))
+# "auto" usa Parquet quando o pyarrow estiver instalado e CSV com gzip caso contrário.
+ARQUIVO_FORMATO = os.environ.get("ARQUIVO_FORMATO", "auto")
+
+COLUNAS_ARQUIVO = (
+    "id", "seq", "cpf", "lote_id", "data", "atualizado_em", "consultado_em", *COLUNAS_RESULTADO
+)
+_INTEIROS = {"id", "seq"}
+_REAIS = {"atualizado_em", "consultado_em"} | {k for k, v in COLUNAS_RESULTADO.items() if v == "REAL"}
+_SELECT = [c.strip() for c in SELECT_RESULTADO.split(",")]
+
+ARQUIVO_LOTES = registro.contador(
+    "arquivo_lotes_total", "Lotes movidos do banco para arquivos compactados.", ("formato",)
+)
+ARQUIVO_LINHAS = registro.contador("arquivo_linhas_total", "Linhas de consultas arquivadas e podadas do banco.")
+ARQUIVO_PAGINAS = registro.contador(
+    "arquivo_paginas_liberadas_total", "Páginas devolvidas ao sistema pelo incremental_vacuum."
+)
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        return None
+    return pyarrow
+
+
+class LoteArquivado(Exception):
+    pass
+
+
+def _converter(coluna, valor):
+    if valor in (None, ""):
+        return None
+    if coluna in _INTEIROS:
+        return int(valor)
+    if coluna in _REAIS:
+        return float(valor)
+    return valor
+
+
+class Arquivador:
+    def __init__(
+        self,
+        persistencia,
+        pasta=ARQUIVO_PASTA,
+        idade_dias=ARQUIVO_IDADE_DIAS,
+        intervalo=ARQUIVO_INTERVALO,
+        formato=ARQUIVO_FORMATO,
+        bloco=ARQUIVO_BLOCO,
+    ):
+        self.persistencia = persistencia
+        self.pasta = os.path.abspath(pasta)
+        self.idade_dias = idade_dias
+        self.intervalo = intervalo
+        self.bloco = bloco
+        # find_spec não importa o pyarrow: ele só é carregado quando um lote é escrito ou lido.
+        tem_pyarrow = importlib.util.find_spec("pyarrow") is not None
+        if formato == "auto":
+            formato = "parquet" if tem_pyarrow else "csv.gz"
+        if formato == "parquet" and not tem_pyarrow:
+            raise RuntimeError("ARQUIVO_FORMATO=parquet exige o pacote pyarrow")
+        self.formato = formato
+
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._thread = None
+        self._ultimo_ciclo = None
+
+    def iniciar(self):
+        if self.intervalo <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+
+    def _loop(self):
+        # Primeiro ciclo um pouco depois da subida, para não competir com a retomada dos lotes.
+        espera = min(self.intervalo, 300)
+        while not self._parar.wait(espera):
+            try:
+                self.executar_ciclo()
+            except Exception:
+                log.exception("Erro no ciclo de arquivamento")
+            espera = self.intervalo
+
+    # --- consulta ao que já foi arquivado ---
+
+    def arquivado(self, lote_id):
+        with self.persistencia.leitura() as conn:
+            row = conn.execute(
+                "SELECT caminho, formato, linhas, max_seq FROM lotes_arquivados WHERE lote_id = ?", (lote_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        caminho, formato, linhas, max_seq = row
+        return {
+            "caminho": os.path.join(self.pasta, caminho),
+            "formato": formato,
+            "linhas": linhas,
+            "max_seq": max_seq,
+        }
+
+    def _novas(self, conn, lote_id, arquivado):
+        # Linhas que chegaram ao banco depois do arquivamento; as de seq <= max_seq já estão
+        # no arquivo (ou sobraram de uma poda interrompida).
+        return conn.execute(
+            "SELECT COUNT(*), COALESCE(MAX(seq), 0) FROM consultas WHERE lote_id = ? AND seq > ?",
+            (lote_id, arquivado["max_seq"])
+        ).fetchone()
+
+    def cursor(self, lote_id):
+        # (COUNT, MAX(seq)) do lote inteiro: arquivo mais as linhas novas no banco.
+        arquivado = self.arquivado(lote_id)
+        if arquivado is None:
+            return None
+        with self.persistencia.leitura() as conn:
+            novas, max_seq = self._novas(conn, lote_id, arquivado)
+        return arquivado["linhas"] + novas, max(arquivado["max_seq"], max_seq)
+
+    def _ler(self, arquivado):
+        if arquivado["formato"] == "parquet":
+            pa = _pyarrow()
+            if pa is None:
+                raise RuntimeError("Lote arquivado em Parquet: instale o pyarrow para lê-lo")
+            arquivo = pa.parquet.ParquetFile(arquivado["caminho"])
+            for lote in arquivo.iter_batches(batch_size=self.bloco):
+                yield from lote.to_pylist()
+        else:
+            with gzip.open(arquivado["caminho"], "rt", encoding="utf-8", newline="") as f:
+                for linha in csv.DictReader(f):
+                    yield {k: _converter(k, v) for k, v in linha.items()}
+
+    def linhas(self, lote_id, desde=None):
+        # Mesmas colunas e ordem do SELECT_RESULTADO, para reaproveitar formatar_linha.
+        # O arquivo vem primeiro, depois as linhas novas do banco (seq > max_seq).
+        arquivado = self.arquivado(lote_id)
+        if arquivado is None:
+            return
+        if desde is None or desde < arquivado["max_seq"]:
+            for linha in self._ler(arquivado):
+                if desde is None or (linha["seq"] or 0) > desde:
+                    yield tuple(linha[c] for c in _SELECT)
+        with self.persistencia.leitura() as conn:
+            c = conn.execute(
+                f"SELECT {SELECT_RESULTADO} FROM consultas WHERE lote_id = ? AND seq > ? ORDER BY seq",
+                (lote_id, max(desde or 0, arquivado["max_seq"]))
+            )
+            while True:
+                rows = c.fetchmany(self.bloco)
+                if not rows:
+                    break
+                yield from rows
+
+    def listar(self, limite=100, deslocamento=0):
+        with self.persistencia.leitura() as conn:
+            rows = conn.execute(
+                "SELECT lote_id, particao, formato, linhas, bytes, arquivado_em FROM lotes_arquivados "
+                "ORDER BY arquivado_em DESC LIMIT ? OFFSET ?",
+                (limite, deslocamento)
+            ).fetchall()
+        return [
+            {
+                "lote_id": lote_id,
+                "particao": particao,
+                "formato": formato,
+                "linhas": linhas,
+                "bytes": tamanho,
+                "arquivado_em": datetime.fromtimestamp(arquivado_em).strftime("%Y-%m-%d %H:%M:%S"),
+            }
+            for lote_id, particao, formato, linhas, tamanho, arquivado_em in rows
+        ]
+
+    # --- arquivamento ---
+
+    def candidatos(self, idade_dias=None):
+        limite = time.time() - 86400 * (self.idade_dias if idade_dias is None else idade_dias)
+        with self.persistencia.leitura() as conn:
+            return conn.execute(
+                """
+                SELECT r.lote_id, r.atualizado_em FROM resumo_lotes r
+                LEFT JOIN lotes l ON l.lote_id = r.lote_id
+                WHERE r.total > 0 AND r.pendentes = 0 AND r.reprocessando = 0
+                    AND r.atualizado_em < ? AND COALESCE(l.estado, '') != 'executando'
+                    AND NOT EXISTS (SELECT 1 FROM lotes_arquivados a WHERE a.lote_id = r.lote_id)
+                ORDER BY r.atualizado_em
+                """,
+                (limite,)
+            ).fetchall()
+
+    def _caminho_relativo(self, lote_id, particao):
+        base = re.sub(r"[^\w-]", "_", lote_id)[:60]
+        sufixo = hashlib.sha1(lote_id.encode()).hexdigest()[:8]
+        extensao = "parquet" if self.formato == "parquet" else "csv.gz"
+        return os.path.join(f"data={particao}", f"lote_{base}_{sufixo}.{extensao}")
+
+    def _linhas_banco(self, lote_id):
+        with self.persistencia.leitura() as conn:
+            c = conn.execute(
+                f"SELECT {', '.join(COLUNAS_ARQUIVO)} FROM consultas WHERE lote_id = ? ORDER BY id", (lote_id,)
+            )
+            while True:
+                rows = c.fetchmany(self.bloco)
+                if not rows:
+                    break
+                yield rows
+
+    def _escrever_parquet(self, lote_id, temporario):
+        pa = _pyarrow()
+        tipos = {c: pa.int64() if c in _INTEIROS else pa.float64() if c in _REAIS else pa.string()
+                 for c in COLUNAS_ARQUIVO}
+        esquema = pa.schema([(c, tipos[c]) for c in COLUNAS_ARQUIVO])
+        linhas, max_seq = 0, 0
+        with pa.parquet.ParquetWriter(temporario, esquema, compression="zstd") as escritor:
+            for rows in self._linhas_banco(lote_id):
+                colunas = list(zip(*rows))
+                escritor.write_batch(pa.record_batch(
+                    [pa.array(valores, tipos[c]) for c, valores in zip(COLUNAS_ARQUIVO, colunas)], schema=esquema
+                ))
+                linhas += len(rows)
+                max_seq = max(max_seq, max(s or 0 for s in colunas[1]))
+        return linhas, max_seq
+
+    def _escrever_csv(self, lote_id, temporario):
+        linhas, max_seq = 0, 0
+        with gzip.open(temporario, "wt", encoding="utf-8", newline="", compresslevel=6) as f:
+            escritor = csv.writer(f)
+            escritor.writerow(COLUNAS_ARQUIVO)
+            for rows in self._linhas_banco(lote_id):
+                escritor.writerows(rows)
+                linhas += len(rows)
+                max_seq = max(max_seq, max(row[1] or 0 for row in rows))
+        return linhas, max_seq
+
+    def arquivar_lote(self, lote_id, atualizado_em):
+        particao = datetime.fromtimestamp(atualizado_em).strftime("%Y-%m-%d")
+        relativo = self._caminho_relativo(lote_id, particao)
+        destino = os.path.join(self.pasta, relativo)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+
+        fd, temporario = tempfile.mkstemp(dir=os.path.dirname(destino), suffix=".tmp")
+        os.close(fd)
+        try:
+            if self.formato == "parquet":
+                linhas, max_seq = self._escrever_parquet(lote_id, temporario)
+            else:
+                linhas, max_seq = self._escrever_csv(lote_id, temporario)
+            os.replace(temporario, destino)
+        except Exception:
+            os.remove(temporario)
+            raise
+        tamanho = os.path.getsize(destino)
+
+        def registrar(c):
+            # Só vale se nada mudou no lote enquanto o arquivo era escrito.
+            atual = c.execute(
+                "SELECT COUNT(*), COALESCE(MAX(seq), 0) FROM consultas WHERE lote_id = ?", (lote_id,)
+            ).fetchone()
+            if tuple(atual) != (linhas, max_seq):
+                return False
+            c.execute(
+                "INSERT OR IGNORE INTO lotes_arquivados "
+                "(lote_id, caminho, formato, particao, linhas, max_seq, bytes, arquivado_em) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (lote_id, relativo, self.formato, particao, linhas, max_seq, tamanho, time.time())
+            )
+            return True
+
+        if not self.persistencia.executar(registrar).result():
+            log.warning(
+                "Lote mudou durante o arquivamento; fica para o próximo ciclo", extra={"lote_id": lote_id}
+            )
+            return 0
+
+        podadas = self.podar(lote_id, max_seq)
+        ARQUIVO_LOTES.inc(formato=self.formato)
+        log.info(
+            "Lote arquivado",
+            extra={
+                "lote_id": lote_id,
+                "linhas": linhas,
+                "bytes": tamanho,
+                "formato": self.formato,
+                "particao": particao,
+            },
+        )
+        return podadas
+
+    def podar(self, lote_id, max_seq):
+        # Em blocos, para não segurar o escritor por um lote inteiro de uma vez. Só o que
+        # está no arquivo (seq <= max_seq) sai do banco.
+        def apagar(c):
+            n = c.execute(
+                "DELETE FROM consultas WHERE id IN ("
+                "SELECT id FROM consultas WHERE lote_id = ? AND seq <= ? LIMIT ?)",
+                (lote_id, max_seq, self.bloco)
+            ).rowcount
+            if not n:
+                c.execute("DELETE FROM reprocessamentos WHERE lote_id = ?", (lote_id,))
+            return n
+
+        total = 0
+        while True:
+            n = self.persistencia.executar(apagar).result()
+            if not n:
+                break
+            total += n
+            ARQUIVO_LINHAS.inc(n)
+        return total
+
+    def _podas_interrompidas(self):
+        with self.persistencia.leitura() as conn:
+            return conn.execute(
+                "SELECT a.lote_id, a.max_seq FROM lotes_arquivados a WHERE EXISTS ("
+                "SELECT 1 FROM consultas c WHERE c.lote_id = a.lote_id AND c.seq <= a.max_seq)"
+            ).fetchall()
+
+    def compactar(self):
+        # O texto legado de "resultado" já foi migrado para colunas; só ocupa espaço.
+        def limpar(c):
+            return c.execute(
+                "UPDATE consultas SET resultado = NULL WHERE id IN ("
+                "SELECT id FROM consultas WHERE resultado IS NOT NULL AND status IS NOT NULL LIMIT ?)",
+                (self.bloco,)
+            ).rowcount
+
+        total = 0
+        while True:
+            n = self.persistencia.executar(limpar).result()
+            if not n:
+                return total
+            total += n
+
+    def vacuo(self, paginas=ARQUIVO_VACUO_PAGINAS):
+        # O sqlite3 do Python executa uma única etapa do PRAGMA por chamada, e cada
+        # etapa libera uma página: daí o laço de incremental_vacuum(1).
+        def liberar(c):
+            # Sem auto_vacuum incremental o PRAGMA não libera nada e o laço não terminaria.
+            if c.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                return 0
+            livres = c.execute("PRAGMA freelist_count").fetchone()[0]
+            passos = min(livres, paginas)
+            for _ in range(passos):
+                c.execute("PRAGMA incremental_vacuum(1)")
+            return passos
+
+        total = 0
+        while True:
+            n = self.persistencia.executar(liberar).result()
+            if not n:
+                break
+            total += n
+            ARQUIVO_PAGINAS.inc(n)
+
+        if total:
+            conn = conectar(self.persistencia.db_file)
+            try:
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            finally:
+                conn.close()
+        return total
+
+    def converter_banco(self):
+        # Manutenção manual: o VACUUM completo trava as escritas de todos os workers.
+        if not self._lock.acquire(blocking=False):
+            return {"erro": "Arquivamento já em andamento"}
+        try:
+            segundos = converter_auto_vacuum(self.persistencia.db_file)
+            return {"convertido": segundos is not None, "segundos_conversao": segundos}
+        finally:
+            self._lock.release()
+
+    def executar_ciclo(self, idade_dias=None):
+        if not self._lock.acquire(blocking=False):
+            return {"erro": "Arquivamento já em andamento"}
+        try:
+            inicio = time.perf_counter()
+            relatorio = {"formato": self.formato, "lotes": 0, "linhas": 0}
+            for lote_id, max_seq in self._podas_interrompidas():
+                relatorio["linhas"] += self.podar(lote_id, max_seq)
+            for lote_id, atualizado_em in self.candidatos(idade_dias):
+                podadas = self.arquivar_lote(lote_id, atualizado_em)
+                if podadas:
+                    relatorio["lotes"] += 1
+                    relatorio["linhas"] += podadas
+            relatorio["compactadas"] = self.compactar()
+            relatorio["paginas_liberadas"] = self.vacuo()
+            relatorio["segundos"] = round(time.perf_counter() - inicio, 3)
+            self._ultimo_ciclo = {"em": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), **relatorio}
+            if relatorio["lotes"] or relatorio["paginas_liberadas"]:
+                log.info("Ciclo de arquivamento concluído", extra=relatorio)
+            return relatorio
+        finally:
+            self._lock.release()
+
+    def estatisticas(self):
+        with self.persistencia.leitura() as conn:
+            lotes, linhas, tamanho = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(linhas), 0), COALESCE(SUM(bytes), 0) FROM lotes_arquivados"
+            ).fetchone()
+            paginas, livres, tamanho_pagina, auto_vacuum = (
+                conn.execute(f"PRAGMA {p}").fetchone()[0]
+                for p in ("page_count", "freelist_count", "page_size", "auto_vacuum")
+            )
+        return {
+            "formato": self.formato,
+            "pasta": self.pasta,
+            "idade_dias": self.idade_dias,
+            "lotes_arquivados": lotes,
+            "linhas_arquivadas": linhas,
+            "bytes_arquivados": tamanho,
+            "banco_bytes": paginas * tamanho_pagina,
+            "banco_paginas_livres": livres,
+            "auto_vacuum_incremental": auto_vacuum == 2,
+            "ultimo_ciclo": self._ultimo_ciclo,
+        }
@@ -0,0 +1,435 @@
+# Benchmark de ponta a ponta contra o simulador local da Facta.
+#
+#   python bench/benchmark.py --tamanhos 1000,10000 --saida bench/relatorio.json
+#   python bench/benchmark.py --comparar bench/relatorio.json --tolerancia 0.25
+#
+# Sobe o simulador e o app (em outro processo, numa pasta temporária) e, para
+# cada tamanho de lote, mede: /registrar-lote, o motor de lotes até o fim,
+# /consultar (latência com e sem cache), /status-lote (completo e por cursor),
+# /exportar-lote (gerado e em cache), pico de RSS do app e contenção do SQLite
+# a partir de /metrics. Com --comparar, sai com código 1 se algo piorou além
+# da tolerância.
+import argparse
+import base64
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from simulador_facta import argumentos, configuracao, iniciar_simulador
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Métricas comparadas com a linha de base: (caminho, True se maior é melhor).
+COMPARADAS = (
+    ("registrar.cpfs_por_segundo", True),
+    ("lote.cpfs_por_segundo", True),
+    ("consultar_facta.p50_ms", False),
+    ("consultar_facta.p99_ms", False),
+    ("consultar_cache.p50_ms", False),
+    ("consultar_cache.p99_ms", False),
+    ("status_completo.p50_ms", False),
+    ("status_completo.p99_ms", False),
+    ("status_cursor.p50_ms", False),
+    ("status_cursor.p99_ms", False),
+    ("exportar.xlsx.gerado_ms", False),
+    ("exportar.csv.gz.gerado_ms", False),
+    ("sqlite.escrita_p99_ms", False),
+    ("rss_pico_mb", False),
+)
+
+_LINHA_METRICA = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{.*\})?\s+(\S+)$")
+
+
+def gerar_cpfs(quantidade, semente):
+    aleatorio = random.Random(semente)
+    cpfs = set()
+    while len(cpfs) < quantidade:
+        d = [aleatorio.randint(0, 9) for _ in range(9)]
+        if len(set(d)) == 1:
+            continue
+        for n in (9, 10):
+            d.append(sum(v * p for v, p in zip(d, range(n + 1, 1, -1))) * 10 % 11 % 10)
+        cpfs.add("".join(map(str, d)))
+    return sorted(cpfs)
+
+
+def percentis(amostras):
+    if not amostras:
+        return {"n": 0, "p50_ms": None, "p99_ms": None, "max_ms": None}
+    ordenadas = sorted(amostras)
+
+    def p(q):
+        return round(ordenadas[min(len(ordenadas) - 1, int(q * len(ordenadas)))] * 1000, 2)
+
+    return {"n": len(ordenadas), "p50_ms": p(0.50), "p99_ms": p(0.99), "max_ms": p(1.0)}
+
+
+def ler_metricas(texto):
+    metricas = {}
+    for linha in texto.splitlines():
+        m = _LINHA_METRICA.match(linha)
+        if m:
+            metricas[(m.group(1), m.group(2) or "")] = float(m.group(3))
+    return metricas
+
+
+def diferenca(depois, antes):
+    return {k: v - antes.get(k, 0) for k, v in depois.items()}
+
+
+def quantil_histograma(metricas, nome, q):
+    buckets = []
+    for (chave, rotulos), valor in metricas.items():
+        if chave == f"{nome}_bucket":
+            le = re.search(r'le="([^"]+)"', rotulos).group(1)
+            buckets.append((float("inf") if le == "+Inf" else float(le), valor))
+    buckets.sort()
+    total = buckets[-1][1] if buckets else 0
+    if not total:
+        return None
+    # Interpolação linear dentro do bucket, como o histogram_quantile do Prometheus.
+    anterior_limite, anterior_contagem = 0.0, 0
+    for limite, contagem in buckets:
+        if contagem >= q * total:
+            if limite == float("inf"):
+                return round(anterior_limite * 1000, 2)
+            fracao = (q * total - anterior_contagem) / max(contagem - anterior_contagem, 1)
+            return round((anterior_limite + (limite - anterior_limite) * fracao) * 1000, 2)
+        anterior_limite, anterior_contagem = limite, contagem
+    return None
+
+
+def soma_metrica(metricas, nome, filtro=""):
+    return sum(v for (chave, rotulos), v in metricas.items() if chave == nome and filtro in rotulos)
+
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def rss_kb(pid, campo):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for linha in f:
+                if linha.startswith(campo + ":"):
+                    return int(linha.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class AppEmTeste:
+    def __init__(self, url_simulador, env_extra=None):
+        self.pasta = tempfile.mkdtemp(prefix="bench-fgts-")
+        self.porta = porta_livre()
+        self.base = f"http://127.0.0.1:{self.porta}"
+        self.url_simulador = url_simulador
+        self.env_extra = env_extra or {}
+        self.processo = None
+        self.sessao = requests.Session()
+
+    def iniciar(self, espera=30):
+        env = {
+            **os.environ,
+            "PYTHONPATH": RAIZ + os.pathsep + os.environ.get("PYTHONPATH", ""),
+            "FACTA_TOKEN_URL": f"{self.url_simulador}/gera-token",
+            "FACTA_API_URL": f"{self.url_simulador}/consignado-trabalhador/autoriza-consulta",
+            **self.env_extra,
+        }
+        self.log = open(os.path.join(self.pasta, "app.log"), "w")
+        self.processo = subprocess.Popen(
+            [
+                sys.executable, "-c",
+                "import app; app.create_app().run("
+                f"host='127.0.0.1', port={self.porta}, threaded=True, use_reloader=False)",
+            ],
+            cwd=self.pasta, env=env, stdout=self.log, stderr=subprocess.STDOUT,
+        )
+        limite = time.monotonic() + espera
+        while time.monotonic() < limite:
+            if self.processo.poll() is not None:
+                raise RuntimeError(f"App encerrou ao iniciar; veja {self.log.name}")
+            try:
+                self.sessao.get(f"{self.base}/diagnostico", timeout=2)
+                return
+            except requests.RequestException:
+                time.sleep(0.2)
+        raise RuntimeError(f"App não respondeu em {espera}s; veja {self.log.name}")
+
+    def encerrar(self, manter_pasta=False):
+        if self.processo and self.processo.poll() is None:
+            self.processo.terminate()
+            try:
+                self.processo.wait(10)
+            except subprocess.TimeoutExpired:
+                self.processo.kill()
+        self.log.close()
+        if not manter_pasta:
+            shutil.rmtree(self.pasta, ignore_errors=True)
+
+    def get(self, rota, **kwargs):
+        return self.sessao.get(f"{self.base}{rota}", timeout=600, **kwargs)
+
+    def post(self, rota, corpo):
+        return self.sessao.post(f"{self.base}{rota}", json=corpo, timeout=600)
+
+    def metricas(self):
+        return ler_metricas(self.get("/metrics").text)
+
+
+class Amostrador:
+    # Lê RSS e profundidade da fila de escrita periodicamente enquanto o lote roda.
+    def __init__(self, app, intervalo=0.25):
+        self.app = app
+        self.intervalo = intervalo
+        self.fila_maxima = 0
+        self.rss_maximo_kb = 0
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def _loop(self):
+        sessao = requests.Session()
+        while not self._parar.wait(self.intervalo):
+            self.rss_maximo_kb = max(self.rss_maximo_kb, rss_kb(self.app.processo.pid, "VmRSS") or 0)
+            try:
+                metricas = ler_metricas(sessao.get(f"{self.app.base}/metrics", timeout=5).text)
+                self.fila_maxima = max(
+                    self.fila_maxima, int(soma_metrica(metricas, "fgts_clt_sqlite_fila_escrita"))
+                )
+            except requests.RequestException:
+                pass
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._parar.set()
+        self._thread.join()
+
+
+def medir_tamanho(app, tamanho, args):
+    print(f"--- {tamanho} CPFs ---")
+    lote_id = f"bench-{tamanho}-{int(time.time())}"
+    cpfs = gerar_cpfs(tamanho, semente=tamanho)
+    resultado = {"tamanho": tamanho}
+    antes = app.metricas()
+
+    inicio = time.perf_counter()
+    r = app.post("/registrar-lote", {"lote_id": lote_id, "cpfs": cpfs})
+    r.raise_for_status()
+    duracao = time.perf_counter() - inicio
+    resultado["registrar"] = {
+        "segundos": round(duracao, 3),
+        "cpfs_por_segundo": round(tamanho / duracao, 1),
+    }
+
+    status_completo, status_cursor = [], []
+    cursor = 0
+    with Amostrador(app) as amostrador:
+        inicio = time.perf_counter()
+        app.post("/iniciar-lote", {"lote_id": lote_id, "cpfs": [], "concorrencia": args.concorrencia}).raise_for_status()
+        while True:
+            time.sleep(args.intervalo_status)
+            t = time.perf_counter()
+            resposta = app.get("/status-lote", params={"lote_id": lote_id, "desde": cursor})
+            status_cursor.append(time.perf_counter() - t)
+            if resposta.status_code == 200:
+                cursor = resposta.json()["cursor"]
+
+            if len(status_completo) < args.amostras_status:
+                t = time.perf_counter()
+                app.get("/status-lote", params={"lote_id": lote_id}).raise_for_status()
+                status_completo.append(time.perf_counter() - t)
+
+            progresso = app.get("/progresso-lote", params={"lote_id": lote_id}).json()
+            if progresso["pendentes"] == 0 and progresso["estado"] != "executando":
+                # 429/5xx viram reprocessamento: o lote só acaba quando a fila esvazia.
+                if not soma_metrica(app.metricas(), "fgts_clt_reprocessamento_fila"):
+                    break
+            if time.perf_counter() - inicio > args.limite_lote:
+                print(f"Lote {lote_id} não terminou em {args.limite_lote}s; seguindo com o parcial.")
+                break
+        duracao = time.perf_counter() - inicio
+
+    resultado["lote"] = {
+        "segundos": round(duracao, 3),
+        "concluidos": progresso["concluidos"],
+        "cpfs_por_segundo": round(progresso["concluidos"] / duracao, 1),
+        "estado": progresso["estado"],
+    }
+    resultado["status_cursor"] = percentis(status_cursor)
+    resultado["status_completo"] = percentis(status_completo)
+
+    # /consultar síncrono: CPFs novos vão à Facta, CPFs do lote saem do cache.
+    amostras = min(args.amostras_consultar, tamanho)
+    for nome, lista in (
+        ("consultar_facta", gerar_cpfs(amostras, semente=f"consultar-{tamanho}")),
+        ("consultar_cache", random.Random(tamanho).sample(cpfs, amostras)),
+    ):
+        latencias = []
+        for cpf in lista:
+            t = time.perf_counter()
+            app.post("/consultar", {"lote_id": f"{lote_id}-{nome}", "cpfs": [cpf]}).raise_for_status()
+            latencias.append(time.perf_counter() - t)
+        resultado[nome] = percentis(latencias)
+
+    resultado["exportar"] = {}
+    for formato in ("xlsx", "csv.gz"):
+        medidas = {}
+        for origem in ("gerado", "cache"):
+            t = time.perf_counter()
+            resposta = app.get("/exportar-lote", params={"lote_id": lote_id, "formato": formato})
+            resposta.raise_for_status()
+            medidas[f"{origem}_ms"] = round((time.perf_counter() - t) * 1000, 1)
+        medidas["bytes"] = len(resposta.content)
+        resultado["exportar"][formato] = medidas
+
+    delta = diferenca(app.metricas(), antes)
+    commits = soma_metrica(delta, "fgts_clt_sqlite_commit_segundos_count")
+    resultado["sqlite"] = {
+        "commits": int(commits),
+        "operacoes_por_commit": round(
+            soma_metrica(delta, "fgts_clt_sqlite_operacoes_por_commit_sum") / commits, 2
+        ) if commits else None,
+        "commit_p99_ms": quantil_histograma(delta, "fgts_clt_sqlite_commit_segundos", 0.99),
+        "escrita_p50_ms": quantil_histograma(delta, "fgts_clt_sqlite_escrita_segundos", 0.50),
+        "escrita_p99_ms": quantil_histograma(delta, "fgts_clt_sqlite_escrita_segundos", 0.99),
+        "leitura_p99_ms": quantil_histograma(delta, "fgts_clt_sqlite_leitura_segundos", 0.99),
+        "fila_escrita_maxima": amostrador.fila_maxima,
+    }
+    resultado["facta"] = {
+        "respostas": {
+            status: int(soma_metrica(delta, "fgts_clt_http_respostas_total", f'status="{status}"'))
+            for status in ("200", "429", "500", "503")
+        },
+        "cpfs_do_cache": int(soma_metrica(delta, "fgts_clt_cpfs_processados_total", 'origem="cache"')),
+    }
+    resultado["rss_amostrado_mb"] = round(amostrador.rss_maximo_kb / 1024, 1)
+    print(json.dumps(resultado, ensure_ascii=False))
+    return resultado
+
+
+def _valor(relatorio, tamanho, caminho):
+    atual = next((r for r in relatorio["resultados"] if r["tamanho"] == tamanho), None)
+    if atual is None:
+        return None
+    if caminho == "rss_pico_mb":
+        return relatorio.get("rss_pico_mb")
+    # Os nomes de formato têm ponto (csv.gz): tenta o caminho mais longo primeiro.
+    partes = caminho.split(".")
+    while partes and isinstance(atual, dict):
+        for i in range(len(partes), 0, -1):
+            chave = ".".join(partes[:i])
+            if chave in atual:
+                atual, partes = atual[chave], partes[i:]
+                break
+        else:
+            return None
+    return atual if not partes and isinstance(atual, (int, float)) else None
+
+
+def comparar(relatorio, base, tolerancia):
+    regressoes = []
+    for resultado in relatorio["resultados"]:
+        tamanho = resultado["tamanho"]
+        for caminho, maior_melhor in COMPARADAS:
+            novo, antigo = _valor(relatorio, tamanho, caminho), _valor(base, tamanho, caminho)
+            if novo is None or not antigo:
+                continue
+            variacao = (novo - antigo) / antigo
+            if (-variacao if maior_melhor else variacao) > tolerancia:
+                regressoes.append({
+                    "tamanho": tamanho,
+                    "metrica": caminho,
+                    "base": antigo,
+                    "atual": novo,
+                    "variacao_percentual": round(100 * variacao, 1),
+                })
+    return regressoes
+
+
+def main():
+    parser = argumentos(argparse.ArgumentParser(description="Benchmark de ponta a ponta do FGTS-CLT."))
+    parser.add_argument("--tamanhos", default="1000,10000", help="tamanhos de lote separados por vírgula")
+    parser.add_argument("--concorrencia", type=int, default=10)
+    parser.add_argument("--amostras-consultar", type=int, default=100)
+    parser.add_argument("--amostras-status", type=int, default=30)
+    parser.add_argument("--intervalo-status", type=float, default=0.5)
+    parser.add_argument(
+        "--reprocessamento-base", type=float, default=1.0,
+        help="REPROCESSAMENTO_BASE do app (s); menor que o padrão para o lote não esperar 15s por 429",
+    )
+    parser.add_argument(
+        "--credenciais", type=int, default=1,
+        help="contas no FACTA_CREDENCIAIS do app; com --limite-por-credencial mostra o ganho do pool",
+    )
+    parser.add_argument("--limite-lote", type=float, default=3600, help="tempo máximo por lote (s)")
+    parser.add_argument("--saida", help="arquivo JSON para o relatório")
+    parser.add_argument("--comparar", help="relatório anterior usado como linha de base")
+    parser.add_argument("--tolerancia", type=float, default=0.2, help="piora relativa aceita (0.2 = 20%%)")
+    parser.add_argument("--manter-pasta", action="store_true", help="não apaga o banco e o log do app")
+    args = parser.parse_args()
+    if args.semente is None:
+        args.semente = 42
+
+    servidor, estado, url_simulador = iniciar_simulador(configuracao(args))
+    env_app = {"REPROCESSAMENTO_BASE": str(args.reprocessamento_base)}
+    if args.credenciais > 1:
+        env_app["FACTA_CREDENCIAIS"] = ",".join(
+            f"conta{i}=Basic {base64.b64encode(f'conta{i}:bench'.encode()).decode()}"
+            for i in range(1, args.credenciais + 1)
+        )
+    app = AppEmTeste(url_simulador, env_app)
+    app.iniciar()
+    print(f"Simulador em {url_simulador}, app em {app.base} (pasta {app.pasta})")
+
+    relatorio = {
+        "gerado_em": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": sys.version.split()[0],
+        "parametros": {k: v for k, v in vars(args).items() if k not in ("saida", "comparar")},
+        "resultados": [],
+    }
+    try:
+        for tamanho in (int(t) for t in args.tamanhos.split(",") if t.strip()):
+            relatorio["resultados"].append(medir_tamanho(app, tamanho, args))
+        pico = rss_kb(app.processo.pid, "VmHWM")
+        relatorio["rss_pico_mb"] = round(pico / 1024, 1) if pico else None
+        relatorio["simulador"] = estado.estatisticas()
+    finally:
+        app.encerrar(args.manter_pasta)
+        servidor.shutdown()
+
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump(relatorio, f, ensure_ascii=False, indent=2)
+        print(f"Relatório salvo em {args.saida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            base = json.load(f)
+        regressoes = comparar(relatorio, base, args.tolerancia)
+        for r in regressoes:
+            print(
+                f"REGRESSÃO {r['tamanho']} CPFs {r['metrica']}: "
+                f"{r['base']} -> {r['atual']} ({r['variacao_percentual']:+}%)"
+            )
+        if regressoes:
+            sys.exit(1)
+        print(f"Sem regressões acima de {args.tolerancia:.0%} em relação a {args.comparar}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+# Simulador local da API da Facta (gera-token e autoriza-consulta).
+#
+#   python bench/simulador_facta.py --porta 8900 --latencia-mediana 0.08 --taxa-429 0.02
+#
+# e depois subir o app apontando para ele:
+#   FACTA_TOKEN_URL=http://127.0.0.1:8900/gera-token \
+#   FACTA_API_URL=http://127.0.0.1:8900/consignado-trabalhador/autoriza-consulta python app.py
+
+import argparse
+import base64
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class ConfiguracaoSimulador:
+    def __init__(
+        self,
+        latencia_mediana=0.08,
+        latencia_sigma=0.5,
+        latencia_token=0.05,
+        taxa_erro=0.0,
+        taxa_429=0.0,
+        taxa_sem_dados=0.1,
+        taxa_elegivel=0.6,
+        validade_token=59 * 60,
+        limite_por_credencial=0,
+        queda_a_cada=0.0,
+        queda_duracao=0.0,
+        modo_queda="503",
+        semente=None,
+    ):
+        self.latencia_mediana = latencia_mediana
+        self.latencia_sigma = latencia_sigma
+        self.latencia_token = latencia_token
+        self.taxa_erro = taxa_erro
+        self.taxa_429 = taxa_429
+        self.taxa_sem_dados = taxa_sem_dados
+        self.taxa_elegivel = taxa_elegivel
+        self.validade_token = validade_token
+        self.limite_por_credencial = limite_por_credencial
+        self.queda_a_cada = queda_a_cada
+        self.queda_duracao = queda_duracao
+        self.modo_queda = modo_queda
+        self.aleatorio = random.Random(semente)
+
+
+class EstadoSimulador:
+    def __init__(self, config):
+        self.config = config
+        self.inicio = time.monotonic()
+        self.tokens = {}
+        self.lock = threading.Lock()
+        self.contadores = {}
+        self.em_voo = 0
+        self.pico_em_voo = 0
+        self.em_voo_credencial = {}
+        self.consultas_credencial = {}
+
+    def contar(self, chave):
+        with self.lock:
+            self.contadores[chave] = self.contadores.get(chave, 0) + 1
+
+    def fora_do_ar(self):
+        c = self.config
+        if c.queda_a_cada <= 0 or c.queda_duracao <= 0:
+            return False
+        return (time.monotonic() - self.inicio) % c.queda_a_cada >= c.queda_a_cada - c.queda_duracao
+
+    def latencia(self):
+        c = self.config
+        with self.lock:
+            return c.latencia_mediana * math.exp(c.aleatorio.gauss(0, c.latencia_sigma))
+
+    def sortear(self, taxa):
+        with self.lock:
+            return self.config.aleatorio.random() < taxa
+
+    def estatisticas(self):
+        with self.lock:
+            return {
+                "contadores": dict(self.contadores),
+                "tokens_validos": sum(1 for e, _ in self.tokens.values() if e > time.time()),
+                "pico_em_voo": self.pico_em_voo,
+                "consultas_por_credencial": dict(self.consultas_credencial),
+            }
+
+
+def _usuario(credencial):
+    try:
+        return base64.b64decode(credencial.removeprefix("Basic ")).decode().partition(":")[0]
+    except ValueError:
+        return "?"
+
+
+def _trabalhador(cpf, elegivel):
+    semente = int(hashlib.sha1(cpf.encode()).hexdigest()[:8], 16)
+    return {
+        "nome": f"Trabalhador {semente % 100000:05d}",
+        "dataNascimento": f"{1 + semente % 28:02d}/{1 + semente % 12:02d}/{1960 + semente % 40}",
+        "dataAdmissao": f"{1 + semente % 28:02d}/{1 + (semente >> 4) % 12:02d}/{2000 + semente % 24}",
+        "valorTotalVencimentos": f"{1500 + semente % 8000},{semente % 100:02d}",
+        "valorMargemDisponivel": f"{(semente % 2500) if elegivel else 0},{semente % 100:02d}",
+        "elegivel": "SIM" if elegivel else "NAO",
+    }
+
+
+def criar_handler(estado):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _responder(self, status, corpo):
+            dados = json.dumps(corpo, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(dados)))
+            self.end_headers()
+            self.wfile.write(dados)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            with estado.lock:
+                estado.em_voo += 1
+                estado.pico_em_voo = max(estado.pico_em_voo, estado.em_voo)
+            try:
+                if url.path.endswith("/gera-token"):
+                    self._gera_token()
+                elif url.path.endswith("/autoriza-consulta"):
+                    self._autoriza_consulta(parse_qs(url.query))
+                elif url.path == "/estatisticas":
+                    self._responder(200, estado.estatisticas())
+                else:
+                    self._responder(404, {"erro": True, "mensagem": "Rota inexistente"})
+            finally:
+                with estado.lock:
+                    estado.em_voo -= 1
+
+        def _queda(self):
+            if not estado.fora_do_ar():
+                return False
+            estado.contar("queda")
+            if estado.config.modo_queda == "timeout":
+                time.sleep(60)
+            self._responder(503, {"erro": True, "mensagem": "Serviço indisponível"})
+            return True
+
+        def _gera_token(self):
+            time.sleep(estado.config.latencia_token)
+            if self._queda():
+                return
+            credencial = self.headers.get("Authorization", "")
+            if not credencial.startswith("Basic "):
+                estado.contar("token_401")
+                self._responder(401, {"erro": True, "mensagem": "Credenciais inválidas"})
+                return
+            token = uuid.uuid4().hex
+            with estado.lock:
+                estado.tokens[token] = (time.time() + estado.config.validade_token, credencial)
+            estado.contar("token_gerado")
+            self._responder(200, {"erro": False, "mensagem": "Token gerado", "token": token})
+
+        def _autoriza_consulta(self, params):
+            token = self.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+            with estado.lock:
+                expira_em, credencial = estado.tokens.get(token, (0, None))
+                em_voo = estado.em_voo_credencial.get(credencial, 0) + 1
+                estado.em_voo_credencial[credencial] = em_voo
+            try:
+                time.sleep(estado.latencia())
+                if self._queda():
+                    return
+                if expira_em < time.time():
+                    estado.contar("token_invalido")
+                    self._responder(200, {"erro": True, "mensagem": "Token inválido ou expirado"})
+                    return
+                # Cota por conta: acima do limite de chamadas simultâneas da credencial, 429.
+                if 0 < estado.config.limite_por_credencial < em_voo:
+                    estado.contar("429_cota")
+                    self._responder(429, {"erro": True, "mensagem": "Limite de requisições excedido"})
+                    return
+                self._consultar(params, credencial)
+            finally:
+                with estado.lock:
+                    estado.em_voo_credencial[credencial] -= 1
+
+        def _consultar(self, params, credencial):
+            if estado.sortear(estado.config.taxa_429):
+                estado.contar("429")
+                self._responder(429, {"erro": True, "mensagem": "Limite de requisições excedido"})
+                return
+            if estado.sortear(estado.config.taxa_erro):
+                estado.contar("500")
+                self._responder(500, {"erro": True, "mensagem": "Erro interno"})
+                return
+
+            cpf = (params.get("cpf") or [""])[0]
+            estado.contar("consulta")
+            usuario = _usuario(credencial)
+            with estado.lock:
+                estado.consultas_credencial[usuario] = estado.consultas_credencial.get(usuario, 0) + 1
+            if estado.sortear(estado.config.taxa_sem_dados):
+                self._responder(200, {"erro": False, "mensagem": "Nenhum vínculo encontrado", "dados_trabalhador": {"dados": []}})
+                return
+
+            elegivel = int(hashlib.md5(cpf.encode()).hexdigest()[:4], 16) / 0xFFFF < estado.config.taxa_elegivel
+            self._responder(200, {
+                "erro": False,
+                "mensagem": "Consulta autorizada" if elegivel else "Trabalhador não elegível",
+                "dados_trabalhador": {"dados": [_trabalhador(cpf, elegivel)]},
+            })
+
+    return Handler
+
+
+def iniciar_simulador(config=None, host="127.0.0.1", porta=0):
+    estado = EstadoSimulador(config or ConfiguracaoSimulador())
+    servidor = ThreadingHTTPServer((host, porta), criar_handler(estado))
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, estado, f"http://{host}:{servidor.server_address[1]}"
+
+
+def argumentos(parser=None):
+    parser = parser or argparse.ArgumentParser(description="Simulador local da API da Facta.")
+    parser.add_argument("--latencia-mediana", type=float, default=0.08, help="mediana da latência (s), lognormal")
+    parser.add_argument("--latencia-sigma", type=float, default=0.5, help="sigma da lognormal")
+    parser.add_argument("--taxa-erro", type=float, default=0.0, help="fração de respostas HTTP 500")
+    parser.add_argument("--taxa-429", type=float, default=0.0, help="fração de respostas HTTP 429")
+    parser.add_argument("--taxa-sem-dados", type=float, default=0.1, help="fração de respostas sem vínculo")
+    parser.add_argument("--validade-token", type=float, default=59 * 60, help="validade do token (s)")
+    parser.add_argument(
+        "--limite-por-credencial", type=int, default=0,
+        help="chamadas simultâneas por credencial antes de responder 429; 0 desliga",
+    )
+    parser.add_argument("--queda-a-cada", type=float, default=0.0, help="período entre quedas (s); 0 desliga")
+    parser.add_argument("--queda-duracao", type=float, default=0.0, help="duração de cada queda (s)")
+    parser.add_argument("--modo-queda", choices=("503", "timeout"), default="503")
+    parser.add_argument("--semente", type=int, default=None)
+    return parser
+
+
+def configuracao(args):
+    return ConfiguracaoSimulador(
+        latencia_mediana=args.latencia_mediana,
+        latencia_sigma=args.latencia_sigma,
+        taxa_erro=args.taxa_erro,
+        taxa_429=args.taxa_429,
+        taxa_sem_dados=args.taxa_sem_dados,
+        validade_token=args.validade_token,
+        limite_por_credencial=args.limite_por_credencial,
+        queda_a_cada=args.queda_a_cada,
+        queda_duracao=args.queda_duracao,
+        modo_queda=args.modo_queda,
+        semente=args.semente,
+    )
+
+
+if __name__ == "__main__":
+    parser = argumentos()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=8900)
+    args = parser.parse_args()
+
+    servidor, estado, base = iniciar_simulador(configuracao(args), args.host, args.porta)
+    print(f"Simulador da Facta em {base} (estatísticas em {base}/estatisticas)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        servidor.shutdown()
@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from database import COLUNAS_RESULTADO
+from metricas import registro
+
+CACHE_TTL_POSITIVO = float(os.environ.get("CACHE_TTL_POSITIVO", "3600"))
+CACHE_TTL_NEGATIVO = float(os.environ.get("CACHE_TTL_NEGATIVO", "1800"))
+CACHE_LRU_TAMANHO = int(os.environ.get("CACHE_LRU_TAMANHO", "50000"))
+
+CACHE_CONSULTAS = registro.contador(
+    "cache_consultas_total", "Buscas no cache de resultados por CPF.", ("resultado",)
+)
+
+
+class CacheResultados:
+    def __init__(
+        self,
+        persistencia,
+        ttl_positivo=CACHE_TTL_POSITIVO,
+        ttl_negativo=CACHE_TTL_NEGATIVO,
+        tamanho=CACHE_LRU_TAMANHO,
+    ):
+        self.persistencia = persistencia
+        self.ttl_positivo = ttl_positivo
+        self.ttl_negativo = ttl_negativo
+        self.tamanho = tamanho
+
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits_memoria = 0
+        self._hits_banco = 0
+        self._misses = 0
+
+    def ttl(self, resultado):
+        return self.ttl_positivo if resultado.get("status") == "Autorizado" else self.ttl_negativo
+
+    def _fresco(self, consultado_em, resultado):
+        return consultado_em is not None and time.time() - consultado_em < self.ttl(resultado)
+
+    def buscar(self, cpf):
+        if self.ttl_positivo <= 0 and self.ttl_negativo <= 0:
+            return None
+
+        with self._lock:
+            item = self._lru.get(cpf)
+            if item is not None:
+                if self._fresco(*item):
+                    self._lru.move_to_end(cpf)
+                    self._hits_memoria += 1
+                    CACHE_CONSULTAS.inc(resultado="hit_memoria")
+                    return item
+                del self._lru[cpf]
+
+        with self.persistencia.leitura() as conn:
+            row = conn.execute(
+                f"""
+                SELECT consultado_em, {', '.join(COLUNAS_RESULTADO)} FROM consultas
+                WHERE cpf = ? AND consultado_em IS NOT NULL
+                ORDER BY consultado_em DESC LIMIT 1
+                """,
+                (cpf,)
+            ).fetchone()
+
+        if row is not None:
+            item = (row[0], dict(zip(COLUNAS_RESULTADO, row[1:])))
+            if self._fresco(*item):
+                self._guardar(cpf, item)
+                with self._lock:
+                    self._hits_banco += 1
+                CACHE_CONSULTAS.inc(resultado="hit_banco")
+                return item
+
+        with self._lock:
+            self._misses += 1
+        CACHE_CONSULTAS.inc(resultado="miss")
+        return None
+
+    def guardar(self, cpf, resultado, consultado_em):
+        self._guardar(cpf, (consultado_em, {k: resultado.get(k) for k in COLUNAS_RESULTADO}))
+
+    def _guardar(self, cpf, item):
+        with self._lock:
+            self._lru[cpf] = item
+            self._lru.move_to_end(cpf)
+            while len(self._lru) > self.tamanho:
+                self._lru.popitem(last=False)
+
+    def estatisticas(self):
+        with self._lock:
+            hits = self._hits_memoria + self._hits_banco
+            total = hits + self._misses
+            return {
+                "itens_memoria": len(self._lru),
+                "hits_memoria": self._hits_memoria,
+                "hits_banco": self._hits_banco,
+                "misses": self._misses,
+                "hit_ratio": round(hits / total, 3) if total else 0,
+                "ttl_positivo": self.ttl_positivo,
+                "ttl_negativo": self.ttl_negativo,
+            }
@@ -0,0 +1,172 @@
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+from limitador import CircuitoAberto, DisjuntorCircuito, LimitadorAdaptativo
+from metricas import registro
+from token_manager import CredencialRecusada
+
+log = logging.getLogger(__name__)
+
+# Falhas seguidas de autenticação (ou 429 com o AIMD no mínimo) que tiram a credencial de circulação.
+CREDENCIAL_FALHAS_QUARENTENA = int(os.environ.get("CREDENCIAL_FALHAS_QUARENTENA", "3"))
+CREDENCIAL_QUARENTENA = float(os.environ.get("CREDENCIAL_QUARENTENA", "60"))
+CREDENCIAL_QUARENTENA_MAXIMA = float(os.environ.get("CREDENCIAL_QUARENTENA_MAXIMA", "900"))
+
+CREDENCIAL_CHAMADAS = registro.contador(
+    "credencial_chamadas_total", "Chamadas à Facta por credencial e resultado (ok/429/erro/auth).",
+    ("credencial", "resultado")
+)
+CREDENCIAL_QUARENTENAS = registro.contador(
+    "credencial_quarentenas_total", "Vezes que uma credencial foi posta em quarentena.", ("credencial", "motivo")
+)
+
+
+def ler_credenciais(texto, padrao):
+    # "conta1=Basic xxx,conta2=Basic yyy"; sem nada configurado vale só o cabeçalho padrão.
+    credenciais = {}
+    for i, item in enumerate(texto.split(","), 1):
+        if not item.strip():
+            continue
+        nome, _, cabecalho = item.partition("=")
+        nome, cabecalho = nome.strip(), cabecalho.strip()
+        if not re.fullmatch(r"[\w-]+", nome) or not cabecalho:
+            raise ValueError(f"FACTA_CREDENCIAIS: item {i} deve ser nome=cabeçalho Authorization")
+        if nome in credenciais:
+            raise ValueError(f"FACTA_CREDENCIAIS: credencial {nome} repetida")
+        credenciais[nome] = cabecalho
+    return list(credenciais.items()) or [("padrao", padrao)]
+
+
+def falha_de_credencial(erro):
+    # Conta recusada pela Facta; rede e 5xx ficam com o disjuntor, não com a quarentena.
+    return isinstance(erro, CredencialRecusada) or isinstance(erro.__cause__, CredencialRecusada)
+
+
+class Credencial:
+    def __init__(self, nome, token, limitador=None, disjuntor=None):
+        self.nome = nome
+        self.token = token
+        self.limitador = limitador or LimitadorAdaptativo()
+        self.disjuntor = disjuntor or DisjuntorCircuito(nome=nome)
+
+        self.quarentena_ate = 0.0
+        self.motivo = None
+        self.quarentenas = 0
+        self._falhas_seguidas = 0
+        self._tempo_quarentena = CREDENCIAL_QUARENTENA
+
+    def em_quarentena(self, agora=None):
+        return (agora or time.monotonic()) < self.quarentena_ate
+
+    def estatisticas(self):
+        restante = self.quarentena_ate - time.monotonic()
+        return {
+            "nome": self.nome,
+            "quarentena_s": round(restante, 1) if restante > 0 else 0,
+            "motivo_quarentena": self.motivo if restante > 0 else None,
+            "quarentenas": self.quarentenas,
+            "falhas_seguidas": self._falhas_seguidas,
+            "token": self.token.estatisticas(),
+            "limitador": self.limitador.estatisticas(),
+            "disjuntor": self.disjuntor.estatisticas(),
+        }
+
+
+class PoolCredenciais:
+    def __init__(
+        self,
+        credenciais,
+        falhas_quarentena=CREDENCIAL_FALHAS_QUARENTENA,
+        quarentena_maxima=CREDENCIAL_QUARENTENA_MAXIMA,
+    ):
+        self.credenciais = list(credenciais)
+        self.falhas_quarentena = falhas_quarentena
+        self.quarentena_maxima = quarentena_maxima
+        self._cond = threading.Condition()
+
+    def iniciar(self):
+        for credencial in self.credenciais:
+            credencial.token.iniciar()
+
+    def parar(self):
+        for credencial in self.credenciais:
+            credencial.token.parar()
+
+    def capacidade(self):
+        agora = time.monotonic()
+        return sum(int(c.limitador.limite) for c in self.credenciais if not c.em_quarentena(agora))
+
+    def _tentar(self, agora):
+        # Menos carregada primeiro (em voo / limite do AIMD); empate sorteado para espalhar.
+        candidatas = [c for c in self.credenciais if not c.em_quarentena(agora) and c.disjuntor.disponivel()]
+        candidatas.sort(key=lambda c: (c.limitador.carga(), random.random()))
+        for credencial in candidatas:
+            if not credencial.limitador.adquirir(timeout=0):
+                continue
+            if credencial.disjuntor.permitir():
+                return credencial, True
+            credencial.limitador.devolver()
+        return None, bool(candidatas)
+
+    def adquirir(self, espera_maxima):
+        # Só há prazo quando nenhuma credencial está saudável; se estão todas ocupadas,
+        # espera a vaga como o limitador sempre fez.
+        prazo = time.monotonic() + espera_maxima
+        with self._cond:
+            while True:
+                agora = time.monotonic()
+                credencial, saudaveis = self._tentar(agora)
+                if credencial is not None:
+                    return credencial
+                if not saudaveis and agora >= prazo:
+                    raise CircuitoAberto("Facta indisponível (nenhuma credencial disponível)")
+                # Quarentena e disjuntor vencem sem aviso: daí o teto na espera.
+                self._cond.wait(0.25)
+
+    def liberar(self, credencial, latencia, resultado):
+        # 429 acima da cota é o AIMD sondando e ele mesmo recua; só conta para disjuntor e
+        # quarentena quando a credencial é barrada mesmo com a concorrência já no mínimo.
+        barrada = resultado == "429" and credencial.limitador.limite <= credencial.limitador.minimo
+        credencial.limitador.liberar(latencia, resultado in ("429", "erro"))
+        credencial.disjuntor.registrar(resultado != "erro" and not barrada)
+        CREDENCIAL_CHAMADAS.inc(credencial=credencial.nome, resultado=resultado)
+
+        with self._cond:
+            if resultado == "auth" or barrada:
+                credencial._falhas_seguidas += 1
+                if credencial._falhas_seguidas >= self.falhas_quarentena:
+                    self._quarentena(credencial, resultado)
+            elif resultado == "ok" and not credencial.em_quarentena():
+                credencial._falhas_seguidas = 0
+                credencial._tempo_quarentena = CREDENCIAL_QUARENTENA
+            self._cond.notify_all()
+
+    def _quarentena(self, credencial, motivo):
+        agora = time.monotonic()
+        if credencial.em_quarentena(agora):
+            return
+        # A última credencial em circulação fica: sem ela não sobraria nada para atender.
+        if not any(c is not credencial and not c.em_quarentena(agora) for c in self.credenciais):
+            return
+        credencial.quarentena_ate = agora + credencial._tempo_quarentena
+        credencial.motivo = motivo
+        credencial.quarentenas += 1
+        # Na volta uma falha só já basta para outra quarentena, com o dobro do tempo.
+        credencial._falhas_seguidas = self.falhas_quarentena - 1
+        CREDENCIAL_QUARENTENAS.inc(credencial=credencial.nome, motivo=motivo)
+        log.warning(
+            "Credencial em quarentena",
+            extra={
+                "credencial": credencial.nome,
+                "motivo": motivo,
+                "segundos": round(credencial._tempo_quarentena),
+            },
+        )
+        credencial._tempo_quarentena = min(self.quarentena_maxima, credencial._tempo_quarentena * 2)
+
+    def estatisticas(self):
+        return [c.estatisticas() for c in self.credenciais]
@@ -1,24 +1,405 @@
+import logging
+import re
 import sqlite3
+import time
 
-def init_db(db_path="consultas.db"):
-    conn = sqlite3.connect(db_path)
+log = logging.getLogger(__name__)
+
+COLUNAS_RESULTADO = {
+    "nome": "TEXT",
+    "data_nascimento": "TEXT",
+    "data_admissao": "TEXT",
+    "valor_liberado": "REAL",
+    "margem": "REAL",
+    "elegivel": "TEXT",
+    "status": "TEXT",
+    "mensagem": "TEXT",
+}
+
+CAMPOS_LEGADOS = {
+    "Nome": "nome",
+    "Data Nascimento": "data_nascimento",
+    "Data Admissao": "data_admissao",
+    "Valor Liberado": "valor_liberado",
+    "Margem": "margem",
+    "Elegível": "elegivel",
+    "Status": "status",
+    "Mensagem": "mensagem",
+}
+
+SELECT_RESULTADO = (
+    "cpf, nome, data_nascimento, data_admissao, valor_liberado, margem, "
+    "elegivel, status, mensagem, data"
+)
+
+# Cada escrita em consultas recebe o próximo seq global; /status-lote usa
+# (lote_id, seq) como cursor para devolver só o que mudou. Linhas podadas pelo
+# arquivamento continuam contando, para um seq nunca ser reaproveitado.
+PROXIMO_SEQ = (
+    "(SELECT MAX(COALESCE((SELECT MAX(seq) FROM consultas), 0), "
+    "COALESCE((SELECT MAX(max_seq) FROM lotes_arquivados), 0)) + 1)"
+)
+
+
+def _prefixo(coluna, prefixo):
+    # Faixa de texto em vez de LIKE: dentro dos gatilhos, chamar qualquer função
+    # SQL custa ~10µs por linha e dobrava o tempo do /registrar-lote.
+    fim = prefixo[:-1] + chr(ord(prefixo[-1]) + 1)
+    return f"CASE WHEN {coluna} >= '{prefixo}' AND {coluna} < '{fim}' THEN 1 ELSE 0 END"
+
+
+# Contribuição de uma linha de consultas para cada contador de resumo_lotes;
+# "{r}" vira NEW ou OLD dentro dos gatilhos e a própria tabela no recálculo.
+CONTADORES_RESUMO = {
+    "total": "1",
+    "pendentes": "({r}.status IS 'Pendente')",
+    "reprocessando": _prefixo("{r}.status", "Reprocessando"),
+    "autorizados": "({r}.status IS 'Autorizado')",
+    "nao_autorizados": "({r}.status IS 'Não autorizado')",
+    "falhas": _prefixo("{r}.status", "Falhou"),
+    "cancelados": "({r}.status IS 'Cancelado')",
+    "elegiveis": "({r}.elegivel IS 'SIM')",
+    "com_margem": "({r}.margem IS NOT NULL)",
+    "soma_margem": "CASE WHEN {r}.margem IS NULL THEN 0 ELSE {r}.margem END",
+}
+
+_REGEX_LEGADO = re.compile(
+    r"(?:^|,\s*)(" + "|".join(re.escape(k) for k in CAMPOS_LEGADOS) + r"):\s?"
+)
+
+
+def para_numero(valor):
+    if valor is None or isinstance(valor, (int, float)):
+        return valor
+    texto = str(valor).strip().replace("R$", "").strip()
+    if not texto or texto == "-":
+        return None
+    if "," in texto:
+        texto = texto.replace(".", "").replace(",", ".")
+    try:
+        return float(texto)
+    except ValueError:
+        return None
+
+
+def colunas_resultado(resultado):
+    valores = []
+    for campo in COLUNAS_RESULTADO:
+        valor = resultado.get(campo)
+        if campo in ("valor_liberado", "margem"):
+            valor = para_numero(valor)
+        elif valor in ("-", ""):
+            valor = None
+        valores.append(valor)
+    return tuple(valores)
+
+
+def interpretar_resultado_legado(resultado):
+    texto = (resultado or "").strip()
+    if not texto:
+        return {}
+    if texto == "Pendente":
+        return {"status": "Pendente"}
+
+    marcas = list(_REGEX_LEGADO.finditer(texto))
+    if not marcas:
+        return {"mensagem": texto}
+
+    partes = {}
+    for i, marca in enumerate(marcas):
+        fim = marcas[i + 1].start() if i + 1 < len(marcas) else len(texto)
+        # Falhas antigas anexavam novos campos ao texto: vale o último valor.
+        partes[CAMPOS_LEGADOS[marca.group(1)]] = texto[marca.end():fim].strip()
+    return partes
+
+
+def formatar_linha(row):
+    cpf, nome, nascimento, admissao, valor_liberado, margem, elegivel, status, mensagem, data = row
+    return {
+        "CPF": (cpf or "").strip().zfill(11),
+        "Nome": nome or "-",
+        "Data Nascimento": nascimento or "-",
+        "Data Admissao": admissao or "-",
+        "Valor Liberado": valor_liberado if valor_liberado is not None else "-",
+        "Margem": margem if margem is not None else "-",
+        "Elegível": elegivel or "-",
+        "Status": status or "-",
+        "Mensagem": mensagem or "-",
+        "Data": data,
+    }
+
+
+def _colunas_existentes(c, tabela):
+    return {row[1] for row in c.execute(f"PRAGMA table_info({tabela})")}
+
+
+def migrar_resultados_legados(conn, tamanho_bloco=5000):
     c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS consultas (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            cpf TEXT,
-            data TEXT,
-            resultado TEXT
-            lote_id TEXT
+    migrados = 0
+    ultimo_id = 0
+    while True:
+        rows = c.execute(
+            """
+            SELECT id, resultado FROM consultas
+            WHERE id > ? AND status IS NULL AND resultado IS NOT NULL
+            ORDER BY id LIMIT ?
+            """,
+            (ultimo_id, tamanho_bloco)
+        ).fetchall()
+        if not rows:
+            break
+
+        atualizacoes = []
+        for id_, resultado in rows:
+            partes = interpretar_resultado_legado(resultado)
+            partes.setdefault("status", "-")
+            atualizacoes.append(colunas_resultado(partes) + (id_,))
+
+        c.executemany(
+            f"UPDATE consultas SET {', '.join(f'{k}=?' for k in COLUNAS_RESULTADO)} WHERE id=?",
+            atualizacoes
+        )
+        migrados += len(atualizacoes)
+        ultimo_id = rows[-1][0]
+
+    if migrados:
+        log.info("Resultados antigos migrados para colunas", extra={"migrados": migrados})
+    return migrados
+
+
+def _somar_resumo(linha):
+    # Garante a linha do lote e depois soma: um UPSERT por linha inserida custava o dobro.
+    incrementos = ", ".join(f"{k} = {k} + {e.format(r=linha)}" for k, e in CONTADORES_RESUMO.items())
+    return f"""
+        INSERT INTO resumo_lotes (lote_id, criado_em) SELECT {linha}.lote_id, {linha}.atualizado_em
+        WHERE {linha}.lote_id IS NOT NULL
+            AND NOT EXISTS (SELECT 1 FROM resumo_lotes WHERE lote_id = {linha}.lote_id);
+        UPDATE resumo_lotes SET {incrementos}, versao = versao + 1,
+            atualizado_em = CASE WHEN {linha}.atualizado_em IS NULL THEN atualizado_em ELSE {linha}.atualizado_em END
+        WHERE lote_id = {linha}.lote_id;
+    """
+
+
+def _subtrair_resumo(linha):
+    decrementos = ", ".join(f"{k} = {k} - {e.format(r=linha)}" for k, e in CONTADORES_RESUMO.items())
+    return f"""
+        UPDATE resumo_lotes SET {decrementos}, versao = versao + 1 WHERE lote_id = {linha}.lote_id;
+    """
+
+
+def criar_resumo_lotes(c):
+    # Os contadores são mantidos por gatilhos na mesma transação de cada escrita em
+    # consultas, então valem para todos os caminhos (lote, reprocessamento, cancelamento)
+    # e para outros processos usando o mesmo banco.
+    nova = not c.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='resumo_lotes'"
+    ).fetchone()
+    colunas = ",\n".join(
+        f"            {k} {'REAL' if k == 'soma_margem' else 'INTEGER'} NOT NULL DEFAULT 0"
+        for k in CONTADORES_RESUMO
+    )
+    c.execute(f"""
+        CREATE TABLE IF NOT EXISTS resumo_lotes (
+            lote_id TEXT PRIMARY KEY,
+            criado_em REAL,
+            atualizado_em REAL,
+            versao INTEGER NOT NULL DEFAULT 0,
+{colunas}
         )
     """)
+    if nova:
+        somas = ", ".join(f"SUM({e.format(r='consultas')})" for e in CONTADORES_RESUMO.values())
+        c.execute(f"""
+            INSERT INTO resumo_lotes (lote_id, criado_em, atualizado_em, versao, {", ".join(CONTADORES_RESUMO)})
+            SELECT lote_id, MIN(atualizado_em), MAX(atualizado_em), 1, {somas}
+            FROM consultas WHERE lote_id IS NOT NULL GROUP BY lote_id
+        """)
+    else:
+        # Resumos criados antes do preenchimento de atualizado_em nas linhas antigas.
+        c.execute("""
+            UPDATE resumo_lotes SET
+                criado_em = COALESCE(criado_em, (SELECT MIN(atualizado_em) FROM consultas
+                                                 WHERE consultas.lote_id = resumo_lotes.lote_id)),
+                atualizado_em = (SELECT MAX(atualizado_em) FROM consultas
+                                 WHERE consultas.lote_id = resumo_lotes.lote_id)
+            WHERE atualizado_em IS NULL
+        """)
+
+    # Recriados a cada subida para que mudanças na definição cheguem aos bancos existentes.
+    for gatilho in ("insert", "delete", "update"):
+        c.execute(f"DROP TRIGGER IF EXISTS trg_resumo_lotes_{gatilho}")
+    c.execute(f"""
+        CREATE TRIGGER trg_resumo_lotes_insert AFTER INSERT ON consultas
+        WHEN NEW.lote_id IS NOT NULL
+        BEGIN {_somar_resumo("NEW")} END
+    """)
+    # Linhas podadas pelo arquivamento continuam contando no resumo do lote.
+    c.execute(f"""
+        CREATE TRIGGER trg_resumo_lotes_delete AFTER DELETE ON consultas
+        WHEN OLD.lote_id IS NOT NULL
+            AND NOT EXISTS (SELECT 1 FROM lotes_arquivados WHERE lote_id = OLD.lote_id)
+        BEGIN {_subtrair_resumo("OLD")} END
+    """)
+    # Renovação de lease e troca de seq não mexem nos contadores: só as colunas que contam.
+    c.execute(f"""
+        CREATE TRIGGER trg_resumo_lotes_update
+        AFTER UPDATE OF status, elegivel, margem, lote_id ON consultas
+        WHEN OLD.status IS NOT NEW.status OR OLD.elegivel IS NOT NEW.elegivel
+            OR OLD.margem IS NOT NEW.margem OR OLD.lote_id IS NOT NEW.lote_id
+        BEGIN {_subtrair_resumo("OLD")} {_somar_resumo("NEW")} END
+    """)
+
+
+def init_db(db_path="consultas.db"):
+    # Transação controlada à mão (isolation_level=None); a espera longa cobre a migração
+    # feita por outro processo.
+    conn = sqlite3.connect(db_path, timeout=300, isolation_level=None)
+    c = conn.cursor()
+    # Só pega em banco novo (antes da primeira tabela); bancos antigos são convertidos
+    # à parte, pelo POST /arquivar com converter_banco, porque exigem um VACUUM completo.
+    c.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    c.execute("PRAGMA journal_mode=WAL")
+    # Todos os workers do gunicorn rodam isto ao subir: com BEGIN IMMEDIATE um de cada vez
+    # confere e migra o esquema, e os demais já encontram as colunas e tabelas prontas.
+    c.execute("BEGIN IMMEDIATE")
     try:
-        c.execute("ALTER TABLE consultas ADD COLUMN lote_id TEXT")
-    except Exception:
-        pass
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS consultas (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                cpf TEXT,
+                data TEXT,
+                resultado TEXT,
+                lote_id TEXT
+            )
+        """)
+        try:
+            c.execute("ALTER TABLE consultas ADD COLUMN lote_id TEXT")
+        except Exception:
+            pass
 
-    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_consultas_cpf_lote ON consultas(cpf, lote_id)")
-    c.execute("CREATE INDEX IF NOT EXISTS idx_consultas_lote_id ON consultas(lote_id)")
+        existentes = _colunas_existentes(c, "consultas")
+        novas = {
+            **COLUNAS_RESULTADO,
+            "seq": "INTEGER",
+            "atualizado_em": "REAL",
+            "consultado_em": "REAL",
+            "lease_dono": "TEXT",
+            "lease_expira": "REAL",
+        }
+        for coluna, tipo in novas.items():
+            if coluna not in existentes:
+                c.execute(f"ALTER TABLE consultas ADD COLUMN {coluna} {tipo}")
 
-    conn.commit()
+        c.execute(
+            "UPDATE consultas SET seq = (SELECT COALESCE(MAX(seq), 0) FROM consultas) + id "
+            "WHERE seq IS NULL"
+        )
+        # Linhas antigas só têm a data em texto (hora local); sem atualizado_em o lote
+        # nunca ficaria velho o bastante para o arquivamento.
+        c.execute(
+            "UPDATE consultas SET atualizado_em = CAST(strftime('%s', data, 'utc') AS REAL) "
+            "WHERE atualizado_em IS NULL AND data IS NOT NULL"
+        )
+
+        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_consultas_cpf_lote ON consultas(cpf, lote_id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_consultas_lote_id ON consultas(lote_id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_consultas_lote_status ON consultas(lote_id, status)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_consultas_lote_seq ON consultas(lote_id, seq)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_consultas_seq ON consultas(seq)")
+        c.execute(
+            "CREATE INDEX IF NOT EXISTS idx_consultas_cpf_consultado ON consultas(cpf, consultado_em) "
+            "WHERE consultado_em IS NOT NULL"
+        )
+
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS lotes (
+                lote_id TEXT PRIMARY KEY,
+                estado TEXT,
+                concorrencia INTEGER,
+                criado_em TEXT,
+                iniciado_em TEXT,
+                finalizado_em TEXT
+            )
+        """)
+        if "prioridade" not in _colunas_existentes(c, "lotes"):
+            c.execute("ALTER TABLE lotes ADD COLUMN prioridade INTEGER DEFAULT 1")
+
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS lotes_arquivados (
+                lote_id TEXT PRIMARY KEY,
+                caminho TEXT NOT NULL,
+                formato TEXT NOT NULL,
+                particao TEXT,
+                linhas INTEGER,
+                max_seq INTEGER,
+                bytes INTEGER,
+                arquivado_em REAL
+            )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_lotes_arquivados_max_seq ON lotes_arquivados(max_seq)")
+        criar_resumo_lotes(c)
+
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS tokens (
+                chave TEXT PRIMARY KEY,
+                token TEXT,
+                expira_em REAL,
+                renovando_ate REAL,
+                atualizado_em REAL
+            )
+        """)
+
+        fila_nova = not c.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='reprocessamentos'"
+        ).fetchone()
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS reprocessamentos (
+                cpf TEXT NOT NULL,
+                lote_id TEXT NOT NULL,
+                tentativas INTEGER NOT NULL DEFAULT 0,
+                proxima_em REAL NOT NULL,
+                ultimo_erro TEXT,
+                criado_em REAL,
+                PRIMARY KEY (cpf, lote_id)
+            )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_reprocessamentos_proxima ON reprocessamentos(proxima_em)")
+
+        migrar_resultados_legados(conn)
+
+        if fila_nova:
+            # A fila antiga ficava só em memória: recupera o que estava em reprocessamento.
+            c.execute("""
+                INSERT OR IGNORE INTO reprocessamentos (cpf, lote_id, tentativas, proxima_em, criado_em)
+                SELECT cpf, lote_id, 0, strftime('%s', 'now'), strftime('%s', 'now')
+                FROM consultas WHERE lote_id IS NOT NULL AND status LIKE 'Reprocessando%'
+            """)
+    except BaseException:
+        c.execute("ROLLBACK")
+        conn.close()
+        raise
+    c.execute("COMMIT")
+
+    if c.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        log.warning(
+            "Banco sem auto_vacuum incremental: o arquivamento não devolve espaço ao disco; "
+            "converta com POST /arquivar {\"converter_banco\": true} fora do horário de uso"
+        )
     conn.close()
+
+
+def converter_auto_vacuum(db_path):
+    # incremental_vacuum exige auto_vacuum=INCREMENTAL, e a mudança só vale após um VACUUM
+    # completo, que bloqueia as escritas de todos os processos enquanto roda.
+    conn = sqlite3.connect(db_path, timeout=300, isolation_level=None)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return None
+        inicio = time.perf_counter()
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        segundos = round(time.perf_counter() - inicio, 2)
+        log.info("Banco convertido para auto_vacuum incremental", extra={"segundos": segundos})
+        return segundos
+    finally:
+        conn.close()
@@ -0,0 +1,190 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+from database import SELECT_RESULTADO, formatar_linha
+
+log = logging.getLogger(__name__)
+
+EVENTOS_HISTORICO = int(os.environ.get("EVENTOS_HISTORICO", "2000"))
+EVENTOS_VARREDURA = float(os.environ.get("EVENTOS_VARREDURA", "2"))
+EVENTOS_HEARTBEAT = float(os.environ.get("EVENTOS_HEARTBEAT", "15"))
+EVENTOS_FILA_ASSINANTE = int(os.environ.get("EVENTOS_FILA_ASSINANTE", "10000"))
+
+
+class Assinante:
+    def __init__(self):
+        self.fila = queue.Queue(maxsize=EVENTOS_FILA_ASSINANTE)
+        self.atrasado = False
+
+
+class CanalLote:
+    def __init__(self, lote_id, cursor_banco):
+        self.lote_id = lote_id
+        self.assinantes = set()
+        self.vistos = set()
+        self.recentes = deque()
+        self.cursor_banco = cursor_banco
+
+
+class DifusorEventos:
+    def __init__(self, persistencia, historico=EVENTOS_HISTORICO, varredura=EVENTOS_VARREDURA):
+        self.persistencia = persistencia
+        self.historico = historico
+        self.varredura = varredura
+        self._canais = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._parar = threading.Event()
+        self._acordar = threading.Event()
+        self._publicados = 0
+        self._entregues = 0
+
+    def publicar(self, lote_id, seq, dados):
+        with self._lock:
+            canal = self._canais.get(lote_id)
+            if canal is None or seq in canal.vistos:
+                return
+            canal.vistos.add(seq)
+            canal.recentes.append(seq)
+            if len(canal.recentes) > self.historico:
+                canal.vistos.discard(canal.recentes.popleft())
+            assinantes = list(canal.assinantes)
+            self._publicados += 1
+
+        for assinante in assinantes:
+            try:
+                assinante.fila.put_nowait((seq, dados))
+            except queue.Full:
+                assinante.atrasado = True
+
+    def publicar_apos_commit(self, futuro, lote_id):
+        # Não entrega direto: commits de outros workers só aparecem na varredura, e um seq
+        # deste processo que passasse na frente faria o Last-Event-ID pular o seq anterior.
+        # O commit só adianta a varredura, que lê o banco em ordem de seq.
+        def acordar(f):
+            if f.exception() is None and lote_id in self._canais:
+                self._acordar.set()
+
+        futuro.add_done_callback(acordar)
+        return futuro
+
+    def _cursor_atual(self, lote_id):
+        with self.persistencia.leitura() as conn:
+            return conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM consultas WHERE lote_id = ?", (lote_id,)
+            ).fetchone()[0]
+
+    def _buscar_desde(self, lote_id, desde):
+        with self.persistencia.leitura() as conn:
+            return conn.execute(
+                f"SELECT seq, {SELECT_RESULTADO} FROM consultas WHERE lote_id = ? AND seq > ? ORDER BY seq",
+                (lote_id, desde)
+            ).fetchall()
+
+    def _entrar(self, lote_id):
+        assinante = Assinante()
+        with self._lock:
+            canal = self._canais.get(lote_id)
+        if canal is None:
+            cursor = self._cursor_atual(lote_id)
+            with self._lock:
+                canal = self._canais.setdefault(lote_id, CanalLote(lote_id, cursor))
+        with self._lock:
+            canal.assinantes.add(assinante)
+        return assinante
+
+    def _sair(self, lote_id, assinante):
+        with self._lock:
+            canal = self._canais.get(lote_id)
+            if canal is None:
+                return
+            canal.assinantes.discard(assinante)
+            if not canal.assinantes:
+                del self._canais[lote_id]
+
+    def assinar(self, lote_id, desde=0):
+        assinante = self._entrar(lote_id)
+        try:
+            yield "retry: 3000\n\n"
+            limite = desde
+            ressincronizar = True
+            ultimo_heartbeat = time.monotonic()
+
+            while True:
+                if ressincronizar or assinante.atrasado:
+                    # Na conexão (ou retomada via Last-Event-ID) e quando a fila
+                    # do assinante transborda, recupera o que falta pelo banco.
+                    ressincronizar = assinante.atrasado = False
+                    for seq, *row in self._buscar_desde(lote_id, limite):
+                        limite = max(limite, seq)
+                        yield self._formatar(seq, formatar_linha(row))
+
+                try:
+                    seq, dados = assinante.fila.get(timeout=1)
+                except queue.Empty:
+                    if time.monotonic() - ultimo_heartbeat >= EVENTOS_HEARTBEAT:
+                        ultimo_heartbeat = time.monotonic()
+                        yield ": ping\n\n"
+                    continue
+
+                # seq segue a ordem de commit: tudo <= limite já saiu na ressincronização.
+                if seq <= limite:
+                    continue
+                with self._lock:
+                    self._entregues += 1
+                yield self._formatar(seq, dados)
+        finally:
+            self._sair(lote_id, assinante)
+
+    def _formatar(self, seq, dados):
+        return f"id: {seq}\nevent: resultado\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+    def iniciar(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._varrer, daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+        self._acordar.set()
+
+    def _varrer(self):
+        # Um leitor por lote assistido e por processo: entrega, em ordem de seq, tanto as
+        # escritas deste processo (que acordam a varredura) quanto as de outros workers.
+        while True:
+            self._acordar.wait(self.varredura)
+            self._acordar.clear()
+            if self._parar.is_set():
+                return
+            with self._lock:
+                canais = [(c.lote_id, c.cursor_banco) for c in self._canais.values()]
+            for lote_id, cursor in canais:
+                try:
+                    rows = self._buscar_desde(lote_id, cursor)
+                except Exception as e:
+                    log.warning("Erro ao varrer eventos do lote", extra={"lote_id": lote_id, "erro": str(e)})
+                    continue
+                if not rows:
+                    continue
+                with self._lock:
+                    canal = self._canais.get(lote_id)
+                    if canal is not None:
+                        canal.cursor_banco = max(canal.cursor_banco, rows[-1][0])
+                for seq, *row in rows:
+                    self.publicar(lote_id, seq, formatar_linha(row))
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                "lotes_assistidos": len(self._canais),
+                "assinantes": sum(len(c.assinantes) for c in self._canais.values()),
+                "publicados": self._publicados,
+                "entregues": self._entregues,
+            }
@@ -0,0 +1,163 @@
+import csv
+import glob
+import hashlib
+import io
+import os
+import re
+import tempfile
+import time
+import zlib
+
+from database import SELECT_RESULTADO, formatar_linha
+from metricas import registro
+
+EXPORTACAO_BLOCO = int(os.environ.get("EXPORTACAO_BLOCO", "2000"))
+
+EXPORTACAO_DURACAO = registro.histograma(
+    "exportacao_segundos", "Duração da geração de exportações (arquivos vindos do cache não entram).",
+    ("formato",)
+)
+EXPORTACAO_TOTAL = registro.contador(
+    "exportacoes_total", "Exportações servidas por formato e origem.", ("formato", "origem")
+)
+
+CABECALHO = list(formatar_linha((None,) * len(SELECT_RESULTADO.split(","))))
+
+FORMATOS = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv; charset=utf-8",
+    "csv.gz": "application/gzip",
+}
+
+
+class ExportadorLotes:
+    def __init__(self, persistencia, pasta, bloco=EXPORTACAO_BLOCO, arquivo=None):
+        self.persistencia = persistencia
+        self.pasta = os.path.abspath(pasta)
+        self.bloco = bloco
+        self.arquivo = arquivo
+
+    def _arquivado(self, lote_id):
+        return self.arquivo is not None and self.arquivo.arquivado(lote_id) is not None
+
+    def cursor(self, lote_id):
+        # Lotes arquivados: o manifesto mais as linhas gravadas no banco depois do arquivamento.
+        if self.arquivo is not None:
+            arquivado = self.arquivo.cursor(lote_id)
+            if arquivado is not None:
+                return arquivado
+        with self.persistencia.leitura() as conn:
+            return conn.execute(
+                "SELECT COUNT(*), COALESCE(MAX(seq), 0) FROM consultas WHERE lote_id = ?", (lote_id,)
+            ).fetchone()
+
+    def _nome(self, lote_id, formato, cursor=None):
+        base = re.sub(r"[^\w-]", "_", lote_id)[:60]
+        sufixo = hashlib.sha1(lote_id.encode()).hexdigest()[:8]
+        return os.path.join(
+            self.pasta, f"consultas_lote_{base}_{sufixo}_{'*' if cursor is None else cursor}.{formato}"
+        )
+
+    def em_cache(self, lote_id, formato, cursor):
+        # O nome carrega o MAX(seq) do lote: qualquer escrita nova invalida o arquivo.
+        arquivo = self._nome(lote_id, formato, cursor)
+        if not os.path.exists(arquivo):
+            return None
+        EXPORTACAO_TOTAL.inc(formato=formato, origem="cache")
+        return arquivo
+
+    def _publicar(self, temporario, lote_id, formato, cursor):
+        arquivo = self._nome(lote_id, formato, cursor)
+        os.replace(temporario, arquivo)
+        for antigo in glob.glob(self._nome(lote_id, formato)):
+            if antigo != arquivo:
+                try:
+                    os.remove(antigo)
+                except OSError:
+                    pass
+        return arquivo
+
+    def linhas(self, lote_id):
+        if self._arquivado(lote_id):
+            for row in self.arquivo.linhas(lote_id):
+                yield list(formatar_linha(row).values())
+            return
+        with self.persistencia.leitura() as conn:
+            c = conn.execute(
+                f"SELECT {SELECT_RESULTADO} FROM consultas WHERE lote_id = ? ORDER BY id", (lote_id,)
+            )
+            while True:
+                rows = c.fetchmany(self.bloco)
+                if not rows:
+                    break
+                for row in rows:
+                    yield list(formatar_linha(row).values())
+
+    def gerar_xlsx(self, lote_id, cursor):
+        from openpyxl import Workbook
+
+        inicio = time.perf_counter()
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Resultados")
+        ws.append(CABECALHO)
+        for linha in self.linhas(lote_id):
+            ws.append(linha)
+
+        fd, temporario = tempfile.mkstemp(dir=self.pasta, suffix=".tmp")
+        os.close(fd)
+        try:
+            wb.save(temporario)
+            arquivo = self._publicar(temporario, lote_id, "xlsx", cursor)
+            EXPORTACAO_DURACAO.observar(time.perf_counter() - inicio, formato="xlsx")
+            EXPORTACAO_TOTAL.inc(formato="xlsx", origem="gerado")
+            return arquivo
+        except Exception:
+            os.remove(temporario)
+            raise
+
+    def transmitir_csv(self, lote_id, cursor, comprimir=False):
+        formato = "csv.gz" if comprimir else "csv"
+        inicio = time.perf_counter()
+        fd, temporario = tempfile.mkstemp(dir=self.pasta, suffix=".tmp")
+        destino = os.fdopen(fd, "wb")
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if comprimir else None
+        concluido = False
+
+        def emitir(dados):
+            if compressor is not None:
+                dados = compressor.compress(dados)
+            if dados:
+                destino.write(dados)
+            return dados
+
+        try:
+            buffer = io.StringIO()
+            # BOM para o Excel reconhecer UTF-8 ao abrir o CSV direto.
+            buffer.write("\ufeff")
+            escritor = csv.writer(buffer, delimiter=";")
+            escritor.writerow(CABECALHO)
+            for i, linha in enumerate(self.linhas(lote_id), 1):
+                escritor.writerow(linha)
+                if i % self.bloco == 0:
+                    pedaco = emitir(buffer.getvalue().encode())
+                    buffer.seek(0)
+                    buffer.truncate()
+                    if pedaco:
+                        yield pedaco
+
+            pedaco = emitir(buffer.getvalue().encode())
+            if compressor is not None:
+                final = compressor.flush()
+                destino.write(final)
+                pedaco += final
+            if pedaco:
+                yield pedaco
+            concluido = True
+        finally:
+            destino.close()
+            if concluido:
+                self._publicar(temporario, lote_id, formato, cursor)
+                EXPORTACAO_DURACAO.observar(time.perf_counter() - inicio, formato=formato)
+                EXPORTACAO_TOTAL.inc(formato=formato, origem="gerado")
+            else:
+                os.remove(temporario)
@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from limitador import LIMITADOR_MAXIMO
+from metricas import registro
+from reprocessamento import REPROCESSAMENTO_WORKERS
+
+HTTP_POOL_HOSTS = int(os.environ.get("HTTP_POOL_HOSTS", "4"))
+# Uma conexão por chamada que o limitador deixa passar, mais as do reprocessamento;
+# abaixo disso o pool descarta conexões e o TLS é refeito a cada pico.
+HTTP_POOL_MAXIMO = int(os.environ.get("HTTP_POOL_MAXIMO", str(int(LIMITADOR_MAXIMO) + REPROCESSAMENTO_WORKERS)))
+HTTP_TIMEOUT_CONEXAO = float(os.environ.get("HTTP_TIMEOUT_CONEXAO", "5"))
+HTTP_TIMEOUT_LEITURA = float(os.environ.get("HTTP_TIMEOUT_LEITURA", "15"))
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", "2"))
+HTTP_RETRIES_LEITURA = int(os.environ.get("HTTP_RETRIES_LEITURA", "0"))
+HTTP_RETRY_BACKOFF = float(os.environ.get("HTTP_RETRY_BACKOFF", "0.3"))
+
+HTTP_DURACAO = registro.histograma(
+    "http_duracao_segundos", "Latência das chamadas HTTP à Facta (inclui retries de transporte).", ("endpoint",)
+)
+HTTP_RESPOSTAS = registro.contador(
+    "http_respostas_total", "Respostas da Facta por endpoint e status HTTP.", ("endpoint", "status")
+)
+
+
+class ClienteHTTP:
+    def __init__(
+        self,
+        pool_hosts=HTTP_POOL_HOSTS,
+        pool_maximo=HTTP_POOL_MAXIMO,
+        timeout_conexao=HTTP_TIMEOUT_CONEXAO,
+        timeout_leitura=HTTP_TIMEOUT_LEITURA,
+        retries=HTTP_RETRIES,
+        retries_leitura=HTTP_RETRIES_LEITURA,
+        retry_backoff=HTTP_RETRY_BACKOFF,
+    ):
+        self.timeout_conexao = timeout_conexao
+        self.timeout_leitura = timeout_leitura
+        self.pool_hosts = pool_hosts
+        self.pool_maximo = pool_maximo
+
+        # Só repete falhas de transporte (conexão recusada, reset, 502/503/504);
+        # 4xx e timeouts de leitura voltam direto para quem chamou.
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries_leitura,
+            status=retries,
+            backoff_factor=retry_backoff,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            raise_on_status=False,
+            respect_retry_after_header=False,
+        )
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_hosts,
+            pool_maxsize=pool_maximo,
+            max_retries=retry,
+        )
+        self.sessao = requests.Session()
+        self.sessao.mount("https://", self.adapter)
+        self.sessao.mount("http://", self.adapter)
+
+        self._lock = threading.Lock()
+        self._requisicoes = 0
+        self._falhas = 0
+
+    def get(self, url, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = (self.timeout_conexao, self.timeout_leitura)
+        elif not isinstance(timeout, tuple):
+            timeout = (min(self.timeout_conexao, timeout), timeout)
+
+        endpoint = urlparse(url).path.rstrip("/").rsplit("/", 1)[-1] or "/"
+        inicio = time.perf_counter()
+        status = "erro"
+        try:
+            response = self.sessao.get(url, timeout=timeout, **kwargs)
+            status = response.status_code
+            return response
+        except requests.RequestException as e:
+            status = type(e).__name__
+            with self._lock:
+                self._falhas += 1
+            raise
+        finally:
+            HTTP_DURACAO.observar(time.perf_counter() - inicio, endpoint=endpoint)
+            HTTP_RESPOSTAS.inc(endpoint=endpoint, status=status)
+            with self._lock:
+                self._requisicoes += 1
+
+    def estatisticas(self):
+        pools = []
+        gerenciador = self.adapter.poolmanager
+        for chave in list(gerenciador.pools.keys()):
+            pool = gerenciador.pools.get(chave)
+            if pool is None:
+                continue
+            pools.append({
+                "host": f"{pool.scheme}://{pool.host}:{pool.port}",
+                "conexoes_abertas": pool.num_connections,
+                "requisicoes": pool.num_requests,
+                "conexoes_ociosas": sum(1 for conn in list(pool.pool.queue) if conn is not None)
+                if pool.pool is not None else 0,
+                "tamanho_maximo": self.pool_maximo,
+            })
+
+        with self._lock:
+            requisicoes, falhas = self._requisicoes, self._falhas
+
+        conexoes = sum(p["conexoes_abertas"] for p in pools)
+        return {
+            "requisicoes": requisicoes,
+            "falhas": falhas,
+            "conexoes_abertas": conexoes,
+            "reuso_conexoes": round(1 - conexoes / requisicoes, 3) if requisicoes else 0,
+            "pools": pools,
+            "pool_hosts": self.pool_hosts,
+        }
+
+
+cliente_http = ClienteHTTP()
@@ -0,0 +1,136 @@
+import csv
+import io
+import os
+import re
+
+INGESTAO_BLOCO = int(os.environ.get("INGESTAO_BLOCO", "50000"))
+
+EXTENSOES = (".csv", ".txt", ".xlsx", ".xlsm")
+
+_PESOS_DV1 = tuple(range(10, 1, -1))
+_PESOS_DV2 = tuple(range(11, 1, -1))
+
+
+def normalizar_cpf(valor):
+    if valor is None:
+        return ""
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    digitos = re.sub(r"\D", "", str(valor))
+    if not digitos.isascii():
+        # \D aceita dígitos de outros alfabetos (ex.: ٥٢٩...): seguem sem completar, como inválidos.
+        return digitos
+    return digitos.zfill(11) if digitos else ""
+
+
+def validar_cpfs(cpfs):
+    import numpy as np
+
+    if not cpfs:
+        return np.zeros(0, dtype=bool)
+
+    formato_ok = [len(c) == 11 and c.isascii() and c.isdigit() for c in cpfs]
+    formato = np.fromiter(formato_ok, dtype=bool, count=len(cpfs))
+    brutos = "".join(c if ok else "0" * 11 for c, ok in zip(cpfs, formato_ok)).encode("ascii")
+    d = (np.frombuffer(brutos, dtype=np.uint8) - ord("0")).astype(np.int64).reshape(-1, 11)
+
+    dv1 = (d[:, :9] @ _PESOS_DV1) * 10 % 11 % 10
+    dv2 = (d[:, :10] @ _PESOS_DV2) * 10 % 11 % 10
+    repetidos = (d == d[:, :1]).all(axis=1)
+    return formato & ~repetidos & (d[:, 9] == dv1) & (d[:, 10] == dv2)
+
+
+def _coluna_cpf(primeira):
+    for i, valor in enumerate(primeira):
+        if valor is not None and "cpf" in str(valor).lower():
+            return i, True
+    return 0, False
+
+
+def _linhas_texto(stream):
+    texto = io.TextIOWrapper(stream, encoding="utf-8-sig", errors="replace", newline="")
+    primeira = texto.readline()
+    delimitador = ";" if ";" in primeira else "\t" if "\t" in primeira else ","
+    leitor = csv.reader(texto, delimiter=delimitador)
+    cabecalho = next(csv.reader([primeira], delimiter=delimitador), [])
+    coluna, tem_cabecalho = _coluna_cpf(cabecalho)
+    if not tem_cabecalho and cabecalho:
+        yield cabecalho[coluna] if coluna < len(cabecalho) else None
+    for linha in leitor:
+        yield linha[coluna] if coluna < len(linha) else None
+
+
+def _linhas_excel(stream):
+    from openpyxl import load_workbook
+
+    wb = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        linhas = wb.active.iter_rows(values_only=True)
+        cabecalho = next(linhas, ())
+        coluna, tem_cabecalho = _coluna_cpf(cabecalho)
+        if not tem_cabecalho and cabecalho:
+            yield cabecalho[coluna] if coluna < len(cabecalho) else None
+        for linha in linhas:
+            yield linha[coluna] if coluna < len(linha) else None
+    finally:
+        wb.close()
+
+
+def ler_cpfs(stream, nome_arquivo):
+    extensao = os.path.splitext((nome_arquivo or "").lower())[1]
+    if extensao not in EXTENSOES:
+        raise ValueError(f"Formato não suportado: use {', '.join(EXTENSOES)}")
+    if extensao in (".xlsx", ".xlsm"):
+        return _linhas_excel(stream)
+    return _linhas_texto(stream)
+
+
+def ingerir_cpfs(valores, registrar, bloco=INGESTAO_BLOCO, amostra=10):
+    relatorio = {
+        "linhas": 0,
+        "vazias": 0,
+        "invalidos": 0,
+        "duplicados": 0,
+        "ja_registrados": 0,
+        "registrados": 0,
+        "amostra_invalidos": [],
+    }
+    vistos = set()
+    pendentes = []
+
+    def processar(brutos):
+        cpfs = [normalizar_cpf(v) for v in brutos]
+        cpfs_preenchidos = [c for c in cpfs if c]
+        relatorio["vazias"] += len(cpfs) - len(cpfs_preenchidos)
+
+        validos = validar_cpfs(cpfs_preenchidos)
+        novos = []
+        for cpf, valido in zip(cpfs_preenchidos, validos):
+            if not valido:
+                relatorio["invalidos"] += 1
+                if len(relatorio["amostra_invalidos"]) < amostra:
+                    relatorio["amostra_invalidos"].append(cpf)
+            elif cpf in vistos:
+                relatorio["duplicados"] += 1
+            else:
+                vistos.add(cpf)
+                novos.append(cpf)
+
+        if novos:
+            inseridos = registrar(novos)
+            relatorio["registrados"] += inseridos
+            relatorio["ja_registrados"] += len(novos) - inseridos
+
+    for valor in valores:
+        relatorio["linhas"] += 1
+        pendentes.append(valor)
+        if len(pendentes) >= bloco:
+            processar(pendentes)
+            pendentes = []
+    if pendentes:
+        processar(pendentes)
+
+    relatorio["chamadas_evitadas"] = (
+        relatorio["invalidos"] + relatorio["duplicados"] + relatorio["ja_registrados"]
+    )
+    return relatorio
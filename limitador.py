@@ -0,0 +1,218 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+LIMITADOR_INICIAL = float(os.environ.get("LIMITADOR_INICIAL", "4"))
+LIMITADOR_MINIMO = float(os.environ.get("LIMITADOR_MINIMO", "1"))
+LIMITADOR_MAXIMO = float(os.environ.get("LIMITADOR_MAXIMO", "32"))
+LIMITADOR_LATENCIA_ALVO = float(os.environ.get("LIMITADOR_LATENCIA_ALVO", "3"))
+LIMITADOR_FATOR_REDUCAO = float(os.environ.get("LIMITADOR_FATOR_REDUCAO", "0.5"))
+
+DISJUNTOR_FALHAS_CONSECUTIVAS = int(os.environ.get("DISJUNTOR_FALHAS_CONSECUTIVAS", "5"))
+DISJUNTOR_TAXA_FALHAS = float(os.environ.get("DISJUNTOR_TAXA_FALHAS", "0.5"))
+DISJUNTOR_JANELA = int(os.environ.get("DISJUNTOR_JANELA", "20"))
+DISJUNTOR_TEMPO_ABERTO = float(os.environ.get("DISJUNTOR_TEMPO_ABERTO", "15"))
+DISJUNTOR_TEMPO_ABERTO_MAXIMO = float(os.environ.get("DISJUNTOR_TEMPO_ABERTO_MAXIMO", "120"))
+
+
+class CircuitoAberto(Exception):
+    pass
+
+
+class LimitadorAdaptativo:
+    def __init__(
+        self,
+        inicial=LIMITADOR_INICIAL,
+        minimo=LIMITADOR_MINIMO,
+        maximo=LIMITADOR_MAXIMO,
+        latencia_alvo=LIMITADOR_LATENCIA_ALVO,
+        fator_reducao=LIMITADOR_FATOR_REDUCAO,
+    ):
+        self.minimo = minimo
+        self.maximo = maximo
+        self.latencia_alvo = latencia_alvo
+        self.fator_reducao = fator_reducao
+        self.limite = max(minimo, min(maximo, inicial))
+
+        self._cond = threading.Condition()
+        self._em_voo = 0
+        self._latencia_media = None
+        self._ultima_reducao = 0.0
+        self._aumentos = 0
+        self._reducoes = 0
+
+    def adquirir(self, timeout=None):
+        prazo = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._em_voo >= int(self.limite):
+                restante = None if prazo is None else prazo - time.monotonic()
+                if restante is not None and restante <= 0:
+                    return False
+                self._cond.wait(restante)
+            self._em_voo += 1
+            return True
+
+    def devolver(self):
+        # Desfaz um adquirir que não virou chamada; não entra na conta do AIMD.
+        with self._cond:
+            self._em_voo -= 1
+            self._cond.notify_all()
+
+    def carga(self):
+        with self._cond:
+            return self._em_voo / max(1, int(self.limite))
+
+    def liberar(self, latencia, sobrecarga=False):
+        agora = time.monotonic()
+        with self._cond:
+            utilizado = self._em_voo >= self.limite / 2
+            self._em_voo -= 1
+            if self._latencia_media is None:
+                self._latencia_media = latencia
+            else:
+                self._latencia_media = 0.9 * self._latencia_media + 0.1 * latencia
+
+            if sobrecarga:
+                # Uma redução por "rodada": as respostas que já estavam em voo
+                # refletem o mesmo congestionamento e não devem cortar de novo.
+                if agora - self._ultima_reducao >= max(self._latencia_media, 0.5):
+                    self.limite = max(self.minimo, self.limite * self.fator_reducao)
+                    self._ultima_reducao = agora
+                    self._reducoes += 1
+            elif latencia <= self.latencia_alvo and utilizado:
+                # Aumento aditivo: ~+1 de concorrência a cada janela inteira de respostas,
+                # só enquanto o limite atual está de fato sendo usado.
+                novo = min(self.maximo, self.limite + 1.0 / self.limite)
+                if int(novo) > int(self.limite):
+                    self._aumentos += 1
+                self.limite = novo
+            self._cond.notify_all()
+
+    def estatisticas(self):
+        with self._cond:
+            return {
+                "limite": int(self.limite),
+                "limite_exato": round(self.limite, 2),
+                "em_voo": self._em_voo,
+                "latencia_media_ms": round(1000 * (self._latencia_media or 0), 1),
+                "aumentos": self._aumentos,
+                "reducoes": self._reducoes,
+            }
+
+
+class DisjuntorCircuito:
+    FECHADO = "fechado"
+    ABERTO = "aberto"
+    MEIO_ABERTO = "meio_aberto"
+
+    def __init__(
+        self,
+        falhas_consecutivas=DISJUNTOR_FALHAS_CONSECUTIVAS,
+        taxa_falhas=DISJUNTOR_TAXA_FALHAS,
+        janela=DISJUNTOR_JANELA,
+        tempo_aberto=DISJUNTOR_TEMPO_ABERTO,
+        tempo_aberto_maximo=DISJUNTOR_TEMPO_ABERTO_MAXIMO,
+        nome=None,
+    ):
+        self.nome = nome
+        self.falhas_consecutivas = falhas_consecutivas
+        self.taxa_falhas = taxa_falhas
+        self.tempo_aberto_base = tempo_aberto
+        self.tempo_aberto_maximo = tempo_aberto_maximo
+
+        self.estado = self.FECHADO
+        self._cond = threading.Condition()
+        self._resultados = deque(maxlen=janela)
+        self._consecutivas = 0
+        self._tempo_aberto = tempo_aberto
+        self._reabre_em = 0.0
+        self._sondando = False
+        self._aberturas = 0
+
+    def permitir(self):
+        with self._cond:
+            return self._permitir()
+
+    def _permitir(self):
+        if self.estado == self.FECHADO:
+            return True
+        if self.estado == self.ABERTO and time.monotonic() >= self._reabre_em:
+            self.estado = self.MEIO_ABERTO
+            self._sondando = False
+        if self.estado == self.MEIO_ABERTO and not self._sondando:
+            self._sondando = True
+            return True
+        return False
+
+    def disponivel(self):
+        # Como permitir(), mas sem reservar a sonda do meio-aberto.
+        with self._cond:
+            if self.estado == self.ABERTO:
+                return time.monotonic() >= self._reabre_em
+            return self.estado == self.FECHADO or not self._sondando
+
+    def aguardar(self, timeout):
+        prazo = time.monotonic() + timeout
+        with self._cond:
+            while not self._permitir():
+                restante = prazo - time.monotonic()
+                if restante <= 0:
+                    return False
+                if self.estado == self.ABERTO:
+                    restante = min(restante, max(0.05, self._reabre_em - time.monotonic()))
+                self._cond.wait(restante)
+            return True
+
+    def registrar(self, sucesso):
+        with self._cond:
+            self._resultados.append(sucesso)
+            if sucesso:
+                self._consecutivas = 0
+                if self.estado == self.MEIO_ABERTO:
+                    log.info("Facta respondeu à sonda: circuito fechado", extra={"credencial": self.nome})
+                    self.estado = self.FECHADO
+                    self._tempo_aberto = self.tempo_aberto_base
+                    self._resultados.clear()
+                self._sondando = False
+                self._cond.notify_all()
+                return
+
+            self._consecutivas += 1
+            falhas = self._resultados.count(False)
+            taxa_excedida = (
+                len(self._resultados) == self._resultados.maxlen
+                and falhas / len(self._resultados) >= self.taxa_falhas
+            )
+            if self.estado == self.MEIO_ABERTO:
+                self._tempo_aberto = min(self.tempo_aberto_maximo, self._tempo_aberto * 2)
+                self._abrir()
+            elif self.estado == self.FECHADO and (
+                self._consecutivas >= self.falhas_consecutivas or taxa_excedida
+            ):
+                self._abrir()
+
+    def _abrir(self):
+        self.estado = self.ABERTO
+        self._sondando = False
+        self._reabre_em = time.monotonic() + self._tempo_aberto
+        self._aberturas += 1
+        log.warning(
+            "Circuito aberto para a Facta",
+            extra={"credencial": self.nome, "aberto_por_s": round(self._tempo_aberto)},
+        )
+
+    def estatisticas(self):
+        with self._cond:
+            return {
+                "estado": self.estado,
+                "falhas_consecutivas": self._consecutivas,
+                "falhas_janela": self._resultados.count(False),
+                "janela": len(self._resultados),
+                "aberturas": self._aberturas,
+                "reabre_em_s": round(max(0.0, self._reabre_em - time.monotonic()), 1)
+                if self.estado == self.ABERTO else 0,
+            }
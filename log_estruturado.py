@@ -0,0 +1,171 @@
+import atexit
+import copy
+import hashlib
+import hmac
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import secrets
+import sys
+import tempfile
+import threading
+from datetime import datetime, timezone
+
+from metricas import registro
+
+LOG_NIVEL = os.environ.get("LOG_NIVEL", "INFO").upper()
+# Níveis por módulo, ex.: "lotes=DEBUG,werkzeug=WARNING,http_client=WARNING".
+LOG_NIVEIS = os.environ.get("LOG_NIVEIS", "werkzeug=WARNING")
+LOG_ARQUIVO = os.environ.get("LOG_ARQUIVO")
+LOG_FILA = int(os.environ.get("LOG_FILA", "10000"))
+# Fração das respostas 200 da Facta que levam o corpo no log "Consulta Facta" (INFO; as demais
+# sempre levam) e o tamanho máximo guardado.
+LOG_CORPO_AMOSTRA = float(os.environ.get("LOG_CORPO_AMOSTRA", "0.01"))
+LOG_CORPO_MAXIMO = int(os.environ.get("LOG_CORPO_MAXIMO", "500"))
+# Chave do HMAC que troca CPFs por hash nos logs: sem segredo, os ~10^9 CPFs válidos se
+# revertem em minutos. Sem LOG_CHAVE_CPF, uma chave aleatória é criada na primeira vez em
+# LOG_CHAVE_CPF_ARQUIVO e reaproveitada por todos os workers, para os hashes baterem.
+LOG_CHAVE_CPF = os.environ.get("LOG_CHAVE_CPF", "")
+LOG_CHAVE_CPF_ARQUIVO = os.environ.get("LOG_CHAVE_CPF_ARQUIVO", "log_chave_cpf.key")
+
+LOGS_DESCARTADOS = registro.contador(
+    "logs_descartados_total", "Registros de log descartados porque a fila estava cheia.", ("nivel",)
+)
+
+_ATRIBUTOS_PADRAO = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+_REGEX_CPF = re.compile(r"(?<!\d)\d{11}(?!\d)")
+
+_listener = None
+_chave_cpf = None
+_chave_lock = threading.Lock()
+
+
+def _chave_do_arquivo(caminho):
+    if not os.path.exists(caminho):
+        fd, temporario = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(caminho)), prefix=".chave")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(secrets.token_hex(32))
+            # link falha se outro processo criou antes: vale a chave de quem chegou primeiro.
+            try:
+                os.link(temporario, caminho)
+            except FileExistsError:
+                pass
+        finally:
+            os.remove(temporario)
+    with open(caminho, encoding="utf-8") as f:
+        chave = f.read().strip()
+    if not chave:
+        raise RuntimeError(f"{caminho} está vazio: apague o arquivo ou defina LOG_CHAVE_CPF")
+    return chave.encode()
+
+
+def _chave():
+    global _chave_cpf
+    if _chave_cpf is None:
+        with _chave_lock:
+            if _chave_cpf is None:
+                _chave_cpf = LOG_CHAVE_CPF.encode() if LOG_CHAVE_CPF else _chave_do_arquivo(LOG_CHAVE_CPF_ARQUIVO)
+    return _chave_cpf
+
+
+def hash_cpf(cpf):
+    if not cpf:
+        return None
+    return hmac.new(_chave(), str(cpf).encode(), hashlib.sha256).hexdigest()[:16]
+
+
+def mascarar_cpfs(texto):
+    return _REGEX_CPF.sub(lambda m: f"cpf:{hash_cpf(m.group())}", texto)
+
+
+def corpo_resposta(texto, forcar=False):
+    # Amostra e corta o corpo antes de ir para a fila; CPFs no texto viram hash.
+    if texto is None or not (forcar or random.random() < LOG_CORPO_AMOSTRA):
+        return None
+    corte = texto[:LOG_CORPO_MAXIMO]
+    if len(texto) > LOG_CORPO_MAXIMO:
+        corte += f"...(+{len(texto) - LOG_CORPO_MAXIMO})"
+    return mascarar_cpfs(corte)
+
+
+class FormatadorJson(logging.Formatter):
+    def format(self, record):
+        saida = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "nivel": record.levelname,
+            "modulo": record.name,
+            "msg": mascarar_cpfs(record.getMessage()),
+        }
+        for chave, valor in vars(record).items():
+            if chave in _ATRIBUTOS_PADRAO or valor is None:
+                continue
+            if chave == "cpf":
+                saida["cpf_hash"] = hash_cpf(valor)
+            elif isinstance(valor, str):
+                # Mensagens de erro e URLs (…?cpf=…) carregam o CPF cru.
+                saida[chave] = mascarar_cpfs(valor)
+            else:
+                saida[chave] = valor
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            saida["excecao"] = mascarar_cpfs(record.exc_text)
+        return json.dumps(saida, ensure_ascii=False, default=str)
+
+
+class HandlerFila(logging.handlers.QueueHandler):
+    # Nunca bloqueia quem loga: com a fila cheia o registro é descartado e contado.
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOGS_DESCARTADOS.inc(nivel=record.levelname)
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _niveis_por_modulo(texto):
+    niveis = {}
+    for item in texto.split(","):
+        nome, _, nivel = item.partition("=")
+        if nome.strip() and nivel.strip():
+            niveis[nome.strip()] = nivel.strip().upper()
+    return niveis
+
+
+def configurar_logs():
+    global _listener
+    if _listener is not None:
+        return
+
+    fila = queue.Queue(LOG_FILA)
+    if LOG_ARQUIVO:
+        destino = logging.handlers.WatchedFileHandler(LOG_ARQUIVO, encoding="utf-8")
+    else:
+        destino = logging.StreamHandler(sys.stdout)
+    destino.setFormatter(FormatadorJson())
+
+    raiz = logging.getLogger()
+    for handler in list(raiz.handlers):
+        raiz.removeHandler(handler)
+    raiz.addHandler(HandlerFila(fila))
+    raiz.setLevel(LOG_NIVEL)
+    for nome, nivel in _niveis_por_modulo(LOG_NIVEIS).items():
+        logging.getLogger(nome).setLevel(nivel)
+
+    registro.medidor("log_fila", "Registros de log aguardando a thread de escrita.", funcao=fila.qsize)
+
+    _listener = logging.handlers.QueueListener(fila, destino, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
@@ -0,0 +1,493 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+
+from database import CONTADORES_RESUMO, PROXIMO_SEQ
+
+log = logging.getLogger(__name__)
+
+LOTE_LEASE = float(os.environ.get("LOTE_LEASE", "120"))
+LOTE_VIGIA = float(os.environ.get("LOTE_VIGIA", "5"))
+LOTE_ESPERA_LEASES = float(os.environ.get("LOTE_ESPERA_LEASES", "1"))
+LOTE_RESERVA = int(os.environ.get("LOTE_RESERVA", "8"))
+LOTE_PRIORIDADE_MAXIMA = int(os.environ.get("LOTE_PRIORIDADE_MAXIMA", "10"))
+
+
+def _formatar_ts(ts):
+    return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S") if ts else None
+
+
+class ExecucaoLote:
+    def __init__(self, lote_id, concorrencia, prioridade, virtual):
+        self.lote_id = lote_id
+        self.concorrencia = concorrencia
+        self.prioridade = prioridade
+        self.parar = threading.Event()
+        self.reservados = deque()
+        self.em_andamento = 0
+        self.processados = 0
+        self.virtual = virtual
+        self.aguardar_ate = 0.0
+        self.finalizados = deque()
+
+
+class MotorLotes:
+    def __init__(self, executor, processar_cpf, persistencia, concorrencia_padrao=3, capacidade=None):
+        self.executor = executor
+        self.processar_cpf = processar_cpf
+        self.persistencia = persistencia
+        self.concorrencia_padrao = concorrencia_padrao
+        self.concorrencia_maxima = executor._max_workers
+        self.capacidade = capacidade or (lambda: self.concorrencia_maxima)
+        self.dono = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+        self._execucoes = {}
+        self._cond = threading.Condition()
+        self._em_andamento = 0
+        self._em_voo = set()
+        self._virtual = 0.0
+        self._despachante = None
+        self._vigia = None
+
+    def _limitar(self, concorrencia):
+        concorrencia = int(concorrencia or self.concorrencia_padrao)
+        return max(1, min(concorrencia, self.concorrencia_maxima))
+
+    def _limitar_prioridade(self, prioridade):
+        return max(1, min(int(prioridade or 1), LOTE_PRIORIDADE_MAXIMA))
+
+    def iniciar(self, lote_id, concorrencia=None, prioridade=None):
+        concorrencia = self._limitar(concorrencia)
+        prioridade = None if prioridade is None else self._limitar_prioridade(prioridade)
+        ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        prioridade = self.persistencia.executar(lambda c: c.execute(
+            """
+            INSERT INTO lotes (lote_id, estado, concorrencia, prioridade, criado_em, iniciado_em)
+            VALUES (?, 'executando', ?, COALESCE(?, 1), ?, ?)
+            ON CONFLICT(lote_id) DO UPDATE SET
+                estado='executando', concorrencia=excluded.concorrencia,
+                prioridade=COALESCE(?, lotes.prioridade),
+                iniciado_em=excluded.iniciado_em, finalizado_em=NULL
+            RETURNING prioridade
+            """,
+            (lote_id, concorrencia, prioridade, ts, ts, prioridade)
+        ).fetchall()[0][0]).result()
+        return self._participar(lote_id, concorrencia, prioridade)
+
+    def _participar(self, lote_id, concorrencia, prioridade):
+        prioridade = self._limitar_prioridade(prioridade)
+        with self._cond:
+            execucao = self._execucoes.get(lote_id)
+            if execucao is not None:
+                retomado = execucao.parar.is_set()
+                execucao.parar.clear()
+                execucao.concorrencia = concorrencia
+                execucao.prioridade = prioridade
+                self._cond.notify_all()
+                if not retomado:
+                    return execucao
+            else:
+                # Entra no tempo virtual corrente: um lote novo não acumula crédito
+                # atrasado, mas também não espera o fim dos que já estão rodando.
+                execucao = ExecucaoLote(lote_id, concorrencia, prioridade, self._virtual)
+                self._execucoes[lote_id] = execucao
+                self._cond.notify_all()
+
+        if self._despachante is None or not self._despachante.is_alive():
+            self._despachante = threading.Thread(target=self._despachar, daemon=True)
+            self._despachante.start()
+        log.info(
+            "Lote iniciado",
+            extra={"lote_id": lote_id, "concorrencia": concorrencia, "prioridade": prioridade, "dono": self.dono},
+        )
+        return execucao
+
+    def _interromper(self, lote_id=None):
+        with self._cond:
+            execucoes = [
+                e for lid, e in self._execucoes.items() if lote_id is None or lid == lote_id
+            ]
+            for execucao in execucoes:
+                execucao.parar.set()
+            self._cond.notify_all()
+        return len(execucoes)
+
+    def parar(self, lote_id):
+        # O estado no banco é o que os outros processos enxergam na próxima vigia.
+        self.persistencia.escrever(
+            "UPDATE lotes SET estado='parado' WHERE lote_id=? AND estado='executando'", (lote_id,)
+        ).result()
+        return self._interromper(lote_id)
+
+    def cancelar(self, lote_id):
+        ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        def cancelar(c):
+            c.execute(
+                "UPDATE lotes SET estado='cancelado', finalizado_em=? WHERE lote_id=?", (ts, lote_id)
+            )
+            c.execute("DELETE FROM reprocessamentos WHERE lote_id=?", (lote_id,))
+            # Um seq por linha, como nas demais escritas, para o delta e o SSE verem cada CPF.
+            base = c.execute(f"SELECT {PROXIMO_SEQ}").fetchone()[0]
+            return c.execute(
+                """
+                UPDATE consultas
+                SET status='Cancelado', mensagem='Lote cancelado', data=?, atualizado_em=?,
+                    lease_dono=NULL, lease_expira=NULL, seq=? + t.n
+                FROM (
+                    SELECT id, ROW_NUMBER() OVER (ORDER BY id) - 1 AS n FROM consultas
+                    WHERE lote_id = ? AND (status = 'Pendente' OR status LIKE 'Reprocessando%')
+                ) AS t
+                WHERE consultas.id = t.id
+                """,
+                (ts, time.time(), base, lote_id)
+            ).rowcount
+
+        cancelados = self.persistencia.executar(cancelar).result()
+        self._interromper(lote_id)
+        return cancelados
+
+    def priorizar(self, lote_id, prioridade):
+        prioridade = self._limitar_prioridade(prioridade)
+        alterados = self.persistencia.escrever(
+            "UPDATE lotes SET prioridade=? WHERE lote_id=?", (prioridade, lote_id)
+        ).result()
+        with self._cond:
+            execucao = self._execucoes.get(lote_id)
+            if execucao is not None:
+                execucao.prioridade = prioridade
+        return alterados
+
+    def retomar_pendentes(self):
+        lotes = self._sincronizar()
+        if self._vigia is None or not self._vigia.is_alive():
+            self._vigia = threading.Thread(target=self._vigiar, daemon=True)
+            self._vigia.start()
+        return lotes
+
+    def _sincronizar(self):
+        with self.persistencia.leitura() as conn:
+            executando = {
+                lote_id: (concorrencia, prioridade)
+                for lote_id, concorrencia, prioridade in conn.execute(
+                    "SELECT lote_id, concorrencia, prioridade FROM lotes WHERE estado='executando'"
+                )
+            }
+
+        with self._cond:
+            locais = {lid: e.parar.is_set() for lid, e in self._execucoes.items()}
+        for lote_id, parado in locais.items():
+            if lote_id not in executando and not parado:
+                self._interromper(lote_id)
+        for lote_id, (concorrencia, prioridade) in executando.items():
+            self._participar(lote_id, self._limitar(concorrencia), prioridade)
+        return list(executando)
+
+    def _vigiar(self):
+        # Renova os leases deste processo e acompanha lotes iniciados/parados
+        # por outros workers (gunicorn ou outros hosts) através da tabela lotes.
+        while True:
+            time.sleep(LOTE_VIGIA)
+            try:
+                self._renovar_leases()
+                self._sincronizar()
+            except Exception:
+                log.exception("Erro na vigia dos lotes")
+
+    def _renovar_leases(self):
+        # Só o que está reservado ou em voo aqui; um CPF que escapou por erro fica com o
+        # lease vencendo e volta para quem reivindicar primeiro.
+        with self._cond:
+            ids = set(self._em_voo)
+            for execucao in self._execucoes.values():
+                ids.update(id_ for id_, _ in execucao.reservados)
+        if not ids:
+            return 0
+        expira = time.time() + LOTE_LEASE
+        return self.persistencia.escrever_muitos(
+            "UPDATE consultas SET lease_expira=? WHERE id=? AND lease_dono=? AND status='Pendente'",
+            [(expira, id_, self.dono) for id_ in ids]
+        ).result()
+
+    def resumo(self, lote_id):
+        # Duas buscas por chave primária: não depende do tamanho do lote.
+        with self.persistencia.leitura() as conn:
+            c = conn.cursor()
+            c.execute(
+                f"SELECT versao, criado_em, atualizado_em, {', '.join(CONTADORES_RESUMO)} "
+                "FROM resumo_lotes WHERE lote_id = ?",
+                (lote_id,)
+            )
+            linha = c.fetchone()
+            c.execute(
+                "SELECT estado, concorrencia, prioridade, iniciado_em, finalizado_em FROM lotes WHERE lote_id = ?",
+                (lote_id,)
+            )
+            lote = c.fetchone()
+
+        if not linha and not lote:
+            return None
+
+        versao, criado_em, atualizado_em, *contagens = linha or (0, None, None) + (0,) * len(CONTADORES_RESUMO)
+        contadores = dict(zip(CONTADORES_RESUMO, contagens))
+        estado, concorrencia, prioridade, iniciado_em, finalizado_em = (
+            lote or ("registrado", None, None, None, None)
+        )
+        # Quem está na fila de reprocessamento ainda não tem resultado final.
+        total = contadores["total"]
+        concluidos = total - contadores["pendentes"] - contadores["reprocessando"]
+        com_margem = contadores.pop("com_margem")
+        soma_margem = contadores.pop("soma_margem")
+        return {
+            "lote_id": lote_id,
+            "estado": estado,
+            "concorrencia": concorrencia,
+            "prioridade": prioridade,
+            "versao": versao,
+            **contadores,
+            "concluidos": concluidos,
+            "percentual": round(100 * concluidos / total, 1) if total else 0,
+            "margem_total": round(soma_margem, 2),
+            "margem_media": round(soma_margem / com_margem, 2) if com_margem else None,
+            "criado_em": _formatar_ts(criado_em),
+            "iniciado_em": iniciado_em,
+            "atualizado_em": _formatar_ts(atualizado_em),
+            "finalizado_em": finalizado_em,
+        }
+
+    def progresso(self, lote_id):
+        resumo = self.resumo(lote_id)
+        if resumo is None:
+            return None
+
+        # Leases vivos só existem entre os pendentes: o índice (lote_id, status) limita a varredura.
+        with self.persistencia.leitura() as conn:
+            em_andamento = conn.execute(
+                "SELECT COUNT(*) FROM consultas WHERE lote_id = ? AND status = 'Pendente' AND lease_expira > ?",
+                (lote_id, time.time())
+            ).fetchone()[0]
+
+        return {
+            "lote_id": lote_id,
+            "estado": resumo["estado"],
+            "concorrencia": resumo["concorrencia"],
+            "prioridade": resumo["prioridade"],
+            "total": resumo["total"],
+            "pendentes": resumo["pendentes"],
+            "reprocessando": resumo["reprocessando"],
+            "concluidos": resumo["concluidos"],
+            "em_andamento": em_andamento,
+            "percentual": resumo["percentual"],
+            "iniciado_em": resumo["iniciado_em"],
+            "finalizado_em": resumo["finalizado_em"],
+        }
+
+    def _reivindicar(self, lote_id, quantidade):
+        agora = time.time()
+
+        def reivindicar(c):
+            return c.execute(
+                """
+                UPDATE consultas SET lease_dono=?, lease_expira=?
+                WHERE id IN (
+                    SELECT id FROM consultas
+                    WHERE lote_id = ? AND status = 'Pendente'
+                      AND (lease_expira IS NULL OR lease_expira < ?)
+                    ORDER BY id LIMIT ?
+                )
+                RETURNING id, cpf
+                """,
+                (self.dono, agora + LOTE_LEASE, lote_id, agora, quantidade)
+            ).fetchall()
+
+        return sorted(self.persistencia.executar(reivindicar).result())
+
+    def _liberar(self, ids):
+        return self.persistencia.escrever_muitos(
+            "UPDATE consultas SET lease_dono=NULL, lease_expira=NULL WHERE id=? AND lease_dono=?",
+            [(id_, self.dono) for id_ in ids]
+        )
+
+    def _restam_pendentes(self, lote_id):
+        # CPFs na fila de reprocessamento também seguram o lote aberto até o resultado final.
+        with self.persistencia.leitura() as conn:
+            return conn.execute(
+                """
+                SELECT 1 FROM consultas
+                WHERE lote_id = ?
+                  AND (status = 'Pendente' OR (status >= 'Reprocessando' AND status < 'Reprocessandp'))
+                LIMIT 1
+                """,
+                (lote_id,)
+            ).fetchone() is not None
+
+    def _encerrar(self, execucao, estado=None):
+        # Chamado com self._cond adquirido.
+        if self._execucoes.get(execucao.lote_id) is execucao:
+            del self._execucoes[execucao.lote_id]
+        if estado is not None:
+            self.persistencia.escrever(
+                "UPDATE lotes SET estado=?, finalizado_em=? WHERE lote_id=? AND estado='executando'",
+                (estado, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), execucao.lote_id)
+            )
+        log.info(
+            "Lote encerrado",
+            extra={
+                "lote_id": execucao.lote_id,
+                "estado": estado or "interrompido",
+                "processados": execucao.processados,
+            },
+        )
+
+    def _recolher(self):
+        # Chamado com self._cond adquirido: devolve reservas de lotes pausados ou
+        # cancelados e encerra os que já não têm nada em voo.
+        for execucao in list(self._execucoes.values()):
+            if not execucao.parar.is_set():
+                continue
+            if execucao.reservados:
+                self._liberar([id_ for id_, _ in execucao.reservados])
+                execucao.reservados.clear()
+            if execucao.em_andamento == 0:
+                self._encerrar(execucao)
+
+    def _proxima(self):
+        # Chamado com self._cond adquirido. Weighted fair queuing: cada CPF
+        # despachado avança o tempo virtual do lote em 1/prioridade, e a próxima
+        # vaga vai para o lote elegível com o menor tempo virtual.
+        while True:
+            self._recolher()
+            agora = time.monotonic()
+            espera = 0.5
+            if self._em_andamento < self.capacidade():
+                elegiveis = []
+                for execucao in self._execucoes.values():
+                    if execucao.parar.is_set() or execucao.em_andamento >= execucao.concorrencia:
+                        continue
+                    if execucao.aguardar_ate > agora:
+                        espera = min(espera, execucao.aguardar_ate - agora)
+                        continue
+                    elegiveis.append(execucao)
+                if elegiveis:
+                    return min(elegiveis, key=lambda e: e.virtual)
+            self._cond.wait(espera)
+
+    def _devolver_vaga(self, execucao):
+        # Chamado com self._cond adquirido: a vaga tomada no despacho não virou tarefa.
+        execucao.em_andamento -= 1
+        self._em_andamento -= 1
+        self._cond.notify_all()
+
+    def _despachar(self):
+        while True:
+            try:
+                with self._cond:
+                    execucao = self._proxima()
+                    item = execucao.reservados.popleft() if execucao.reservados else None
+                    execucao.em_andamento += 1
+                    self._em_andamento += 1
+            except Exception:
+                log.exception("Erro no despachante de lotes")
+                time.sleep(1)
+                continue
+
+            try:
+                self._enviar(execucao, item)
+            except Exception:
+                # Sem devolver a vaga o lote nunca chega a em_andamento == 0 e não encerra.
+                log.exception("Erro no despachante de lotes", extra={"lote_id": execucao.lote_id})
+                with self._cond:
+                    self._devolver_vaga(execucao)
+                time.sleep(1)
+
+    def _enviar(self, execucao, item):
+        if item is None:
+            rows = self._reivindicar(
+                execucao.lote_id, min(LOTE_RESERVA, execucao.concorrencia)
+            )
+            restam = bool(rows) or self._restam_pendentes(execucao.lote_id)
+            with self._cond:
+                if not rows:
+                    self._devolver_vaga(execucao)
+                    if not restam and execucao.em_andamento == 0 and not execucao.parar.is_set():
+                        self._encerrar(execucao, "concluido")
+                    else:
+                        # O restante está em voo aqui ou com lease de outro
+                        # processo, e pode voltar se ele morrer.
+                        execucao.aguardar_ate = time.monotonic() + LOTE_ESPERA_LEASES
+                    return
+                item = rows[0]
+                execucao.reservados.extend(rows[1:])
+
+        with self._cond:
+            self._virtual = max(self._virtual, execucao.virtual)
+            execucao.virtual += 1.0 / execucao.prioridade
+            self._em_voo.add(item[0])
+        try:
+            self.executor.submit(self._processar, execucao, *item)
+        except Exception:
+            with self._cond:
+                self._em_voo.discard(item[0])
+            self._liberar([item[0]])
+            raise
+
+    def _processar(self, execucao, id_, cpf):
+        concluido = False
+        try:
+            if not execucao.parar.is_set():
+                self.processar_cpf(cpf, execucao.lote_id)
+                concluido = True
+        except Exception:
+            log.exception("Erro ao processar CPF do lote", extra={"cpf": cpf, "lote_id": execucao.lote_id})
+        finally:
+            if not concluido:
+                # Devolve o CPF para a fila em vez de esperar o lease expirar.
+                self._liberar([id_])
+            with self._cond:
+                self._em_voo.discard(id_)
+                execucao.em_andamento -= 1
+                execucao.processados += 1
+                agora = time.monotonic()
+                execucao.finalizados.append(agora)
+                while execucao.finalizados[0] < agora - 60:
+                    execucao.finalizados.popleft()
+                self._em_andamento -= 1
+                self._cond.notify_all()
+
+    def vazao(self, janela=60.0):
+        # CPFs concluídos por minuto neste processo, por lote ativo.
+        limite = time.monotonic() - janela
+        with self._cond:
+            vazao = {}
+            for lote_id, execucao in self._execucoes.items():
+                while execucao.finalizados and execucao.finalizados[0] < limite:
+                    execucao.finalizados.popleft()
+                vazao[lote_id] = round(len(execucao.finalizados) * 60.0 / janela, 1)
+            return vazao
+
+    def estatisticas(self):
+        with self._cond:
+            return {
+                "dono": self.dono,
+                "capacidade": self.capacidade(),
+                "em_andamento": self._em_andamento,
+                "tempo_virtual": round(self._virtual, 2),
+                "lotes": [
+                    {
+                        "lote_id": e.lote_id,
+                        "prioridade": e.prioridade,
+                        "concorrencia": e.concorrencia,
+                        "em_andamento": e.em_andamento,
+                        "reservados": len(e.reservados),
+                        "processados": e.processados,
+                        "tempo_virtual": round(e.virtual, 2),
+                        "pausado": e.parar.is_set(),
+                    }
+                    for e in self._execucoes.values()
+                ],
+            }
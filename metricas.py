@@ -0,0 +1,147 @@
+import bisect
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+BUCKETS_PADRAO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _formatar_rotulos(nomes, valores, extra=()):
+    pares = [f'{n}="{_escapar(v)}"' for n, v in list(zip(nomes, valores)) + list(extra)]
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+def _formatar_valor(valor):
+    if valor == float("inf"):
+        return "+Inf"
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class _Metrica:
+    tipo = "untyped"
+
+    def __init__(self, nome, ajuda, rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _chave(self, rotulos):
+        return tuple(str(rotulos.get(n, "")) for n in self.rotulos)
+
+    def exportar(self):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} {self.tipo}"]
+        for sufixo, chave, extra, valor in self._amostras():
+            linhas.append(
+                f"{self.nome}{sufixo}{_formatar_rotulos(self.rotulos, chave, extra)} {_formatar_valor(valor)}"
+            )
+        return linhas
+
+
+class Contador(_Metrica):
+    tipo = "counter"
+
+    def inc(self, valor=1, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            self._series[chave] = self._series.get(chave, 0) + valor
+
+    def _amostras(self):
+        with self._lock:
+            series = list(self._series.items())
+        for chave, valor in series:
+            yield "", chave, (), valor
+
+
+class Medidor(_Metrica):
+    tipo = "gauge"
+
+    def __init__(self, nome, ajuda, rotulos=(), funcao=None):
+        super().__init__(nome, ajuda, rotulos)
+        self.funcao = funcao
+
+    def _amostras(self):
+        # A função devolve um número ou {tupla de rótulos: valor}, lido na hora da coleta.
+        try:
+            valores = self.funcao()
+        except Exception as e:
+            log.warning("Erro ao coletar métrica", extra={"metrica": self.nome, "erro": str(e)})
+            return
+        if not isinstance(valores, dict):
+            valores = {(): valores}
+        for chave, valor in valores.items():
+            chave = chave if isinstance(chave, tuple) else (chave,)
+            yield "", tuple(str(v) for v in chave), (), valor
+
+
+class Histograma(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nome, ajuda, rotulos=(), buckets=BUCKETS_PADRAO):
+        super().__init__(nome, ajuda, rotulos)
+        self.buckets = tuple(sorted(buckets))
+
+    def observar(self, valor, **rotulos):
+        chave = self._chave(rotulos)
+        indice = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(chave)
+            if serie is None:
+                serie = self._series[chave] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            serie[0][indice] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def _amostras(self):
+        with self._lock:
+            series = [(chave, list(contagens), soma, total) for chave, (contagens, soma, total) in self._series.items()]
+        for chave, contagens, soma, total in series:
+            acumulado = 0
+            for limite, contagem in zip(self.buckets + (float("inf"),), contagens):
+                acumulado += contagem
+                yield "_bucket", chave, (("le", _formatar_valor(float(limite))),), acumulado
+            yield "_sum", chave, (), soma
+            yield "_count", chave, (), total
+
+
+class Registro:
+    def __init__(self, prefixo="fgts_clt"):
+        self.prefixo = prefixo
+        self._metricas = {}
+        self._lock = threading.Lock()
+
+    def _registrar(self, classe, nome, *args, **kwargs):
+        nome = f"{self.prefixo}_{nome}"
+        with self._lock:
+            metrica = self._metricas.get(nome)
+            if metrica is None:
+                metrica = self._metricas[nome] = classe(nome, *args, **kwargs)
+            return metrica
+
+    def contador(self, nome, ajuda, rotulos=()):
+        return self._registrar(Contador, nome, ajuda, rotulos)
+
+    def medidor(self, nome, ajuda, rotulos=(), funcao=None):
+        return self._registrar(Medidor, nome, ajuda, rotulos, funcao=funcao)
+
+    def histograma(self, nome, ajuda, rotulos=(), buckets=BUCKETS_PADRAO):
+        return self._registrar(Histograma, nome, ajuda, rotulos, buckets=buckets)
+
+    def exportar(self):
+        with self._lock:
+            metricas = list(self._metricas.values())
+        linhas = []
+        for metrica in metricas:
+            linhas.extend(metrica.exportar())
+        return "\n".join(linhas) + "\n"
+
+
+registro = Registro()
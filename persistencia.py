@@ -0,0 +1,221 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from metricas import registro
+
+log = logging.getLogger(__name__)
+
+PERSISTENCIA_LOTE_MAXIMO = int(os.environ.get("PERSISTENCIA_LOTE_MAXIMO", "500"))
+PERSISTENCIA_LATENCIA_MAXIMA = float(os.environ.get("PERSISTENCIA_LATENCIA_MAXIMA", "0.02"))
+PERSISTENCIA_LEITORES = int(os.environ.get("PERSISTENCIA_LEITORES", "4"))
+
+SQLITE_COMMIT = registro.histograma(
+    "sqlite_commit_segundos", "Duração de cada transação do escritor (BEGIN IMMEDIATE até COMMIT)."
+)
+SQLITE_ESCRITA = registro.histograma(
+    "sqlite_escrita_segundos", "Tempo de cada operação desde entrar na fila do escritor até o commit."
+)
+SQLITE_OPERACOES_POR_COMMIT = registro.histograma(
+    "sqlite_operacoes_por_commit", "Operações agrupadas em cada commit.",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000),
+)
+SQLITE_LEITURA = registro.histograma(
+    "sqlite_leitura_segundos", "Duração dos blocos de leitura nas conexões somente leitura."
+)
+
+
+def conectar(db_file, somente_leitura=False):
+    if somente_leitura:
+        caminho = os.path.abspath(db_file)
+        conn = sqlite3.connect(
+            f"file:{caminho}?mode=ro", uri=True, timeout=30, check_same_thread=False
+        )
+    else:
+        conn = sqlite3.connect(db_file, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+
+class _Operacao:
+    __slots__ = ("fn", "args", "futuro", "criada_em")
+
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+        self.futuro = Future()
+        self.criada_em = time.perf_counter()
+
+
+class Persistencia:
+    def __init__(
+        self,
+        db_file,
+        lote_maximo=PERSISTENCIA_LOTE_MAXIMO,
+        latencia_maxima=PERSISTENCIA_LATENCIA_MAXIMA,
+        leitores=PERSISTENCIA_LEITORES,
+    ):
+        self.db_file = db_file
+        self.lote_maximo = lote_maximo
+        self.latencia_maxima = latencia_maxima
+        self.max_leitores = leitores
+
+        self._fila = queue.Queue()
+        self._leitores = queue.LifoQueue()
+        self._leitores_abertos = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+        self._commits = 0
+        self._operacoes = 0
+        self._erros = 0
+        self._latencia_total = 0.0
+        self._latencia_maxima_obs = 0.0
+        self._latencia_ultima = 0.0
+        self._leituras = 0
+
+    def iniciar(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._escritor, daemon=True)
+            self._thread.start()
+
+    def parar(self, timeout=10):
+        if self._thread is None:
+            return
+        self._fila.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def executar(self, fn, *args):
+        if self._thread is None:
+            self.iniciar()
+        operacao = _Operacao(fn, args)
+        self._fila.put(operacao)
+        return operacao.futuro
+
+    def escrever(self, sql, params=()):
+        return self.executar(lambda c: c.execute(sql, params).rowcount)
+
+    def escrever_muitos(self, sql, linhas):
+        linhas = list(linhas)
+        return self.executar(lambda c: c.executemany(sql, linhas).rowcount)
+
+    def _proximo_lote(self, primeiro):
+        lote = [primeiro]
+        prazo = time.monotonic() + self.latencia_maxima
+        while len(lote) < self.lote_maximo:
+            restante = prazo - time.monotonic()
+            try:
+                item = self._fila.get(timeout=restante) if restante > 0 else self._fila.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._fila.put(None)
+                break
+            lote.append(item)
+        return lote
+
+    def _escritor(self):
+        conn = conectar(self.db_file)
+        try:
+            while True:
+                item = self._fila.get()
+                if item is None:
+                    break
+                self._gravar(conn, self._proximo_lote(item))
+        finally:
+            conn.close()
+
+    def _gravar(self, conn, lote):
+        inicio = time.perf_counter()
+        resultados = []
+        try:
+            c = conn.cursor()
+            c.execute("BEGIN IMMEDIATE")
+            for operacao in lote:
+                # Savepoint por operação: uma falha não derruba o restante do lote.
+                c.execute("SAVEPOINT op")
+                try:
+                    resultados.append((operacao, operacao.fn(c, *operacao.args), None))
+                    c.execute("RELEASE op")
+                except Exception as e:
+                    c.execute("ROLLBACK TO op")
+                    c.execute("RELEASE op")
+                    resultados.append((operacao, None, e))
+            c.execute("COMMIT")
+        except Exception as e:
+            log.error("Erro ao gravar lote de operações", extra={"operacoes": len(lote), "erro": str(e)})
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            with self._lock:
+                self._erros += len(lote)
+            for operacao in lote:
+                operacao.futuro.set_exception(e)
+            return
+
+        fim = time.perf_counter()
+        latencia = fim - inicio
+        SQLITE_COMMIT.observar(latencia)
+        SQLITE_OPERACOES_POR_COMMIT.observar(len(lote))
+        for operacao in lote:
+            SQLITE_ESCRITA.observar(fim - operacao.criada_em)
+        with self._lock:
+            self._commits += 1
+            self._operacoes += len(lote)
+            self._latencia_total += latencia
+            self._latencia_ultima = latencia
+            self._latencia_maxima_obs = max(self._latencia_maxima_obs, latencia)
+
+        for operacao, resultado, erro in resultados:
+            if erro is not None:
+                with self._lock:
+                    self._erros += 1
+                operacao.futuro.set_exception(erro)
+            else:
+                operacao.futuro.set_result(resultado)
+
+    @contextmanager
+    def leitura(self):
+        try:
+            conn = self._leitores.get_nowait()
+        except queue.Empty:
+            conn = conectar(self.db_file, somente_leitura=True)
+            with self._lock:
+                self._leitores_abertos += 1
+        inicio = time.perf_counter()
+        try:
+            yield conn
+        finally:
+            SQLITE_LEITURA.observar(time.perf_counter() - inicio)
+            with self._lock:
+                self._leituras += 1
+            if self._leitores.qsize() < self.max_leitores:
+                self._leitores.put(conn)
+            else:
+                conn.close()
+                with self._lock:
+                    self._leitores_abertos -= 1
+
+    def estatisticas(self):
+        with self._lock:
+            commits = self._commits
+            return {
+                "fila_escrita": self._fila.qsize(),
+                "commits": commits,
+                "operacoes": self._operacoes,
+                "erros": self._erros,
+                "operacoes_por_commit": round(self._operacoes / commits, 1) if commits else 0,
+                "latencia_commit_media_ms": round(1000 * self._latencia_total / commits, 2) if commits else 0,
+                "latencia_commit_maxima_ms": round(1000 * self._latencia_maxima_obs, 2),
+                "latencia_commit_ultima_ms": round(1000 * self._latencia_ultima, 2),
+                "leituras": self._leituras,
+                "leitores_abertos": self._leitores_abertos,
+            }
@@ -0,0 +1,183 @@
+import logging
+import os
+import random
+import threading
+import time
+
+from metricas import registro
+
+log = logging.getLogger(__name__)
+
+REPROCESSAMENTO_WORKERS = int(os.environ.get("REPROCESSAMENTO_WORKERS", "3"))
+REPROCESSAMENTO_BASE = float(os.environ.get("REPROCESSAMENTO_BASE", "15"))
+REPROCESSAMENTO_MAXIMO = float(os.environ.get("REPROCESSAMENTO_MAXIMO", "600"))
+REPROCESSAMENTO_LEASE = float(os.environ.get("REPROCESSAMENTO_LEASE", "120"))
+REPROCESSAMENTO_ESPERA_MAXIMA = float(os.environ.get("REPROCESSAMENTO_ESPERA_MAXIMA", "30"))
+
+REPROCESSAMENTO_TENTATIVAS = registro.contador(
+    "reprocessamento_tentativas_total", "Tentativas de reprocessamento por número da tentativa e resultado.",
+    ("tentativa", "resultado")
+)
+
+
+class FilaReprocessamento:
+    def __init__(
+        self,
+        persistencia,
+        processar,
+        desistir,
+        max_tentativas=3,
+        workers=REPROCESSAMENTO_WORKERS,
+        base=REPROCESSAMENTO_BASE,
+        maximo=REPROCESSAMENTO_MAXIMO,
+        lease=REPROCESSAMENTO_LEASE,
+    ):
+        self.persistencia = persistencia
+        self.processar = processar
+        self.desistir = desistir
+        self.max_tentativas = max_tentativas
+        self.workers = workers
+        self.base = base
+        self.maximo = maximo
+        self.lease = lease
+
+        self._cond = threading.Condition()
+        self._parar = threading.Event()
+        self._threads = []
+        self._sucessos = 0
+        self._falhas_definitivas = 0
+
+    def atraso(self, tentativas):
+        atraso = min(self.maximo, self.base * (2 ** max(0, tentativas - 1)))
+        return random.uniform(atraso / 2, atraso)
+
+    def agendar(self, cpf, lote_id, erro=None):
+        if not lote_id:
+            return None
+
+        agora = time.time()
+        futuro = self.persistencia.escrever(
+            """
+            INSERT INTO reprocessamentos (cpf, lote_id, tentativas, proxima_em, ultimo_erro, criado_em)
+            VALUES (?, ?, 0, ?, ?, ?)
+            ON CONFLICT(cpf, lote_id) DO UPDATE SET ultimo_erro=excluded.ultimo_erro
+            """,
+            (cpf, lote_id, agora + self.atraso(1), erro, agora)
+        )
+        futuro.add_done_callback(lambda f: self._acordar())
+        return futuro
+
+    def _acordar(self):
+        with self._cond:
+            self._cond.notify()
+
+    def _reivindicar(self):
+        agora = time.time()
+
+        def reivindicar(c):
+            rows = c.execute(
+                """
+                UPDATE reprocessamentos SET proxima_em=?, tentativas=tentativas + 1
+                WHERE rowid = (
+                    SELECT rowid FROM reprocessamentos WHERE proxima_em <= ?
+                    ORDER BY proxima_em LIMIT 1
+                )
+                RETURNING cpf, lote_id, tentativas
+                """,
+                (agora + self.lease, agora)
+            ).fetchall()
+            return rows[0] if rows else None
+
+        return self.persistencia.executar(reivindicar).result()
+
+    def _proximo_vencimento(self):
+        with self.persistencia.leitura() as conn:
+            return conn.execute("SELECT MIN(proxima_em) FROM reprocessamentos").fetchone()[0]
+
+    def _concluir(self, cpf, lote_id):
+        return self.persistencia.escrever(
+            "DELETE FROM reprocessamentos WHERE cpf=? AND lote_id=?", (cpf, lote_id)
+        )
+
+    def _reagendar(self, cpf, lote_id, tentativas, erro):
+        return self.persistencia.escrever(
+            "UPDATE reprocessamentos SET proxima_em=?, ultimo_erro=? WHERE cpf=? AND lote_id=?",
+            (time.time() + self.atraso(tentativas + 1), erro, cpf, lote_id)
+        )
+
+    def _trabalhar(self):
+        while not self._parar.is_set():
+            try:
+                item = self._reivindicar()
+            except Exception:
+                log.exception("Erro ao buscar CPF para reprocessar")
+                self._parar.wait(5)
+                continue
+
+            if item is None:
+                vencimento = self._proximo_vencimento()
+                espera = REPROCESSAMENTO_ESPERA_MAXIMA
+                if vencimento is not None:
+                    espera = min(espera, max(0.0, vencimento - time.time()))
+                with self._cond:
+                    self._cond.wait(espera)
+                continue
+
+            cpf, lote_id, tentativas = item
+            log.debug("Reprocessando CPF", extra={"cpf": cpf, "lote_id": lote_id, "tentativa": tentativas})
+            try:
+                concluido, erro = self.processar(cpf, lote_id, tentativas)
+            except Exception as e:
+                concluido, erro = False, f"Erro reprocessando ({e})"
+
+            if concluido:
+                REPROCESSAMENTO_TENTATIVAS.inc(tentativa=tentativas, resultado="sucesso")
+                with self._cond:
+                    self._sucessos += 1
+                self._concluir(cpf, lote_id)
+            elif tentativas >= self.max_tentativas:
+                log.warning(
+                    "CPF atingiu o máximo de tentativas", extra={"cpf": cpf, "lote_id": lote_id, "tentativa": tentativas}
+                )
+                REPROCESSAMENTO_TENTATIVAS.inc(tentativa=tentativas, resultado="desistencia")
+                with self._cond:
+                    self._falhas_definitivas += 1
+                self._concluir(cpf, lote_id)
+                self.desistir(cpf, lote_id, tentativas, erro)
+            else:
+                REPROCESSAMENTO_TENTATIVAS.inc(tentativa=tentativas, resultado="reagendado")
+                self._reagendar(cpf, lote_id, tentativas, erro)
+
+    def iniciar(self):
+        self._threads = [t for t in self._threads if t.is_alive()]
+        if self._threads:
+            return
+        self._parar.clear()
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._trabalhar, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        log.info("Workers de reprocessamento iniciados", extra={"workers": self.workers})
+
+    def parar(self):
+        self._parar.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    def estatisticas(self):
+        with self.persistencia.leitura() as conn:
+            pendentes, vencidos = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(proxima_em <= ?), 0) FROM reprocessamentos",
+                (time.time(),)
+            ).fetchone()
+            por_tentativa = dict(conn.execute(
+                "SELECT tentativas, COUNT(*) FROM reprocessamentos GROUP BY tentativas"
+            ).fetchall())
+        return {
+            "pendentes": pendentes,
+            "vencidos": vencidos,
+            "por_tentativa": por_tentativa,
+            "sucessos": self._sucessos,
+            "falhas_definitivas": self._falhas_definitivas,
+            "workers": len([t for t in self._threads if t.is_alive()]),
+        }
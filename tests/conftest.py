@@ -0,0 +1,42 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import PROXIMO_SEQ, init_db  # noqa: E402
+from persistencia import Persistencia  # noqa: E402
+
+
+@pytest.fixture
+def banco(tmp_path):
+    caminho = str(tmp_path / "consultas.db")
+    init_db(caminho)
+    return caminho
+
+
+@pytest.fixture
+def persistencia(banco):
+    p = Persistencia(banco)
+    p.iniciar()
+    yield p
+    p.parar()
+
+
+@pytest.fixture
+def inserir(persistencia):
+    # Mesma escrita do /registrar-lote, com status e horário escolhidos pelo teste.
+    def inserir(lote_id, cpfs, status="Pendente", atualizado_em=None, **colunas):
+        atualizado_em = time.time() if atualizado_em is None else atualizado_em
+        nomes = ", ".join(colunas)
+        marcadores = ", ".join("?" for _ in colunas)
+        extras = (f", {nomes}", f", {marcadores}") if colunas else ("", "")
+        return persistencia.escrever_muitos(
+            f"INSERT INTO consultas (cpf, status, data, lote_id, atualizado_em, seq{extras[0]}) "
+            f"VALUES (?, ?, '2025-10-09 11:49:35', ?, ?, {PROXIMO_SEQ}{extras[1]})",
+            [(cpf, status, lote_id, atualizado_em, *colunas.values()) for cpf in cpfs]
+        ).result()
+
+    return inserir
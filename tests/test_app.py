@@ -0,0 +1,40 @@
+import io
+
+import pytest
+from flask import Flask
+
+import app as aplicacao
+
+
+@pytest.fixture
+def cliente():
+    # Só o blueprint: sem create_app, nada de banco, threads ou pastas criadas.
+    flask_app = Flask(__name__)
+    flask_app.register_blueprint(aplicacao.rotas)
+    return flask_app.test_client()
+
+
+@pytest.mark.parametrize("campo, valor", [
+    ("concorrencia", "abc"),
+    ("concorrencia", 2.5),
+    ("prioridade", "alta"),
+    ("prioridade", True),
+])
+def test_iniciar_lote_rejeita_parametros_nao_inteiros(cliente, campo, valor):
+    resposta = cliente.post("/iniciar-lote", json={"lote_id": "L1", "cpfs": [], campo: valor})
+    assert resposta.status_code == 400
+    assert campo in resposta.get_json()["erro"]
+
+
+def test_importar_lote_rejeita_parametros_nao_inteiros(cliente):
+    resposta = cliente.post(
+        "/importar-lote",
+        data={"lote_id": "L1", "iniciar": "1", "prioridade": "alta", "arquivo": (io.BytesIO(b"cpf\n"), "a.csv")},
+    )
+    assert resposta.status_code == 400
+    assert "prioridade" in resposta.get_json()["erro"]
+
+
+@pytest.mark.parametrize("valor, esperado", [(None, None), ("", None), (" 4 ", 4), ("-1", -1), (7, 7)])
+def test_inteiro_opcional(valor, esperado):
+    assert aplicacao.inteiro_opcional(valor, "x") == esperado
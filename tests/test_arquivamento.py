@@ -0,0 +1,123 @@
+import sqlite3
+import time
+
+import pytest
+
+from arquivamento import Arquivador
+from database import SELECT_RESULTADO, init_db
+from exportacao import ExportadorLotes
+from persistencia import Persistencia
+
+ANTIGO = time.time() - 90 * 86400
+
+
+@pytest.fixture
+def arquivador(persistencia, tmp_path):
+    return Arquivador(persistencia, pasta=str(tmp_path / "arquivo"), intervalo=0, formato="csv.gz", bloco=2)
+
+
+def _linhas_banco(persistencia, lote_id):
+    with persistencia.leitura() as conn:
+        return conn.execute(
+            f"SELECT {SELECT_RESULTADO} FROM consultas WHERE lote_id = ? ORDER BY id", (lote_id,)
+        ).fetchall()
+
+
+def _resumo(persistencia, lote_id):
+    with persistencia.leitura() as conn:
+        return conn.execute(
+            "SELECT total, autorizados, soma_margem FROM resumo_lotes WHERE lote_id = ?", (lote_id,)
+        ).fetchone()
+
+
+def test_arquiva_poda_e_le_de_volta(arquivador, persistencia, inserir):
+    inserir("L1", ["001", "002", "003"], status="Autorizado", atualizado_em=ANTIGO, nome="ANA", margem=10.5)
+    inserir("L2", ["101"], status="Autorizado")
+    antes = _linhas_banco(persistencia, "L1")
+    resumo = _resumo(persistencia, "L1")
+
+    relatorio = arquivador.executar_ciclo()
+
+    assert (relatorio["lotes"], relatorio["linhas"]) == (1, 3)
+    assert _linhas_banco(persistencia, "L1") == []
+    assert list(arquivador.linhas("L1")) == antes
+    assert arquivador.cursor("L1")[0] == 3
+    # Os contadores do lote sobrevivem à poda; o lote recente fica no banco.
+    assert _resumo(persistencia, "L1") == resumo
+    assert len(_linhas_banco(persistencia, "L2")) == 1
+
+
+def test_linhas_novas_no_lote_arquivado_nao_sao_podadas(arquivador, persistencia, inserir):
+    inserir("L1", ["001", "002"], status="Autorizado", atualizado_em=ANTIGO)
+    arquivador.executar_ciclo()
+    max_seq = arquivador.arquivado("L1")["max_seq"]
+
+    inserir("L1", ["003"], status="Autorizado", atualizado_em=ANTIGO)
+    arquivador.executar_ciclo()
+
+    restantes = _linhas_banco(persistencia, "L1")
+    assert [r[0] for r in restantes] == ["003"]
+    assert arquivador.arquivado("L1")["max_seq"] == max_seq
+
+
+def test_poda_interrompida_e_retomada_no_proximo_ciclo(arquivador, persistencia, inserir, monkeypatch):
+    inserir("L1", ["001", "002", "003"], status="Autorizado", atualizado_em=ANTIGO)
+    monkeypatch.setattr(arquivador, "podar", lambda lote_id, max_seq: 0)
+    arquivador.executar_ciclo()
+    assert len(_linhas_banco(persistencia, "L1")) == 3
+
+    monkeypatch.undo()
+    relatorio = arquivador.executar_ciclo()
+
+    assert relatorio["linhas"] == 3
+    assert _linhas_banco(persistencia, "L1") == []
+    assert len(list(arquivador.linhas("L1"))) == 3
+
+
+def test_lote_com_pendentes_nao_e_arquivado(arquivador, persistencia, inserir):
+    inserir("L1", ["001"], status="Autorizado", atualizado_em=ANTIGO)
+    inserir("L1", ["002"], status="Reprocessando (2/3)", atualizado_em=ANTIGO)
+
+    assert arquivador.executar_ciclo()["lotes"] == 0
+    assert arquivador.arquivado("L1") is None
+
+
+def test_banco_antigo_so_converte_auto_vacuum_sob_pedido(tmp_path):
+    caminho = str(tmp_path / "antigo.db")
+    conn = sqlite3.connect(caminho)
+    conn.execute("CREATE TABLE consultas (id INTEGER PRIMARY KEY AUTOINCREMENT, cpf TEXT, data TEXT, "
+                 "resultado TEXT, lote_id TEXT)")
+    conn.commit()
+    conn.close()
+
+    init_db(caminho)
+    persistencia = Persistencia(caminho)
+    arquivador = Arquivador(persistencia, pasta=str(tmp_path / "arquivo"), intervalo=0, formato="csv.gz")
+    try:
+        # A subida não faz VACUUM; o ciclo não fica preso tentando liberar páginas.
+        assert arquivador.estatisticas()["auto_vacuum_incremental"] is False
+        assert arquivador.executar_ciclo()["paginas_liberadas"] == 0
+
+        assert arquivador.converter_banco()["convertido"] is True
+        assert arquivador.converter_banco()["convertido"] is False
+        assert arquivador.estatisticas()["auto_vacuum_incremental"] is True
+    finally:
+        persistencia.parar()
+
+
+def test_lote_arquivado_com_linhas_novas_le_arquivo_mais_banco(arquivador, persistencia, inserir, tmp_path):
+    inserir("L1", ["001", "002"], status="Autorizado", atualizado_em=ANTIGO)
+    arquivador.executar_ciclo()
+    max_seq = arquivador.arquivado("L1")["max_seq"]
+    inserir("L1", ["003"], status="Pendente")
+    novo = _linhas_banco(persistencia, "L1")
+    with persistencia.leitura() as conn:
+        seq_novo = conn.execute("SELECT seq FROM consultas WHERE cpf = '003'").fetchone()[0]
+
+    assert [r[0] for r in arquivador.linhas("L1")] == ["001", "002", "003"]
+    assert list(arquivador.linhas("L1", desde=max_seq)) == novo
+    assert arquivador.cursor("L1") == (3, seq_novo)
+
+    exportador = ExportadorLotes(persistencia, str(tmp_path), arquivo=arquivador)
+    assert exportador.cursor("L1") == (3, seq_novo)
+    assert [linha[0] for linha in exportador.linhas("L1")] == ["00000000001", "00000000002", "00000000003"]
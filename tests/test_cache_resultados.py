@@ -0,0 +1,54 @@
+import time
+
+import pytest
+
+from cache_resultados import CacheResultados
+
+AUTORIZADO = {"status": "Autorizado", "nome": "ANA", "margem": 10.5}
+NEGADO = {"status": "Não autorizado", "mensagem": "Sem margem"}
+
+
+@pytest.fixture
+def cache(persistencia):
+    return CacheResultados(persistencia, ttl_positivo=100, ttl_negativo=10, tamanho=2)
+
+
+def test_ttl_positivo_e_negativo(cache):
+    agora = time.time()
+    cache.guardar("001", AUTORIZADO, agora - 50)
+    cache.guardar("002", NEGADO, agora - 50)
+
+    consultado_em, resultado = cache.buscar("001")
+    assert consultado_em == agora - 50 and resultado["nome"] == "ANA" and resultado["margem"] == 10.5
+    # Negativo vence antes: o trabalhador pode ganhar margem a qualquer hora.
+    assert cache.buscar("002") is None
+
+
+def test_busca_no_banco_e_aquece_a_memoria(cache, inserir):
+    inserir("L1", ["001"], status="Autorizado", nome="ANA", consultado_em=time.time() - 5)
+    inserir("L2", ["002"], status="Autorizado", consultado_em=time.time() - 500)
+    inserir("L3", ["003"], status="Pendente")
+
+    assert cache.buscar("001")[1]["nome"] == "ANA"
+    assert cache.buscar("001") is not None
+    assert cache.buscar("002") is None
+    assert cache.buscar("003") is None
+
+    stats = cache.estatisticas()
+    assert (stats["hits_banco"], stats["hits_memoria"], stats["misses"]) == (1, 1, 2)
+
+
+def test_lru_descarta_o_menos_usado(cache):
+    agora = time.time()
+    for cpf in ("001", "002"):
+        cache.guardar(cpf, AUTORIZADO, agora)
+    cache.buscar("001")
+    cache.guardar("003", AUTORIZADO, agora)
+
+    assert list(cache._lru) == ["001", "003"]
+
+
+def test_ttl_zero_desliga_o_cache(persistencia):
+    cache = CacheResultados(persistencia, ttl_positivo=0, ttl_negativo=0)
+    cache.guardar("001", AUTORIZADO, time.time())
+    assert cache.buscar("001") is None
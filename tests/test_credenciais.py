@@ -0,0 +1,119 @@
+import pytest
+
+import credenciais
+from credenciais import Credencial, PoolCredenciais, falha_de_credencial, ler_credenciais
+from limitador import CircuitoAberto, DisjuntorCircuito, LimitadorAdaptativo
+from token_manager import CredencialRecusada, FalhaToken
+
+
+class Relogio:
+    def __init__(self):
+        self.agora = 1000.0
+
+    def __call__(self):
+        return self.agora
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    r = Relogio()
+    monkeypatch.setattr(credenciais.time, "monotonic", r)
+    return r
+
+
+def _credencial(nome, limite=4):
+    return Credencial(
+        nome,
+        token=None,
+        limitador=LimitadorAdaptativo(inicial=limite, minimo=1, maximo=limite),
+        disjuntor=DisjuntorCircuito(falhas_consecutivas=100, nome=nome),
+    )
+
+
+def _falhar(pool, credencial, resultado="auth"):
+    assert pool.adquirir(0) is credencial
+    pool.liberar(credencial, 0.1, resultado)
+
+
+def test_ler_credenciais():
+    assert ler_credenciais("", "Basic padrao") == [("padrao", "Basic padrao")]
+    assert ler_credenciais("a=Basic x, b = Basic y,", "Basic padrao") == [("a", "Basic x"), ("b", "Basic y")]
+    for invalido in ("a", "a b=Basic x", "a=Basic x,a=Basic y"):
+        with pytest.raises(ValueError):
+            ler_credenciais(invalido, "Basic padrao")
+
+
+def test_falha_de_credencial_olha_a_causa():
+    assert falha_de_credencial(CredencialRecusada("401"))
+    try:
+        try:
+            raise CredencialRecusada("401")
+        except CredencialRecusada as e:
+            raise FalhaToken("Falha ao renovar token") from e
+    except FalhaToken as e:
+        assert falha_de_credencial(e)
+    assert not falha_de_credencial(FalhaToken("500 Server Error"))
+
+
+def test_escolhe_a_menos_carregada(relogio):
+    a, b = _credencial("a"), _credencial("b")
+    pool = PoolCredenciais([a, b])
+
+    escolhidas = [pool.adquirir(0) for _ in range(4)]
+    assert sorted(c.nome for c in escolhidas) == ["a", "a", "b", "b"]
+    assert pool.capacidade() == 8
+
+
+def test_quarentena_apos_falhas_de_autenticacao(relogio):
+    a, b = _credencial("a"), _credencial("b")
+    pool = PoolCredenciais([a, b], falhas_quarentena=3, quarentena_maxima=300)
+    b.limitador.limite = 0.5  # fora da escolha enquanto a acumula falhas
+
+    for _ in range(3):
+        _falhar(pool, a)
+    assert a.em_quarentena() and a.motivo == "auth"
+
+    b.limitador.limite = 4
+    assert {pool.adquirir(0).nome for _ in range(3)} == {"b"}
+    assert pool.capacidade() == 4
+
+    # Na volta uma falha basta, com o dobro do tempo.
+    relogio.agora += credenciais.CREDENCIAL_QUARENTENA
+    assert not a.em_quarentena()
+    b.limitador.limite = 0.5
+    _falhar(pool, a)
+    assert a.quarentena_ate - relogio.agora == 2 * credenciais.CREDENCIAL_QUARENTENA
+
+
+def test_ultima_credencial_nunca_entra_em_quarentena(relogio):
+    a = _credencial("a")
+    pool = PoolCredenciais([a], falhas_quarentena=1)
+
+    _falhar(pool, a)
+    assert not a.em_quarentena()
+    assert pool.adquirir(0) is a
+
+
+def test_429_so_conta_com_o_limitador_no_minimo(relogio):
+    a, b = _credencial("a"), _credencial("b")
+    pool = PoolCredenciais([a, b], falhas_quarentena=2)
+    b.limitador.limite = 0.5
+
+    # Acima do mínimo o AIMD recua sozinho; no mínimo a conta está barrada.
+    _falhar(pool, a, "429")
+    assert a._falhas_seguidas == 0 and a.limitador.limite < 4
+    a.limitador.limite = a.limitador.minimo
+    _falhar(pool, a, "429")
+    relogio.agora += 10
+    _falhar(pool, a, "429")
+    assert a.em_quarentena() and a.motivo == "429"
+
+
+def test_sem_credencial_disponivel_estoura_o_prazo(relogio):
+    a, b = _credencial("a"), _credencial("b")
+    pool = PoolCredenciais([a, b])
+    a.disjuntor.estado = b.disjuntor.estado = DisjuntorCircuito.ABERTO
+    a.disjuntor._reabre_em = b.disjuntor._reabre_em = float("inf")
+
+    with pytest.raises(CircuitoAberto):
+        pool.adquirir(0)
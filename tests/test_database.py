@@ -0,0 +1,102 @@
+import sqlite3
+
+import pytest
+
+from database import init_db, interpretar_resultado_legado
+
+LEGADO = (
+    "Nome: GABRIELLE CARLA CAMPOS VIEIRA, Data Nascimento: 16/09/2001, Data Admissao: 17/07/2025, "
+    "Valor Liberado: 2.943,42, Margem: 402,90, Elegível: SIM, Status: Autorizado, "
+    "Mensagem: CPF autorizado com sucesso"
+)
+
+
+@pytest.mark.parametrize("texto, esperado", [
+    (None, {}),
+    ("  ", {}),
+    ("Pendente", {"status": "Pendente"}),
+    ("Base offline", {"mensagem": "Base offline"}),
+    (
+        LEGADO,
+        {
+            "nome": "GABRIELLE CARLA CAMPOS VIEIRA",
+            "data_nascimento": "16/09/2001",
+            "data_admissao": "17/07/2025",
+            "valor_liberado": "2.943,42",
+            "margem": "402,90",
+            "elegivel": "SIM",
+            "status": "Autorizado",
+            "mensagem": "CPF autorizado com sucesso",
+        },
+    ),
+    # Falhas antigas anexavam campos ao texto já gravado: vale o último.
+    (
+        "Status: Reprocessando (1/3), Mensagem: timeout, Status: Falhou após 3 tentativas",
+        {"status": "Falhou após 3 tentativas", "mensagem": "timeout"},
+    ),
+])
+def test_interpretar_resultado_legado(texto, esperado):
+    assert interpretar_resultado_legado(texto) == esperado
+
+
+@pytest.fixture
+def banco_legado(tmp_path):
+    # Esquema de antes da migração: o resultado inteiro num texto só.
+    caminho = str(tmp_path / "legado.db")
+    conn = sqlite3.connect(caminho)
+    conn.executescript(
+        """
+        CREATE TABLE consultas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cpf TEXT,
+            data TEXT,
+            resultado TEXT,
+            lote_id TEXT
+        );
+        CREATE UNIQUE INDEX idx_consultas_cpf_lote ON consultas(cpf, lote_id);
+        CREATE INDEX idx_consultas_lote_id ON consultas(lote_id);
+        """
+    )
+    conn.executemany(
+        "INSERT INTO consultas (cpf, data, resultado, lote_id) VALUES (?, ?, ?, ?)",
+        [
+            ("70044307667", "2025-10-09 11:49:35", LEGADO, "L1"),
+            ("70020372698", "2025-10-09 11:49:40", "Pendente", "L1"),
+            ("04265296505", "2025-10-09 11:50:00", "Base offline", "L1"),
+            ("03882857617", "2025-10-09 11:50:03", None, None),
+        ]
+    )
+    conn.commit()
+    conn.close()
+    return caminho
+
+
+def test_init_db_migra_resultados_legados(banco_legado):
+    init_db(banco_legado)
+    init_db(banco_legado)
+
+    conn = sqlite3.connect(banco_legado)
+    try:
+        rows = conn.execute(
+            "SELECT cpf, status, nome, valor_liberado, margem, elegivel, mensagem, seq, atualizado_em "
+            "FROM consultas ORDER BY id"
+        ).fetchall()
+        resumo = conn.execute(
+            "SELECT total, pendentes, autorizados, com_margem, soma_margem FROM resumo_lotes WHERE lote_id='L1'"
+        ).fetchone()
+    finally:
+        conn.close()
+
+    autorizado, pendente, texto_livre, sem_resultado = rows
+    assert autorizado[:7] == (
+        "70044307667", "Autorizado", "GABRIELLE CARLA CAMPOS VIEIRA", 2943.42, 402.9, "SIM",
+        "CPF autorizado com sucesso",
+    )
+    assert pendente[1] == "Pendente"
+    assert texto_livre[1] is None and texto_livre[6] == "Base offline"
+    assert sem_resultado[1] is None
+
+    # seq e atualizado_em preenchidos a partir da ordem e da coluna data.
+    assert len({r[7] for r in rows}) == len(rows) and all(r[7] for r in rows)
+    assert all(r[8] for r in rows)
+    assert resumo == (3, 1, 1, 1, 402.9)
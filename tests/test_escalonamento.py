@@ -0,0 +1,89 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import lotes
+from lotes import MotorLotes
+
+
+@pytest.fixture
+def motor(persistencia, monkeypatch):
+    monkeypatch.setattr(lotes, "LOTE_ESPERA_LEASES", 0.05)
+    ordem = []
+    simultaneos = {"atual": {}, "maximo": {}}
+    trava = threading.Lock()
+    comecar = threading.Event()
+
+    def processar_cpf(cpf, lote_id):
+        comecar.wait(5)
+        with trava:
+            ordem.append(lote_id)
+            atual = simultaneos["atual"][lote_id] = simultaneos["atual"].get(lote_id, 0) + 1
+            simultaneos["maximo"][lote_id] = max(simultaneos["maximo"].get(lote_id, 0), atual)
+        time.sleep(0.005)
+        with trava:
+            simultaneos["atual"][lote_id] -= 1
+        persistencia.escrever(
+            "UPDATE consultas SET status='Autorizado' WHERE cpf=? AND lote_id=?", (cpf, lote_id)
+        ).result()
+
+    executor = ThreadPoolExecutor(max_workers=4)
+    capacidade = {"valor": 1}
+    m = MotorLotes(executor, processar_cpf, persistencia, capacidade=lambda: capacidade["valor"])
+    m.ordem, m.simultaneos, m.comecar, m.capacidade_teste = ordem, simultaneos, comecar, capacidade
+    yield m
+    # Nada pode ficar esperando o escritor depois que a persistência parar.
+    for lote_id in list(m._execucoes):
+        m._interromper(lote_id)
+    comecar.set()
+    executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _aguardar(condicao, prazo=10):
+    fim = time.monotonic() + prazo
+    while not condicao() and time.monotonic() < fim:
+        time.sleep(0.02)
+    return condicao()
+
+
+def test_vagas_divididas_pela_prioridade(motor, inserir):
+    inserir("A", [f"A{i:03d}" for i in range(60)])
+    inserir("B", [f"B{i:03d}" for i in range(60)])
+    motor.iniciar("A", concorrencia=4, prioridade=3)
+    motor.iniciar("B", concorrencia=4, prioridade=1)
+    motor.comecar.set()
+
+    assert _aguardar(lambda: len(motor.ordem) >= 40)
+    primeiros = motor.ordem[:40]
+    # 3:1 enquanto os dois disputam a única vaga (folga para o CPF já em voo na largada).
+    assert 28 <= primeiros.count("A") <= 32
+
+
+def test_concorrencia_por_lote_e_respeitada(motor, inserir):
+    motor.capacidade_teste["valor"] = 4
+    inserir("A", [f"A{i:03d}" for i in range(20)])
+    inserir("B", [f"B{i:03d}" for i in range(20)])
+    motor.iniciar("A", concorrencia=1)
+    motor.iniciar("B", concorrencia=3)
+    motor.comecar.set()
+
+    assert _aguardar(lambda: motor.resumo("A")["estado"] == "concluido" and motor.resumo("B")["estado"] == "concluido")
+    assert motor.simultaneos["maximo"]["A"] == 1
+    assert 1 <= motor.simultaneos["maximo"]["B"] <= 3
+
+
+def test_lote_novo_entra_no_tempo_virtual_corrente(motor, inserir):
+    inserir("A", [f"A{i:03d}" for i in range(30)])
+    motor.iniciar("A", concorrencia=4)
+    motor.comecar.set()
+    assert _aguardar(lambda: len(motor.ordem) >= 15)
+
+    inserir("B", [f"B{i:03d}" for i in range(30)])
+    motor.iniciar("B", concorrencia=4)
+    assert _aguardar(lambda: motor.ordem.count("B") >= 5)
+
+    # Sem crédito acumulado: B alterna com A em vez de tomar todas as vagas seguidas.
+    depois = motor.ordem[motor.ordem.index("B"):][:10]
+    assert 3 <= depois.count("A") <= 7
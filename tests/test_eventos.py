@@ -0,0 +1,70 @@
+import threading
+import time
+
+import pytest
+
+from database import PROXIMO_SEQ, SELECT_RESULTADO
+from eventos import DifusorEventos
+
+
+@pytest.fixture
+def difusor(persistencia):
+    d = DifusorEventos(persistencia, varredura=30)
+    d.iniciar()
+    yield d
+    d.parar()
+
+
+def _assistir(difusor, lote_id, desde=0):
+    ids = []
+
+    def consumir():
+        for evento in difusor.assinar(lote_id, desde):
+            if evento.startswith("id: "):
+                ids.append(int(evento.split("\n", 1)[0][4:]))
+
+    threading.Thread(target=consumir, daemon=True).start()
+    return ids
+
+
+def _gravar(cpf):
+    def gravar(c):
+        rows = c.execute(
+            f"UPDATE consultas SET status='Autorizado', seq={PROXIMO_SEQ} WHERE cpf=? "
+            f"RETURNING seq, {SELECT_RESULTADO}",
+            (cpf,)
+        ).fetchall()
+        return [(row[0], row[1:]) for row in rows]
+
+    return gravar
+
+
+def _aguardar(ids, quantidade, prazo=3):
+    fim = time.monotonic() + prazo
+    while len(ids) < quantidade and time.monotonic() < fim:
+        time.sleep(0.02)
+    return ids
+
+
+def test_entrega_em_ordem_de_seq_entre_workers(difusor, persistencia, inserir):
+    inserir("L1", ["001", "002"])
+    with persistencia.leitura() as conn:
+        inicio = conn.execute("SELECT MAX(seq) FROM consultas").fetchone()[0]
+    ids = _assistir(difusor, "L1", desde=inicio)
+    time.sleep(0.2)
+
+    # Outro worker grava (sem passar por este difusor) e logo depois este processo.
+    persistencia.executar(_gravar("001")).result()
+    difusor.publicar_apos_commit(persistencia.executar(_gravar("002")), "L1").result()
+
+    assert _aguardar(ids, 2) == [inicio + 1, inicio + 2]
+
+
+def test_retomada_pelo_last_event_id_nao_repete_nem_pula(difusor, persistencia, inserir):
+    inserir("L1", ["001", "002", "003"])
+    with persistencia.leitura() as conn:
+        seqs = [r[0] for r in conn.execute("SELECT seq FROM consultas ORDER BY seq")]
+
+    ids = _assistir(difusor, "L1", desde=seqs[0])
+
+    assert _aguardar(ids, 2) == seqs[1:]
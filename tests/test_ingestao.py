@@ -0,0 +1,57 @@
+import io
+
+import pytest
+
+from ingestao import ingerir_cpfs, ler_cpfs, normalizar_cpf, validar_cpfs
+
+
+@pytest.mark.parametrize("valor, esperado", [
+    (None, ""),
+    ("", ""),
+    ("529.982.247-25", "52998224725"),
+    (52998224725.0, "52998224725"),
+    ("1234567890", "01234567890"),
+    ("٥٢٩٩٨٢٢٤٧٢٥", "٥٢٩٩٨٢٢٤٧٢٥"),
+])
+def test_normalizar_cpf(valor, esperado):
+    assert normalizar_cpf(valor) == esperado
+
+
+def test_validar_cpfs_confere_digitos():
+    cpfs = ["52998224725", "52998224724", "11111111111", "5299822472", "٥٢٩٩٨٢٢٤٧٢٥", "1234567890a"]
+    assert validar_cpfs(cpfs).tolist() == [True, False, False, False, False, False]
+    assert validar_cpfs([]).tolist() == []
+
+
+def test_ler_cpfs_acha_a_coluna_pelo_cabecalho():
+    arquivo = io.BytesIO("nome;CPF\nANA;529.982.247-25\nBIA;\n".encode("utf-8-sig"))
+    assert list(ler_cpfs(arquivo, "base.csv")) == ["529.982.247-25", ""]
+
+    with pytest.raises(ValueError):
+        ler_cpfs(io.BytesIO(b""), "base.pdf")
+
+
+def test_ingerir_cpfs_descarta_invalidos_e_repetidos():
+    registrados = []
+
+    def registrar(cpfs):
+        novos = [c for c in cpfs if c != "39053344705"]
+        registrados.extend(cpfs)
+        return len(novos)
+
+    valores = [
+        "529.982.247-25", "52998224725", "", "123", "٥٢٩٩٨٢٢٤٧٢٥", "39053344705", None, "11144477735",
+    ]
+    relatorio = ingerir_cpfs(valores, registrar, bloco=3)
+
+    assert registrados == ["52998224725", "39053344705", "11144477735"]
+    assert relatorio == {
+        "linhas": 8,
+        "vazias": 2,
+        "invalidos": 2,
+        "duplicados": 1,
+        "ja_registrados": 1,
+        "registrados": 2,
+        "amostra_invalidos": ["00000000123", "٥٢٩٩٨٢٢٤٧٢٥"],
+        "chamadas_evitadas": 4,
+    }
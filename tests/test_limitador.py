@@ -0,0 +1,114 @@
+import pytest
+
+import limitador
+from limitador import DisjuntorCircuito, LimitadorAdaptativo
+
+
+class Relogio:
+    def __init__(self):
+        self.agora = 1000.0
+
+    def __call__(self):
+        return self.agora
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    r = Relogio()
+    monkeypatch.setattr(limitador.time, "monotonic", r)
+    return r
+
+
+def _rodada(lim, n, latencia=0.1, sobrecarga=False):
+    for _ in range(n):
+        assert lim.adquirir(timeout=0)
+    for _ in range(n):
+        lim.liberar(latencia, sobrecarga)
+
+
+def test_aimd_sobe_aditivo_so_quando_o_limite_e_usado(relogio):
+    lim = LimitadorAdaptativo(inicial=4, minimo=1, maximo=8, latencia_alvo=1)
+
+    # Uma chamada por vez não usa metade do limite: nada de aumento.
+    for _ in range(20):
+        _rodada(lim, 1)
+    assert lim.limite == 4
+
+    _rodada(lim, 4)
+    assert 4 < lim.limite < 5
+    for _ in range(50):
+        _rodada(lim, int(lim.limite))
+    assert lim.limite == 8
+
+
+def test_aimd_corta_pela_metade_uma_vez_por_rodada(relogio):
+    lim = LimitadorAdaptativo(inicial=8, minimo=1, maximo=8, fator_reducao=0.5)
+
+    _rodada(lim, 8, sobrecarga=True)
+    assert lim.limite == 4
+
+    relogio.agora += 1
+    _rodada(lim, 4, sobrecarga=True)
+    assert lim.limite == 2
+    for _ in range(5):
+        relogio.agora += 1
+        _rodada(lim, 1, sobrecarga=True)
+    assert lim.limite == 1
+
+
+def test_aimd_latencia_acima_do_alvo_nao_aumenta(relogio):
+    lim = LimitadorAdaptativo(inicial=2, latencia_alvo=1)
+    _rodada(lim, 2, latencia=5)
+    assert lim.limite == 2
+
+
+def test_adquirir_respeita_o_limite_e_devolver_libera(relogio):
+    lim = LimitadorAdaptativo(inicial=2)
+    assert lim.adquirir(timeout=0) and lim.adquirir(timeout=0)
+    assert not lim.adquirir(timeout=0)
+    assert lim.carga() == 1
+
+    lim.devolver()
+    assert lim.adquirir(timeout=0)
+
+
+def test_disjuntor_abre_com_falhas_seguidas_e_fecha_pela_sonda(relogio):
+    d = DisjuntorCircuito(falhas_consecutivas=3, janela=10, tempo_aberto=10, tempo_aberto_maximo=40)
+
+    for _ in range(3):
+        assert d.permitir()
+        d.registrar(False)
+    assert d.estado == d.ABERTO and not d.permitir() and not d.disponivel()
+
+    relogio.agora += 10
+    assert d.disponivel()
+    assert d.permitir() and d.estado == d.MEIO_ABERTO
+    # Uma sonda só por vez.
+    assert not d.permitir() and not d.disponivel()
+
+    d.registrar(True)
+    assert d.estado == d.FECHADO and d.permitir()
+
+
+def test_disjuntor_sonda_falha_dobra_o_tempo_aberto(relogio):
+    d = DisjuntorCircuito(falhas_consecutivas=1, tempo_aberto=10, tempo_aberto_maximo=25)
+    d.registrar(False)
+    relogio.agora += 10
+
+    for esperado in (20, 25, 25):
+        assert d.permitir()
+        d.registrar(False)
+        assert d.estado == d.ABERTO
+        relogio.agora += esperado - 0.1
+        assert not d.disponivel()
+        relogio.agora += 0.1
+        assert d.disponivel()
+
+
+def test_disjuntor_abre_pela_taxa_de_falhas_na_janela(relogio):
+    d = DisjuntorCircuito(falhas_consecutivas=100, taxa_falhas=0.5, janela=4)
+    for sucesso in (True, False, True):
+        d.registrar(sucesso)
+    assert d.estado == d.FECHADO
+    d.registrar(False)
+    assert d.estado == d.ABERTO
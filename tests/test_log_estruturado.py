@@ -0,0 +1,69 @@
+import hashlib
+import json
+import logging
+import sys
+
+import pytest
+
+import log_estruturado
+from log_estruturado import FormatadorJson, HandlerFila, corpo_resposta, hash_cpf
+
+CPF = "52998224725"
+
+
+@pytest.fixture(autouse=True)
+def chave(tmp_path, monkeypatch):
+    monkeypatch.setattr(log_estruturado, "LOG_CHAVE_CPF", "")
+    monkeypatch.setattr(log_estruturado, "LOG_CHAVE_CPF_ARQUIVO", str(tmp_path / "chave.key"))
+    monkeypatch.setattr(log_estruturado, "_chave_cpf", None)
+    return tmp_path / "chave.key"
+
+
+def _formatar(msg, args=(), exc_info=None, **extra):
+    record = logging.getLogger("teste").makeRecord("teste", logging.ERROR, "f", 1, msg, args, exc_info, extra=extra)
+    return json.loads(FormatadorJson().format(HandlerFila(None).prepare(record)))
+
+
+def test_hash_usa_chave_secreta_persistida(chave, monkeypatch):
+    primeiro = hash_cpf(CPF)
+
+    assert primeiro != hashlib.sha256(CPF.encode()).hexdigest()[:16]
+    assert chave.read_text()
+    # Outro processo (ou reinício) lê a mesma chave e chega ao mesmo hash.
+    monkeypatch.setattr(log_estruturado, "_chave_cpf", None)
+    assert hash_cpf(CPF) == primeiro
+
+    monkeypatch.setattr(log_estruturado, "LOG_CHAVE_CPF", "outra")
+    monkeypatch.setattr(log_estruturado, "_chave_cpf", None)
+    assert hash_cpf(CPF) != primeiro
+    assert hash_cpf(None) is None
+
+
+def test_formatador_nao_deixa_cpf_cru():
+    try:
+        raise ValueError(f"500 Server Error for url: https://facta/consulta?cpf={CPF}")
+    except ValueError as e:
+        saida = _formatar("CPF %s falhou", (CPF,), sys.exc_info(), cpf=CPF, erro=str(e), tentativa=2)
+
+    assert CPF not in json.dumps(saida)
+    marca = f"cpf:{hash_cpf(CPF)}"
+    assert saida["msg"] == f"CPF {marca} falhou"
+    assert saida["erro"].endswith(f"?cpf={marca}")
+    assert marca in saida["excecao"]
+    assert saida["cpf_hash"] == hash_cpf(CPF)
+    assert saida["tentativa"] == 2
+
+
+def test_mascara_so_sequencias_de_onze_digitos():
+    texto = f"cpf {CPF}, telefone 119876543210, cep 01310100"
+    assert log_estruturado.mascarar_cpfs(texto) == (
+        f"cpf cpf:{hash_cpf(CPF)}, telefone 119876543210, cep 01310100"
+    )
+
+
+def test_corpo_resposta_corta_e_mascara(monkeypatch):
+    monkeypatch.setattr(log_estruturado, "LOG_CORPO_MAXIMO", 20)
+    corpo = f'{{"cpf": "{CPF}", "nome": "FULANO DE TAL"}}'
+
+    cortado = corpo_resposta(corpo, forcar=True)
+    assert CPF not in cortado and cortado.endswith(f"...(+{len(corpo) - 20})")
@@ -0,0 +1,172 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import lotes
+from lotes import MotorLotes
+
+
+@pytest.fixture
+def motor(persistencia, monkeypatch):
+    monkeypatch.setattr(lotes, "LOTE_ESPERA_LEASES", 0.05)
+    processados = []
+    liberar = threading.Event()
+    liberar.set()
+
+    def processar_cpf(cpf, lote_id):
+        liberar.wait(5)
+        processados.append(cpf)
+        persistencia.escrever(
+            "UPDATE consultas SET status='Autorizado' WHERE cpf=? AND lote_id=?", (cpf, lote_id)
+        ).result()
+
+    executor = ThreadPoolExecutor(max_workers=4)
+    m = MotorLotes(executor, processar_cpf, persistencia)
+    m.processados, m.liberar = processados, liberar
+    yield m
+    # Nada pode ficar esperando o escritor depois que a persistência parar.
+    for lote_id in list(m._execucoes):
+        m._interromper(lote_id)
+    liberar.set()
+    executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _leases(persistencia, lote_id):
+    with persistencia.leitura() as conn:
+        return dict(conn.execute(
+            "SELECT cpf, lease_dono FROM consultas WHERE lote_id = ? ORDER BY cpf", (lote_id,)
+        ).fetchall())
+
+
+def _aguardar_estado(motor, lote_id, estado, prazo=5):
+    fim = time.monotonic() + prazo
+    while time.monotonic() < fim:
+        if motor.resumo(lote_id)["estado"] == estado:
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_reivindica_leases_vencidos_e_respeita_os_vivos(motor, persistencia, inserir):
+    inserir("L1", ["001", "002", "003"])
+    agora = time.time()
+    persistencia.escrever(
+        "UPDATE consultas SET lease_dono='morto', lease_expira=? WHERE cpf='001'", (agora - 10,)
+    ).result()
+    persistencia.escrever(
+        "UPDATE consultas SET lease_dono='vivo', lease_expira=? WHERE cpf='002'", (agora + 600,)
+    ).result()
+
+    reivindicados = motor._reivindicar("L1", 10)
+
+    assert [cpf for _, cpf in reivindicados] == ["001", "003"]
+    assert _leases(persistencia, "L1") == {"001": motor.dono, "002": "vivo", "003": motor.dono}
+    assert motor._reivindicar("L1", 10) == []
+
+
+def test_lote_retoma_cpfs_de_processo_morto(motor, persistencia, inserir):
+    inserir("L1", ["001", "002"])
+    persistencia.escrever(
+        "UPDATE consultas SET lease_dono='morto', lease_expira=? WHERE lote_id='L1'", (time.time() - 1,)
+    ).result()
+
+    motor.iniciar("L1")
+
+    assert _aguardar_estado(motor, "L1", "concluido")
+    assert sorted(motor.processados) == ["001", "002"]
+
+
+def test_parar_devolve_reservas_e_so_afeta_o_lote(motor, persistencia, inserir):
+    inserir("L1", ["001", "002", "003"])
+    inserir("L2", ["101"])
+    motor.liberar.clear()
+    motor.iniciar("L1", concorrencia=1)
+    motor.iniciar("L2", concorrencia=1)
+    time.sleep(0.3)
+
+    motor.parar("L1")
+    motor.liberar.set()
+
+    assert _aguardar_estado(motor, "L2", "concluido")
+    assert motor.resumo("L1")["estado"] == "parado"
+    with persistencia.leitura() as conn:
+        presos = conn.execute(
+            "SELECT COUNT(*) FROM consultas WHERE lote_id='L1' AND status='Pendente' AND lease_dono IS NOT NULL"
+        ).fetchone()[0]
+    assert presos == 0
+
+
+def test_falha_no_despacho_devolve_a_vaga(motor, persistencia, inserir, monkeypatch):
+    inserir("L1", ["001", "002", "003"])
+    original = motor._reivindicar
+    falhas = []
+
+    def reivindicar(lote_id, quantidade):
+        if not falhas:
+            falhas.append(lote_id)
+            raise RuntimeError("database is locked")
+        return original(lote_id, quantidade)
+
+    monkeypatch.setattr(motor, "_reivindicar", reivindicar)
+    motor.iniciar("L1")
+
+    assert _aguardar_estado(motor, "L1", "concluido")
+    assert falhas and sorted(motor.processados) == ["001", "002", "003"]
+    assert motor._em_andamento == 0
+
+
+def test_falha_ao_gravar_devolve_o_cpf(persistencia, inserir, monkeypatch):
+    monkeypatch.setattr(lotes, "LOTE_ESPERA_LEASES", 0.05)
+    tentativas = []
+
+    def processar_cpf(cpf, lote_id):
+        tentativas.append(cpf)
+        if tentativas.count(cpf) == 1:
+            raise RuntimeError("disk I/O error")
+        persistencia.escrever(
+            "UPDATE consultas SET status='Autorizado' WHERE cpf=? AND lote_id=?", (cpf, lote_id)
+        ).result()
+
+    executor = ThreadPoolExecutor(max_workers=2)
+    motor = MotorLotes(executor, processar_cpf, persistencia)
+    inserir("L1", ["001", "002"])
+    motor.iniciar("L1")
+
+    assert _aguardar_estado(motor, "L1", "concluido")
+    assert sorted(tentativas) == ["001", "001", "002", "002"]
+    executor.shutdown(wait=True)
+
+
+def test_vigia_so_renova_leases_em_uso(motor, persistencia, inserir):
+    inserir("L1", ["001", "002"])
+    vencido = time.time() - 1
+    persistencia.escrever(
+        "UPDATE consultas SET lease_dono=?, lease_expira=? WHERE lote_id='L1'", (motor.dono, vencido)
+    ).result()
+    with persistencia.leitura() as conn:
+        id_001 = conn.execute("SELECT id FROM consultas WHERE cpf='001'").fetchone()[0]
+    motor._em_voo.add(id_001)
+
+    motor._renovar_leases()
+
+    with persistencia.leitura() as conn:
+        expira = dict(conn.execute("SELECT cpf, lease_expira FROM consultas WHERE lote_id='L1'").fetchall())
+    assert expira["001"] > time.time() and expira["002"] == vencido
+
+
+def test_lote_so_conclui_depois_do_reprocessamento(motor, persistencia, inserir):
+    inserir("L1", ["001"])
+    inserir("L1", ["002"], status="Reprocessando (1/3)")
+
+    motor.iniciar("L1")
+    time.sleep(0.5)
+
+    resumo = motor.resumo("L1")
+    assert resumo["estado"] == "executando"
+    assert (resumo["concluidos"], resumo["reprocessando"]) == (1, 1)
+
+    persistencia.escrever("UPDATE consultas SET status='Autorizado' WHERE cpf='002'").result()
+    assert _aguardar_estado(motor, "L1", "concluido")
+    assert motor.resumo("L1")["percentual"] == 100
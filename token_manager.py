@@ -0,0 +1,212 @@
+import logging
+import random
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+from metricas import registro
+
+log = logging.getLogger(__name__)
+
+VALIDADE_TOKEN = 59 * 60
+ANTECEDENCIA_RENOVACAO = 5 * 60
+LEASE_RENOVACAO = 30
+
+TOKEN_RENOVACOES = registro.contador(
+    "token_renovacoes_total", "Tokens gerados na Facta por este processo.", ("chave", "resultado")
+)
+TOKEN_REAPROVEITADOS = registro.contador(
+    "token_reaproveitados_total", "Tokens reaproveitados do banco, gerados por outro processo.", ("chave",)
+)
+
+
+class FalhaToken(requests.RequestException):
+    # Como erro de rede para quem consulta: o CPF vai para a fila de reprocessamento.
+    pass
+
+
+class CredencialRecusada(FalhaToken):
+    pass
+
+
+class GerenciadorToken:
+    def __init__(
+        self,
+        db_file,
+        cliente_http,
+        token_url,
+        auth_header,
+        chave="padrao",
+        validade=VALIDADE_TOKEN,
+        antecedencia=ANTECEDENCIA_RENOVACAO,
+    ):
+        self.db_file = db_file
+        self.cliente_http = cliente_http
+        self.token_url = token_url
+        self.auth_header = auth_header
+        self.chave = chave
+        self.validade = validade
+        self.antecedencia = antecedencia
+
+        self.token = None
+        self.expira_em = 0.0
+        self.renovacoes = 0
+        self.reaproveitados = 0
+
+        self._cond = threading.Condition()
+        self._renovando = False
+        self._ultimo_erro = None
+        self._parar = threading.Event()
+        self._thread = None
+
+    def _valido(self, minimo_restante=0):
+        return self.token is not None and self.expira_em - time.time() > minimo_restante
+
+    def obter(self):
+        token = self.token
+        if token is not None and self.expira_em > time.time():
+            return token
+        return self.renovar()
+
+    def renovar(self, token_invalido=None, minimo_restante=0):
+        with self._cond:
+            if self._valido(minimo_restante) and self.token != token_invalido:
+                return self.token
+            if self._renovando:
+                while self._renovando:
+                    self._cond.wait()
+                if self._valido() and self.token != token_invalido:
+                    return self.token
+                raise FalhaToken(f"Falha ao renovar token: {self._ultimo_erro}") from self._ultimo_erro
+            self._renovando = True
+
+        try:
+            token, expira_em = self._renovar_compartilhado(token_invalido, minimo_restante)
+            with self._cond:
+                self.token, self.expira_em = token, expira_em
+                self._ultimo_erro = None
+            return token
+        except Exception as e:
+            with self._cond:
+                self._ultimo_erro = e
+            if isinstance(e, FalhaToken):
+                raise
+            raise FalhaToken(f"Falha ao renovar token: {e}") from e
+        finally:
+            with self._cond:
+                self._renovando = False
+                self._cond.notify_all()
+
+    def _conectar(self):
+        return sqlite3.connect(self.db_file, timeout=10)
+
+    def _ler_compartilhado(self, conn):
+        row = conn.execute(
+            "SELECT token, expira_em, renovando_ate FROM tokens WHERE chave=?", (self.chave,)
+        ).fetchone()
+        return row or (None, 0.0, None)
+
+    def _renovar_compartilhado(self, token_invalido, minimo_restante):
+        conn = self._conectar()
+        try:
+            conn.execute("INSERT OR IGNORE INTO tokens (chave) VALUES (?)", (self.chave,))
+            conn.commit()
+            while True:
+                token, expira_em, _ = self._ler_compartilhado(conn)
+                if token and token != token_invalido and expira_em - time.time() > minimo_restante:
+                    self.reaproveitados += 1
+                    TOKEN_REAPROVEITADOS.inc(chave=self.chave)
+                    return token, expira_em
+
+                agora = time.time()
+                cur = conn.execute(
+                    """
+                    UPDATE tokens SET renovando_ate=?
+                    WHERE chave=? AND (renovando_ate IS NULL OR renovando_ate < ?)
+                    """,
+                    (agora + LEASE_RENOVACAO, self.chave, agora)
+                )
+                conn.commit()
+                if cur.rowcount == 1:
+                    break
+
+                # Outro processo está renovando: espera ele publicar o token novo.
+                time.sleep(0.2)
+
+            try:
+                token = self._gerar()
+            except Exception:
+                conn.execute("UPDATE tokens SET renovando_ate=NULL WHERE chave=?", (self.chave,))
+                conn.commit()
+                raise
+
+            expira_em = time.time() + self.validade
+            conn.execute(
+                """
+                UPDATE tokens SET token=?, expira_em=?, renovando_ate=NULL, atualizado_em=?
+                WHERE chave=?
+                """,
+                (token, expira_em, time.time(), self.chave)
+            )
+            conn.commit()
+            return token, expira_em
+        finally:
+            conn.close()
+
+    def _gerar(self):
+        try:
+            resp = self.cliente_http.get(
+                self.token_url,
+                headers={"Authorization": self.auth_header, "Accept": "application/json"},
+                timeout=10
+            )
+            if resp.status_code in (401, 403):
+                raise CredencialRecusada(f"Facta recusou a credencial (HTTP {resp.status_code})")
+            resp.raise_for_status()
+            data = resp.json()
+            novo_token = data.get("token")
+            if not novo_token:
+                raise CredencialRecusada(f"Não recebi token. Resposta: {resp.text}")
+            self.renovacoes += 1
+            TOKEN_RENOVACOES.inc(chave=self.chave, resultado="ok")
+            validade = datetime.fromtimestamp(time.time() + self.validade)
+            log.info("Token gerado", extra={"chave": self.chave, "valido_ate": validade.strftime("%H:%M:%S")})
+            return novo_token
+        except Exception as e:
+            TOKEN_RENOVACOES.inc(chave=self.chave, resultado="erro")
+            log.error("Erro ao gerar token", extra={"chave": self.chave, "erro": str(e)})
+            raise
+
+    def iniciar(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._renovar_em_segundo_plano, daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+
+    def _renovar_em_segundo_plano(self):
+        espera = 0
+        while not self._parar.wait(espera):
+            try:
+                self.renovar(minimo_restante=self.antecedencia)
+                restante = self.expira_em - time.time() - self.antecedencia
+                espera = max(1.0, restante) + random.uniform(0, 5)
+            except Exception as e:
+                log.warning("Erro na renovação automática do token", extra={"chave": self.chave, "erro": str(e)})
+                espera = 10
+
+    def estatisticas(self):
+        return {
+            "chave": self.chave,
+            "valido": self._valido(),
+            "expira_em": datetime.fromtimestamp(self.expira_em).strftime("%Y-%m-%d %H:%M:%S")
+            if self.token else None,
+            "renovacoes": self.renovacoes,
+            "reaproveitados": self.reaproveitados,
+        }
@@ -0,0 +1,5 @@
+# Entrada para o gunicorn: gunicorn -w 4 -k gthread --threads 16 wsgi:app
+# Sem --preload: as threads de fundo precisam subir em cada worker, depois do fork.
+from app import create_app
+
+app = create_app()